@@ -0,0 +1,635 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import os
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import struct
+import tempfile
+import time
+import tracemalloc
+import zlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from minetest_world import MinetestWorld
+from dwarftest_transformer import DwarftestTransformer
+from df_block_prefetcher import iter_df_block_positions
+from fake_dfhack_rpc import SyntheticDFMap, FakeDFHackRPC
+from voxel_volume import VoxelVolume
+import texture_baker
+from remote_fortress_reader import load_remote_fortress_reader, message_to_dict, get_block_list
+
+
+# complex_block_scale settings used by conversion benchmark
+BENCHMARK_SCALES = {
+    'tile': {'tile_x': 1, 'tile_y': 1, 'tile_z_floor': 0, 'tile_z_wall': 1},
+    'main': {'tile_x': 2, 'tile_y': 2, 'tile_z_floor': 1, 'tile_z_wall': 2},
+    'large': {'tile_x': 3, 'tile_y': 3, 'tile_z_floor': 1, 'tile_z_wall': 3},
+}
+
+BENCHMARKS = ['parse', 'build', 'compression', 'write', 'decode', 'material_mod', 'conversion']
+CONVERSION_STAGES = ['parse', 'complete', 'build_map_block', 'write_block', 'build_material_mod']
+CONVERSION_PIPELINES = ['blocks', 'volume']
+
+
+def make_test_blocks(count, palette_size=16, seed=0):
+    """
+    Generates map blocks with layered content, similar to converted underground/surface blocks.
+
+    :return: (list of node arrays with integer content ids, palette)
+    """
+    rng = np.random.RandomState(seed)
+    palette = ['air'] + ['dwarftest:material_{}'.format(i) for i in range(palette_size - 1)]
+
+    blocks = []
+    for _ in range(count):
+        layers = rng.randint(0, palette_size, size=16)
+        nodes = np.zeros((4096, ), dtype=MinetestWorld.BLOCK_NUMPY_DTYPE)
+        nodes['content_id'] = np.repeat(layers, 256)  # one material per MT y layer
+        noise = rng.randint(0, 4096, size=64)
+        nodes['content_id'][noise] = rng.randint(0, palette_size, size=noise.size)
+        blocks.append(nodes)
+
+    return blocks, palette
+
+
+def make_test_df_block_lists(pb2, synthetic_map, count):
+    """
+    :return: list of BlockList messages with one MapBlock each, blocks are taken from top of synthetic map
+    """
+    positions = [(x, y, z) for z in reversed(range(synthetic_map.block_size[2]))
+                 for x in range(synthetic_map.block_size[0]) for y in range(synthetic_map.block_size[1])]
+
+    block_lists = []
+    for x, y, z in positions[:count]:
+        block = synthetic_map.get_block(x, y, z)
+        block_list = pb2.BlockList()
+        message = block_list.map_blocks.add(map_x=block['mapX'], map_y=block['mapY'], map_z=block['mapZ'])
+        message.tiles.extend(block['tiles'])
+        for mat in block['materials']:
+            message.materials.add(mat_type=mat['matType'], mat_index=mat['matIndex'])
+        message.water.extend(block['water'])
+        message.magma.extend(block['magma'])
+        message.hidden.extend(block['hidden'])
+        block_lists.append(block_list)
+
+    return block_lists
+
+
+def make_test_material_list(count, seed=0):
+    """
+    :return: list of materials similar to tile material variants created by get_tile_material()
+    """
+    rng = np.random.RandomState(seed)
+    shapes = ['wall', 'wall', 'wall', 'stair', 'fortification', 'leaves', None]
+    node_materials = ['stone', 'soil', 'ice', 'wood', 'mushroom', 'grass', 'smooth', 'leaves', None]
+
+    material_list = []
+    for i in range(count):
+        shape = shapes[rng.randint(len(shapes))]
+        node_material = node_materials[rng.randint(len(node_materials))]
+        tile_mat_string = 'shape={};material={}'.format(shape, node_material)
+        material_list.append({
+            'name': 'Test material {} ({})'.format(i // 8, tile_mat_string),
+            'color': tuple(int(c) for c in rng.randint(0, 256, size=3)),
+            'df_id': 'INORGANIC:TEST_{}*{}'.format(i // 8, tile_mat_string),
+            'df_tuple': (0, i // 8, '{:040x}'.format(i)),
+            'mt_id': 'dwarftest:inorganic_test_{}__{:040x}'.format(i // 8, i),
+            'df_tile': {'shape': shape, 'special': 'NORMAL', 'material': node_material, 'variant': 'NO_VARIANT'},
+            'mt_node': {'shape': shape, 'material': node_material},
+        })
+
+    return material_list
+
+
+def load_lua_runtime():
+    """
+    :return: LuaRuntime class of lupa package (LuaJIT if available, like in Minetest), None if lupa is not installed
+    """
+    try:
+        import lupa.luajit21
+        return lupa.luajit21.LuaRuntime
+    except ImportError:
+        pass
+
+    try:
+        import lupa
+        return lupa.LuaRuntime
+    except ImportError:
+        return None
+
+
+def load_world_mod(lua_runtime, mod_path):
+    """
+    Runs init.lua of world mod with stub of Minetest API, minetest.parse_json is emulated in Python.
+
+    :return: number of registered nodes
+    """
+    lua = lua_runtime()
+    lua.execute('''
+        registered_nodes = 0
+        minetest = {
+            register_item = function() end,
+            register_node = function() registered_nodes = registered_nodes + 1 end,
+            register_alias = function() end,
+            log = function() end,
+        }
+    ''')
+    minetest = lua.globals().minetest
+    minetest.get_modpath = lambda name: mod_path
+    minetest.parse_json = lambda data: lua.table_from(json.loads(data), recursive=True)
+
+    lua.execute('dofile(...)', os.path.join(mod_path, 'init.lua'))
+    return lua.globals().registered_nodes
+
+
+def benchmark_material_mod(count):
+    """
+    Compares material list formats of world mod and texture baking, world load is measured only if lupa package
+    is installed.
+    """
+    lua_runtime = load_lua_runtime()
+    material_list = make_test_material_list(count)
+
+    with tempfile.TemporaryDirectory() as tmp_path:
+        mw = MinetestWorld(os.path.join(tmp_path, 'world'))
+        dt = DwarftestTransformer(mw)
+        dt.material_list.extend(material_list)
+        mod_path = os.path.join(mw.path, 'worldmods', 'dwarftest')
+
+        for material_list_format in DwarftestTransformer.MATERIAL_LIST_FORMATS:
+            start = time.perf_counter()
+            stats = dt.build_material_mod(material_list_format=material_list_format)
+            elapsed = time.perf_counter() - start
+            print('build_material_mod ({}): {} materials in {:.3f}s, {:.1f} KiB'.format(
+                material_list_format, stats['written'], elapsed, stats['file_bytes'] / 1024))
+
+            if lua_runtime is None:
+                continue
+
+            start = time.perf_counter()
+            registered = load_world_mod(lua_runtime, mod_path)
+            elapsed = time.perf_counter() - start
+            print('world mod load ({}): {} nodes registered in {:.3f}s'.format(
+                material_list_format, registered, elapsed))
+
+        # first build bakes all textures, second one finds them in cache
+        for build in (['first', 'cached'] if texture_baker.Image is not None else []):
+            start = time.perf_counter()
+            stats = dt.build_material_mod(bake_textures=True)
+            elapsed = time.perf_counter() - start
+            print('build_material_mod (baked textures, {}): {} materials in {:.3f}s, {textures} textures, '
+                  '{baked} baked, {cached} cached'.format(build, stats['written'], elapsed, **stats['textures']))
+
+        if lua_runtime is not None and texture_baker.Image is not None:
+            start = time.perf_counter()
+            registered = load_world_mod(lua_runtime, mod_path)
+            elapsed = time.perf_counter() - start
+            print('world mod load (baked textures): {} nodes registered in {:.3f}s'.format(registered, elapsed))
+
+        mw.close_sql_connections()
+
+    if lua_runtime is None:
+        print('world mod load: skipped, lupa package is not installed')
+    if texture_baker.Image is None:
+        print('build_material_mod (baked textures): skipped, Pillow package is not installed')
+
+
+def benchmark_parse_df_blocks(mw, count):
+    """
+    Compares parsing of GetBlockList results converted to dicts with parsing of protobuf messages.
+    """
+    pb2 = load_remote_fortress_reader()
+    if pb2 is None:
+        print('parse_df_blocks: skipped, protobuf or RemoteFortressReader_pb2 is not available')
+        return
+
+    synthetic_map = SyntheticDFMap(8, 8, 48)
+    block_lists = make_test_df_block_lists(pb2, synthetic_map, count)
+
+    variants = [
+        ('dict', lambda dt, block_list: dt.parse_df_blocks((0, 0, 0), message_to_dict(block_list)['mapBlocks'])),
+        ('message', lambda dt, block_list: dt.parse_df_blocks((0, 0, 0), block_list.map_blocks)),
+    ]
+
+    for name, parse in variants:
+        def run(trace=False):
+            dt = DwarftestTransformer(mw)
+            dt.load_df_tiletype_list(synthetic_map.tiletype_list)
+            dt.load_df_material_list(synthetic_map.material_list)
+
+            transient = 0  # memory allocated by parsing of one block list on top of memory kept by transformer
+            for block_list in block_lists:
+                if trace:
+                    current, _ = tracemalloc.get_traced_memory()
+                    tracemalloc.reset_peak()
+                parse(dt, block_list)
+                if trace:
+                    transient = max(transient, tracemalloc.get_traced_memory()[1] - current)
+            return transient
+
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+
+        # memory is measured in separate run, tracing slows down allocations
+        tracemalloc.start()
+        transient = run(trace=True)
+        tracemalloc.stop()
+
+        print('parse_df_blocks ({}): {} blocks in {:.3f}s, {:.1f} blocks/sec, {:.1f} KiB allocated per block'.format(
+            name, count, elapsed, count / elapsed, transient / 1024))
+
+
+def build_map_block_reference(nodes, palette):
+    """
+    Scalar encoder of map block version 28 without light, kept as reference of MinetestWorld.encode_map_block().
+
+    :param nodes: numpy array of length 4096 and dtype of MinetestWorld.BLOCK_NUMPY_DTYPE
+    :param palette: sequence of content names indexed by nodes['content_id']
+    :return: bytes
+    """
+    block = b''
+    block += struct.pack('>B', 28)  # u8 version
+    block += struct.pack('>B', 0b00000000)  # u8 flags
+    block += struct.pack('>H', 0b0000000000000000)  # u16 lighting_complete
+    block += struct.pack('>B', 2)  # u8 content_width
+    block += struct.pack('>B', 2)  # u8 params_width
+
+    num_name_id_mappings = {}
+    content_ids = []
+    for n in nodes:
+        name = palette[n['content_id']]
+        if name not in num_name_id_mappings:
+            num_name_id_mappings[name] = len(num_name_id_mappings)
+        content_ids.append(num_name_id_mappings[name])
+    num_name_id_mappings = [(num_name_id_mappings[name], name) for name in num_name_id_mappings]
+
+    node_data = [struct.pack('>H', content_id) for content_id in content_ids]
+    node_data += [struct.pack('>B', n['param1']) for n in nodes]
+    node_data += [struct.pack('>B', n['param2']) for n in nodes]
+    block += zlib.compress(b''.join(node_data))
+
+    block += zlib.compress(struct.pack('>I', 0))  # node metadata list without metadata
+    block += struct.pack('>B', 0)  # u8 static object version
+    block += struct.pack('>H', 0)  # u16 static_object_count
+    block += struct.pack('>I', 0xffffffff)  # u32 timestamp
+    block += struct.pack('>B', 0)  # u8 name-id-mapping version
+    block += struct.pack('>H', len(num_name_id_mappings))  # u16 num_name_id_mappings
+
+    for id, name in num_name_id_mappings:
+        block += struct.pack('>H', id) + struct.pack('>H', len(name)) + name.encode('ascii')
+
+    block += struct.pack('>B', 10)  # u8 length of the data of a single timer
+    block += struct.pack('>H', 0)  # u16 num_of_timers
+    return block
+
+
+def benchmark_build_map_block(mw, count, reference_count=50):
+    """
+    Checks that encoded blocks are byte-identical to scalar reference encoder, then compares speed of both.
+    """
+    blocks, palette = make_test_blocks(count)
+    for i, nodes in enumerate(blocks[:reference_count]):
+        nodes['param1'] = i
+        nodes['param2'] = np.arange(4096) % 24
+
+    reference = []
+    start = time.perf_counter()
+    for nodes in blocks[:reference_count]:
+        reference.append(build_map_block_reference(nodes, palette))
+    reference_elapsed = time.perf_counter() - start
+
+    for nodes, block in zip(blocks, reference):
+        if mw.encode_map_block(nodes, palette) != block:
+            raise Exception('build_map_block output differs from reference encoder')
+
+    start = time.perf_counter()
+    for nodes in blocks:
+        mw.build_map_block(nodes, palette)
+    elapsed = time.perf_counter() - start
+
+    print('build_map_block (reference): {} blocks in {:.3f}s, {:.1f} blocks/sec'.format(
+        len(reference), reference_elapsed, len(reference) / reference_elapsed))
+    print('build_map_block: {} blocks in {:.3f}s, {:.1f} blocks/sec, {:.0f}x faster than reference'.format(
+        count, elapsed, count / elapsed, count / elapsed / (len(reference) / reference_elapsed)))
+
+
+def benchmark_map_block_compression(count, levels=(1, 6, 9), workers=4):
+    """
+    Builds same blocks with every zlib level, in calling thread and by compression workers. Every run uses new
+    world with empty block cache, so that all blocks are compressed.
+    """
+    blocks, palette = make_test_blocks(count)
+
+    with tempfile.TemporaryDirectory() as tmp_path:
+        for level in levels:
+            for level_workers in (0, workers):
+                mw = MinetestWorld(tmp_path, allow_overwrite=True, compression_level=level,
+                                   compression_workers=level_workers)
+                content_ids = np.array([mw.content_registry.get_id(name) for name in palette], dtype=np.uint16)
+                registered = []
+                for nodes in blocks:
+                    nodes = nodes.copy()
+                    nodes['content_id'] = content_ids[nodes['content_id']]
+                    registered.append((nodes, 0))
+
+                start = time.perf_counter()
+                data = mw.build_map_blocks(registered)
+                elapsed = time.perf_counter() - start
+                mw.close_sql_connections()
+
+                size = sum(len(block) for block in data)
+                print('build_map_blocks (level {}, {} workers): {} blocks in {:.3f}s, {:.1f} blocks/sec, '
+                      '{:.1f} KiB per block'.format(level, level_workers, count, elapsed, count / elapsed,
+                                                    size / count / 1024))
+
+
+def benchmark_write_blocks(mw, count):
+    blocks, palette = make_test_blocks(min(count, 100))
+    data = [mw.build_map_block(nodes, palette) for nodes in blocks]
+    rows = [(i % 64, i // 64 % 64, i // 4096, data[i % len(data)]) for i in range(count)]
+
+    start = time.perf_counter()
+    for x, y, z, block in rows:
+        mw.write_block(x, y, z, block)
+    mw.commit_sql_connections()
+    elapsed = time.perf_counter() - start
+    print('write_block: {} blocks in {:.3f}s, {:.1f} rows/sec'.format(count, elapsed, count / elapsed))
+
+    start = time.perf_counter()
+    mw.write_blocks(rows)
+    elapsed = time.perf_counter() - start
+    print('write_blocks: {} blocks in {:.3f}s, {:.1f} rows/sec'.format(count, elapsed, count / elapsed))
+
+
+def benchmark_decode_map_block(mw, count):
+    """
+    Checks that decoded blocks equal encoded nodes, then measures decoding and reading of blocks by bounding box.
+    """
+    blocks, palette = make_test_blocks(min(count, 100))
+    for i, nodes in enumerate(blocks):
+        nodes['param1'] = i
+        nodes['param2'] = np.arange(4096) % 24
+    data = [mw.build_map_block(nodes, palette) for nodes in blocks]
+
+    for nodes, block in zip(blocks, data):
+        decoded, names = mw.decode_map_block(block)
+        if not (np.array(names, dtype=object)[decoded['content_id']] ==
+                np.array(palette, dtype=object)[nodes['content_id']]).all():
+            raise Exception('Decoded content names differ from encoded nodes')
+        if not (decoded[['param1', 'param2']] == nodes[['param1', 'param2']]).all():
+            raise Exception('Decoded params differ from encoded nodes')
+
+    start = time.perf_counter()
+    for i in range(count):
+        mw.decode_map_block(data[i % len(data)])
+    elapsed = time.perf_counter() - start
+    print('decode_map_block: {} blocks in {:.3f}s, {:.1f} blocks/sec'.format(count, elapsed, count / elapsed))
+
+    # cube of blocks around 0,0,0 with negative positions
+    size = max(2, int(round(count ** (1 / 3))))
+    positions = [(x, y, z) for x in range(-size // 2, size - size // 2) for y in range(-size // 2, size - size // 2)
+                 for z in range(-size // 2, size - size // 2)]
+    mw.write_blocks((x, y, z, data[i % len(data)]) for i, (x, y, z) in enumerate(positions))
+    bbox = (positions[0], positions[-1])
+
+    start = time.perf_counter()
+    for x, y, z in positions:
+        mw.read_block_data(x, y, z)
+    elapsed = time.perf_counter() - start
+    print('read_block_data: {} blocks in {:.3f}s, {:.1f} blocks/sec'.format(
+        len(positions), elapsed, len(positions) / elapsed))
+
+    start = time.perf_counter()
+    read = [pos for pos, _ in mw.iter_block_data(bbox)]
+    elapsed = time.perf_counter() - start
+    if sorted(read) != sorted(positions):
+        raise Exception('iter_block_data returned different block positions')
+    print('iter_block_data: {} blocks in {:.3f}s, {:.1f} blocks/sec'.format(len(read), elapsed, len(read) / elapsed))
+
+    start = time.perf_counter()
+    decoded = sum(1 for _ in mw.iter_blocks(bbox))
+    elapsed = time.perf_counter() - start
+    print('iter_blocks: {} blocks in {:.3f}s, {:.1f} blocks/sec'.format(decoded, elapsed, decoded / elapsed))
+
+
+def timed(fnc, stats, stage):
+    """
+    :return: function that adds run time of fnc to stats[stage]
+    """
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fnc(*args, **kwargs)
+        finally:
+            stats[stage] += time.perf_counter() - start
+    return wrapper
+
+
+def run_conversion(scale_name, embark, pipeline='blocks', seed=0, compression_workers=0):
+    """
+    Converts synthetic embark same way as main.py and measures every stage separately. Generation of DF blocks
+    is not included in stage times. Should run in its own process, peak RSS is measured for whole process.
+
+    :param embark: (block_size_x, block_size_y, block_size_z)
+    :param pipeline: 'blocks' sets nodes of MT blocks directly, 'volume' writes DF blocks into VoxelVolume and
+        emits MT blocks from it (like --voxel_volume of main.py)
+    :param compression_workers: see MinetestWorld
+    :return: dict with results
+    """
+    synthetic_map = SyntheticDFMap(*embark, seed=seed)
+    rpc = FakeDFHackRPC(synthetic_map)
+    stats = {stage: 0.0 for stage in CONVERSION_STAGES}
+    df_tiles = 0
+
+    with tempfile.TemporaryDirectory() as tmp_path:
+        mw = MinetestWorld(os.path.join(tmp_path, 'world'),
+                           map_sqlite_pragmas=MinetestWorld.CONVERSION_MAP_SQLITE_PRAGMAS,
+                           compression_workers=compression_workers)
+        dt = DwarftestTransformer(mw, complex_block_scale=BENCHMARK_SCALES[scale_name])
+        dt.load_df_material_list(rpc.call_method_dict('GetMaterialList')[0]['materialList'])
+        dt.load_df_tiletype_list(rpc.call_method_dict('GetTiletypeList')[0]['tiletypeList'])
+
+        mw.build_map_blocks = timed(mw.build_map_blocks, stats, 'build_map_block')
+        mw.write_blocks = timed(mw.write_blocks, stats, 'write_block')
+        mw.commit_sql_connections = timed(mw.commit_sql_connections, stats, 'write_block')
+
+        if pipeline == 'volume':
+            dt.set_voxel_volume(VoxelVolume.create(mw.path, dt.coordinates, (0, 0, 0), embark))
+        else:
+            dt.set_df_scan_order((0, 0, 0), embark[0], embark[1])
+
+        for x, y, z in iter_df_block_positions(*embark):
+            block_list = get_block_list(rpc, x, x + 1, y, y + 1, z, z + 1, request_message=True)
+            df_tiles += len(block_list.map_blocks) * SyntheticDFMap.BLOCK_TILE_SIZE**2
+
+            start = time.perf_counter()
+            dt.parse_df_blocks((0, 0, 0), block_list.map_blocks)
+            stats['parse'] += time.perf_counter() - start
+
+            if pipeline == 'blocks' and z == embark[2] - 1:
+                start = time.perf_counter()
+                dt.evict_mt_blocks(x, y)
+                stats['complete'] += time.perf_counter() - start
+                dt.dump_mt_blocks()
+
+        if pipeline == 'volume':
+            # slicing of volume is counted as completion, serialization and writes have their own stages
+            serialization = stats['build_map_block'] + stats['write_block']
+            start = time.perf_counter()
+            dt.dump_voxel_volume()
+            stats['complete'] += time.perf_counter() - start - \
+                (stats['build_map_block'] + stats['write_block'] - serialization)
+            dt.voxel_volume.close()
+        else:
+            start = time.perf_counter()
+            dt.complete_mt_blocks()
+            stats['complete'] += time.perf_counter() - start
+            dt.dump_mt_blocks()
+
+        start = time.perf_counter()
+        dt.build_material_mod()
+        stats['build_material_mod'] += time.perf_counter() - start
+
+        mw.close_sql_connections()
+
+    mt_blocks = mw.map_write_stats['rows']
+    total = sum(stats.values())
+    serialization = stats['build_map_block'] + stats['write_block']
+
+    return {
+        'scale': scale_name,
+        'pipeline': pipeline,
+        'complex_block_scale': BENCHMARK_SCALES[scale_name],
+        'embark': list(embark),
+        'df_tiles': df_tiles,
+        'mt_blocks': mt_blocks,
+        'materials': len(dt.material_list),
+        'stage_seconds': stats,
+        'total_seconds': total,
+        'tiles_per_sec': df_tiles / total if total else 0.0,
+        'parse_tiles_per_sec': df_tiles / stats['parse'] if stats['parse'] else 0.0,
+        'blocks_per_sec': mt_blocks / total if total else 0.0,
+        'serialize_blocks_per_sec': mt_blocks / serialization if serialization else 0.0,
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,  # ru_maxrss is in KiB
+        'map_block_cache_hit_rate': mw.get_map_block_cache_hit_rate(),
+        'map_block_compression': mw.get_map_block_compression_stats(),
+    }
+
+
+def benchmark_conversion(scale_names, embark, pipelines=('blocks', ), compression_workers=0):
+    """
+    :return: list of results of run_conversion()
+    """
+    results = []
+    for scale_name in scale_names:
+        for pipeline in pipelines:
+            # fresh process for every run, so that peak RSS is not shared
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(run_conversion, scale_name, embark, pipeline,
+                                         compression_workers=compression_workers).result()
+            results.append(result)
+
+            print('conversion ({}, {}): {} DF tiles -> {} MT blocks in {:.3f}s, {:.0f} tiles/sec, {:.1f} blocks/sec, '
+                  'peak RSS {:.1f} MiB'.format(scale_name, pipeline, result['df_tiles'], result['mt_blocks'],
+                                               result['total_seconds'], result['tiles_per_sec'],
+                                               result['blocks_per_sec'], result['peak_rss_bytes'] / 1024**2))
+            print('    ' + ', '.join('{}={:.3f}s'.format(stage, result['stage_seconds'][stage])
+                                     for stage in CONVERSION_STAGES))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Dwarftest benchmarks'
+    )
+    parser.add_argument(
+        'benchmarks',
+        nargs='*', metavar='BENCHMARK', help='Benchmarks to run: {}, default is all'.format(', '.join(BENCHMARKS))
+    )
+    parser.add_argument(
+        '--blocks',
+        type=int, default=2000, help='Number of map blocks, default is 2000'
+    )
+    parser.add_argument(
+        '--materials',
+        type=int, default=20000, help='Number of materials of material_mod benchmark, default is 20000'
+    )
+    parser.add_argument(
+        '--embark',
+        default='4,4,48', help='Size of synthetic embark used by conversion benchmark in DF blocks (X,Y,Z). '
+                               'Default is 4,4,48'
+    )
+    parser.add_argument(
+        '--scales',
+        default=','.join(BENCHMARK_SCALES.keys()),
+        help='complex_block_scale settings used by conversion benchmark, from: {}'.format(
+            ', '.join(BENCHMARK_SCALES.keys()))
+    )
+    parser.add_argument(
+        '--pipelines',
+        default='blocks',
+        help='Conversion pipelines compared by conversion benchmark, from: {}. Default is blocks'.format(
+            ', '.join(CONVERSION_PIPELINES))
+    )
+    parser.add_argument(
+        '--compression_workers',
+        type=int, default=4, help='Number of threads compressing map blocks in compression and conversion '
+                                  'benchmarks, default is 4'
+    )
+    parser.add_argument(
+        '--output',
+        help='Write results of conversion benchmark into JSON file'
+    )
+    args = parser.parse_args()
+    benchmarks = args.benchmarks or BENCHMARKS
+
+    for name in benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('Unknown benchmark {}'.format(name))
+
+    with tempfile.TemporaryDirectory() as tmp_path:
+        mw = MinetestWorld(
+            tmp_path, allow_overwrite=True, map_sqlite_pragmas=MinetestWorld.CONVERSION_MAP_SQLITE_PRAGMAS)
+        if 'parse' in benchmarks:
+            benchmark_parse_df_blocks(mw, args.blocks // 4)
+        if 'build' in benchmarks:
+            benchmark_build_map_block(mw, args.blocks)
+        if 'compression' in benchmarks:
+            benchmark_map_block_compression(args.blocks, workers=args.compression_workers)
+        if 'write' in benchmarks:
+            benchmark_write_blocks(mw, args.blocks * 10)
+        if 'decode' in benchmarks:
+            benchmark_decode_map_block(mw, args.blocks)
+        mw.close_sql_connections()
+
+    if 'material_mod' in benchmarks:
+        benchmark_material_mod(args.materials)
+
+    if 'conversion' in benchmarks:
+        embark = tuple(int(v) for v in args.embark.split(','))
+        pipelines = args.pipelines.split(',')
+        for pipeline in pipelines:
+            if pipeline not in CONVERSION_PIPELINES:
+                parser.error('Unknown conversion pipeline {}'.format(pipeline))
+        results = benchmark_conversion(args.scales.split(','), embark, pipelines, args.compression_workers)
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'python': platform.python_version(),
+                    'numpy': np.__version__,
+                    'machine': platform.machine(),
+                    'results': results,
+                }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import os
+import json
+import sqlite3
+import logging
+
+from minetest_world import get_block_as_integer
+
+_logger = logging.getLogger(__name__)
+
+
+class ConversionManifest(object):
+    """
+    Record of converted DF blocks kept in world directory, used for incremental re-conversion and resuming
+    of interrupted conversion.
+
+    DF block (requested position of GetBlockList) is recorded with digest of its content only after all MT
+    blocks it contributed to were written, MT blocks are recorded in same transaction. MT block that is
+    recorded is therefore always in map database (or was skipped as air block).
+    """
+    FILENAME = 'dwarftest_manifest.sqlite'
+
+    def __init__(self, world_path):
+        self.path = os.path.join(world_path, self.FILENAME)
+        db_exists = os.path.exists(self.path)
+
+        self.sqlite_connection = sqlite3.connect(self.path)
+        self.sqlite_cursor = self.sqlite_connection.cursor()
+
+        if not db_exists:
+            self.sqlite_cursor.execute('''
+            CREATE TABLE `config` (
+              `name` TEXT NOT NULL PRIMARY KEY,
+              `value` TEXT
+            );
+            ''')
+            self.sqlite_cursor.execute('''
+            CREATE TABLE `df_blocks` (
+              `x` INT NOT NULL,
+              `y` INT NOT NULL,
+              `z` INT NOT NULL,
+              `digest` BLOB NOT NULL,
+              `mt_blocks` TEXT NOT NULL,
+              PRIMARY KEY (x, y, z)
+            );
+            ''')
+            self.sqlite_cursor.execute('''
+            CREATE TABLE `mt_blocks` (`pos` INT NOT NULL PRIMARY KEY);
+            ''')
+            self.sqlite_connection.commit()
+
+        self.digests = {
+            (x, y, z): digest
+            for x, y, z, digest in self.sqlite_cursor.execute('SELECT x, y, z, digest FROM df_blocks')
+        }
+        self.mt_blocks = {pos for pos, in self.sqlite_cursor.execute('SELECT pos FROM mt_blocks')}
+
+    def commit(self):
+        self.sqlite_connection.commit()
+
+    def close(self):
+        self.commit()
+        self.sqlite_connection.close()
+
+    def check_config(self, config):
+        """
+        Manifest is cleared if conversion config changed, because recorded blocks would be converted differently.
+
+        :param config: JSON serializable dict (block scale, offsets, ...)
+        :return: True if manifest was kept
+        """
+        value = json.dumps(config, sort_keys=True)
+        row = self.sqlite_cursor.execute('SELECT value FROM config WHERE name=?', ('conversion', )).fetchone()
+        if row is not None and row[0] == value:
+            return True
+
+        if row is not None:
+            _logger.warning('Conversion config changed, all DF blocks will be converted again')
+
+        self.sqlite_cursor.execute('DELETE FROM df_blocks')
+        self.sqlite_cursor.execute('DELETE FROM mt_blocks')
+        self.sqlite_cursor.execute('INSERT OR REPLACE INTO config(name, value) VALUES(?,?)', ('conversion', value))
+        self.commit()
+        self.digests = {}
+        self.mt_blocks = set()
+        return row is None
+
+    def get_digest(self, x, y, z):
+        """
+        :return: digest of recorded DF block or None
+        """
+        return self.digests.get((x, y, z))
+
+    def has_mt_block(self, x, y, z):
+        return get_block_as_integer(x, y, z) in self.mt_blocks
+
+    def add_mt_blocks(self, mt_block_positions):
+        rows = [(get_block_as_integer(*pos), ) for pos in mt_block_positions]
+        self.sqlite_cursor.executemany('INSERT OR IGNORE INTO mt_blocks(pos) VALUES(?)', rows)
+        self.mt_blocks.update(pos for pos, in rows)
+
+    def set_df_block(self, x, y, z, digest, mt_block_positions):
+        """
+        :param mt_block_positions: list of MT block positions DF block contributed to
+        """
+        self.sqlite_cursor.execute(
+            'INSERT OR REPLACE INTO df_blocks(x, y, z, digest, mt_blocks) VALUES(?,?,?,?,?)',
+            (x, y, z, digest, json.dumps([list(pos) for pos in mt_block_positions]))
+        )
+        self.digests[(x, y, z)] = digest
+
+    def __len__(self):
+        return len(self.digests)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import numpy as np
+
+
+class CoordinateMapper(object):
+    """
+    Converts DF tile positions into MT node and MT block positions with array operations. All divisions are
+    floor divisions, negative positions belong to negative MT blocks.
+
+    MT positions are (X, Y, Z), MT Y is DF z. Node boxes are indexed by [MT z, MT y, MT x] like MT blocks.
+    """
+
+    def __init__(self, df_region_offset, block_scale, df_region_tile_size=(48, 48, 1), df_block_tile_size=(16, 16),
+                 mt_block_node_size=(16, 16, 16)):
+        """
+        :param block_scale: size of DF tile in MT nodes along DF x, y and z
+        """
+        self.df_region_offset = np.array(df_region_offset, dtype=np.int64)
+        self.block_scale = np.array(block_scale, dtype=np.int64)
+        self.df_region_tile_size = np.array(df_region_tile_size, dtype=np.int64)
+        self.df_block_tile_size = tuple(df_block_tile_size)
+        self.mt_block_node_size = np.array(mt_block_node_size, dtype=np.int64)
+
+        # size of one DF block level in MT nodes (x, y, z)
+        self.df_block_box_size = (
+            self.df_block_tile_size[0] * int(self.block_scale[0]),
+            int(self.block_scale[2]),
+            self.df_block_tile_size[1] * int(self.block_scale[1]),
+        )
+
+        self.box_templates = {}  # key: (box size, position of first node inside its MT block)
+
+    def df2mt_pos(self, region_pos, tile_pos):
+        """
+        :param region_pos: (x, y, z) of DF region
+        :param tile_pos: (x, y, z) or array of shape (..., 3), DF tile positions relative to region
+        :return: numpy int64 array of MT node positions (x, y, z) with shape of tile_pos
+        """
+        tile_pos = np.asarray(tile_pos, dtype=np.int64)
+
+        # apply region offset, absolute DF tile position
+        df_pos = (np.asarray(region_pos, dtype=np.int64) - self.df_region_offset) * self.df_region_tile_size + tile_pos
+
+        # NOTE: MT pos is (X, Z, Y)
+        return (df_pos * self.block_scale)[..., [0, 2, 1]]
+
+    def mt2mt_block_pos(self, mt_pos):
+        """
+        :param mt_pos: (x, y, z) or array of shape (..., 3), MT node positions
+        :return: (MT block positions, node positions inside MT blocks, node indexes inside MT blocks)
+        """
+        mt_pos = np.asarray(mt_pos, dtype=np.int64)
+        bs = self.mt_block_node_size
+
+        mt_block_pos = mt_pos // bs
+        node_pos = mt_pos - mt_block_pos * bs
+        node_index = node_pos[..., 0] + node_pos[..., 1] * bs[0] + node_pos[..., 2] * bs[0] * bs[1]
+
+        return mt_block_pos, node_pos, node_index
+
+    def get_box_template(self, box_size, first_node_pos):
+        """
+        Layout of box of nodes in MT blocks. It is same for all boxes of same size starting at same position inside
+        MT block, e.g. for all DF blocks on same z level.
+
+        :param box_size: (x, y, z) size of box in nodes
+        :param first_node_pos: (x, y, z) position of first node of box inside its MT block
+        :return: dict:
+            'blocks': list of (block offset, dst slices, src slices) for every MT block intersecting box, block
+                offset is relative to MT block of first node, slices select nodes in MT block and in box
+            'node_block_offsets': array of shape (size_z, size_y, size_x, 3), block offsets of box nodes
+            'node_indexes': array of shape (size_z, size_y, size_x), indexes of box nodes inside their MT blocks
+        """
+        key = (tuple(box_size), tuple(first_node_pos))
+        template = self.box_templates.get(key)
+        if template is not None:
+            return template
+
+        bs = [int(v) for v in self.mt_block_node_size]
+        last_offset = [(first_node_pos[i] + box_size[i] - 1) // bs[i] for i in range(3)]
+
+        blocks = []
+        for ox in range(last_offset[0] + 1):
+            for oy in range(last_offset[1] + 1):
+                for oz in range(last_offset[2] + 1):
+                    offset = (ox, oy, oz)
+
+                    # intersection of box and block in node positions relative to MT block of first node
+                    lo = [max(first_node_pos[i], offset[i] * bs[i]) for i in range(3)]
+                    hi = [min(first_node_pos[i] + box_size[i], (offset[i] + 1) * bs[i]) for i in range(3)]
+
+                    dst = tuple(slice(lo[i] - offset[i] * bs[i], hi[i] - offset[i] * bs[i]) for i in (2, 1, 0))
+                    src = tuple(slice(lo[i] - first_node_pos[i], hi[i] - first_node_pos[i]) for i in (2, 1, 0))
+                    blocks.append((offset, dst, src))
+
+        z, y, x = np.meshgrid(np.arange(box_size[2]), np.arange(box_size[1]), np.arange(box_size[0]), indexing='ij')
+        node_block_offsets, _, node_indexes = self.mt2mt_block_pos(np.stack([x, y, z], axis=-1) + first_node_pos)
+
+        template = self.box_templates[key] = {
+            'blocks': blocks,
+            'node_block_offsets': node_block_offsets,
+            'node_indexes': node_indexes,
+        }
+        return template
+
+    def get_mt_box_template(self, mt_pos, box_size):
+        """
+        :param mt_pos: (x, y, z) MT position of first node of box
+        :return: (MT block position of first node, template from get_box_template())
+        """
+        mt_block_pos, node_pos, _ = self.mt2mt_block_pos(mt_pos)
+        return (
+            tuple(int(v) for v in mt_block_pos),
+            self.get_box_template(tuple(box_size), tuple(int(v) for v in node_pos)),
+        )
+
+    def get_df_block_mt_block_positions(self, region_pos, map_pos):
+        """
+        :return: list of MT block positions with nodes of DF block
+        """
+        mt_block_pos, template = self.get_mt_box_template(self.df2mt_pos(region_pos, map_pos), self.df_block_box_size)
+        return [(mt_block_pos[0] + offset[0], mt_block_pos[1] + offset[1], mt_block_pos[2] + offset[2])
+                for offset, _, _ in template['blocks']]
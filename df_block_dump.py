@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import os
+import argparse
+import json
+import sqlite3
+import zlib
+import numpy as np
+
+
+class DFBlockDump(object):
+    """
+    Single file dump of DF blocks returned by GetBlockList, indexed by requested DF block position (x, y, z).
+
+    Per tile values are stored as zlib-compressed typed arrays. Materials are dictionary encoded, dictionary
+    is shared by all blocks in dump.
+    """
+    TILE_COUNT = 16 * 16
+
+    # name, numpy dtype
+    COLUMNS = [
+        ('tiles', np.dtype('<u2')),
+        ('materials', np.dtype('<u2')),
+        ('water', np.dtype('u1')),
+        ('magma', np.dtype('u1')),
+        ('hidden', np.dtype('u1')),
+    ]
+
+    COMMIT_INTERVAL = 256
+    MMAP_SIZE = 256 * 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        db_exists = os.path.exists(path)
+
+        # dump is written by prefetch thread
+        self.sqlite_connection = sqlite3.connect(path, check_same_thread=False)
+        self.sqlite_cursor = self.sqlite_connection.cursor()
+        self.sqlite_cursor.execute('PRAGMA mmap_size={}'.format(self.MMAP_SIZE))
+        self.uncommitted_count = 0
+
+        if not db_exists:
+            self.sqlite_cursor.execute('''
+            CREATE TABLE `block_lists` (
+              `x` INT NOT NULL,
+              `y` INT NOT NULL,
+              `z` INT NOT NULL,
+              `block_count` INT NOT NULL,
+              PRIMARY KEY (x, y, z)
+            );
+            ''')
+            self.sqlite_cursor.execute('''
+            CREATE TABLE `blocks` (
+              `x` INT NOT NULL,
+              `y` INT NOT NULL,
+              `z` INT NOT NULL,
+              `idx` INT NOT NULL,
+              `map_x` INT NOT NULL,
+              `map_y` INT NOT NULL,
+              `map_z` INT NOT NULL,
+              {},
+              PRIMARY KEY (x, y, z, idx)
+            );
+            '''.format(',\n'.join('`{}` BLOB'.format(name) for name, _ in self.COLUMNS)))
+            self.sqlite_cursor.execute('''
+            CREATE TABLE `materials` (
+              `id` INTEGER PRIMARY KEY,
+              `mat_type` INT,
+              `mat_index` INT
+            );
+            ''')
+            self.sqlite_connection.commit()
+
+        # material dictionary, index: material id
+
+        self.material_list = self.sqlite_cursor.execute(
+            'SELECT mat_type, mat_index FROM materials ORDER BY id').fetchall()
+        self.material_ids = {mat: i for i, mat in enumerate(self.material_list)}
+        self.material_array = np.array(self.material_list, dtype=np.int32).reshape(-1, 2)
+
+    def commit(self):
+        self.sqlite_connection.commit()
+        self.uncommitted_count = 0
+
+    def close(self):
+        self.commit()
+        self.sqlite_connection.close()
+
+    # Materials
+
+    def encode_materials(self, materials):
+        """
+        :param materials: list of (mat_type, mat_index)
+        :return: numpy array of material ids
+        """
+        ids = np.zeros((len(materials), ), dtype=np.uint16)
+        for i, mat in enumerate(materials):
+            mat_id = self.material_ids.get(mat)
+            if mat_id is None:
+                mat_id = len(self.material_list)
+                self.sqlite_cursor.execute(
+                    'INSERT INTO materials(id, mat_type, mat_index) VALUES(?,?,?)', (mat_id, mat[0], mat[1]))
+                self.material_list.append(mat)
+                self.material_ids[mat] = mat_id
+                self.material_array = None
+            ids[i] = mat_id
+        return ids
+
+    def decode_materials(self, ids):
+        """
+        :return: numpy array of (mat_type, mat_index) with shape (len(ids), 2)
+        """
+        if self.material_array is None:
+            self.material_array = np.array(self.material_list, dtype=np.int32).reshape(-1, 2)
+        return self.material_array[ids]
+
+    # Blocks
+
+    def get_block_values(self, block):
+        """
+        :param block: MapBlock dict or MapBlock protobuf message
+        :return: (map position, dict of per tile values, materials as list of (mat_type, mat_index))
+        """
+        if isinstance(block, dict):
+            map_pos = (block['mapX'], block['mapY'], block['mapZ'])
+            materials = [(m['matType'], m['matIndex']) for m in block['materials']]
+            values = {
+                'tiles': block['tiles'],
+                'water': block['water'],
+                'magma': block['magma'],
+                'hidden': block.get('hidden', [False] * self.TILE_COUNT),
+            }
+        else:
+            map_pos = (block.map_x, block.map_y, block.map_z)
+            materials = [(m.mat_type, m.mat_index) for m in block.materials]
+            values = {
+                'tiles': list(block.tiles),
+                'water': list(block.water),
+                'magma': list(block.magma),
+                'hidden': list(block.hidden) or [False] * self.TILE_COUNT,
+            }
+        return map_pos, values, materials
+
+    def write_block_list(self, x, y, z, block_list):
+        """
+        :param x, y, z: requested DF block position
+        :param block_list: BlockList dict or BlockList protobuf message returned by GetBlockList
+        """
+        self.sqlite_cursor.execute('DELETE FROM blocks WHERE x=? AND y=? AND z=?', (x, y, z))
+
+        blocks = block_list.get('mapBlocks', []) if isinstance(block_list, dict) else block_list.map_blocks
+        for idx, block in enumerate(blocks):
+            map_pos, values, materials = self.get_block_values(block)
+            if len(materials) != self.TILE_COUNT:
+                raise Exception(
+                    'List of block materials has invalid length! Try to restart Dwarf Fortress.'
+                )
+
+            values['materials'] = self.encode_materials(materials)
+            columns = [zlib.compress(np.asarray(values[name]).astype(dtype).tobytes()) for name, dtype in self.COLUMNS]
+
+            self.sqlite_cursor.execute(
+                'INSERT INTO blocks VALUES({})'.format(','.join(['?'] * (7 + len(columns)))),
+                [x, y, z, idx] + list(map_pos) + columns
+            )
+
+        self.sqlite_cursor.execute(
+            'INSERT OR REPLACE INTO block_lists(x, y, z, block_count) VALUES(?,?,?,?)', (x, y, z, len(blocks)))
+
+        self.uncommitted_count += 1
+        if self.uncommitted_count >= self.COMMIT_INTERVAL:
+            self.commit()
+
+    def read_block_list(self, x, y, z):
+        """
+        Tile values of returned blocks are numpy arrays, materials are array of (mat_type, mat_index).
+
+        :return: {'mapBlocks': [block, ...]}
+        """
+        row = self.sqlite_cursor.execute(
+            'SELECT block_count FROM block_lists WHERE x=? AND y=? AND z=?', (x, y, z)).fetchone()
+        if row is None:
+            raise KeyError('DF block {} is not in dump'.format((x, y, z)))
+
+        rows = self.sqlite_cursor.execute(
+            'SELECT map_x, map_y, map_z, {} FROM blocks WHERE x=? AND y=? AND z=? ORDER BY idx'.format(
+                ', '.join(name for name, _ in self.COLUMNS)), (x, y, z)
+        ).fetchall()
+
+        blocks = []
+        for row in rows:
+            block = {'mapX': row[0], 'mapY': row[1], 'mapZ': row[2]}
+            for (name, dtype), data in zip(self.COLUMNS, row[3:]):
+                block[name] = np.frombuffer(zlib.decompress(data), dtype=dtype)
+            block['materials'] = self.decode_materials(block['materials'])
+            block['hidden'] = block['hidden'].astype(bool)
+            blocks.append(block)
+
+        return {'mapBlocks': blocks}
+
+    def has_block_list(self, x, y, z):
+        row = self.sqlite_cursor.execute(
+            'SELECT 1 FROM block_lists WHERE x=? AND y=? AND z=?', (x, y, z)).fetchone()
+        return row is not None
+
+
+def convert_json_dump(json_path, dump_path):
+    """
+    Converts directory with {x}_{y}_{z}.json files created by old --save_dump into DFBlockDump file.
+
+    :return: number of converted files
+    """
+    dump = DFBlockDump(dump_path)
+    count = 0
+
+    for filename in sorted(os.listdir(json_path)):
+        name, ext = os.path.splitext(filename)
+        if ext != '.json':
+            continue
+        x, y, z = [int(v) for v in name.split('_')]
+
+        with open(os.path.join(json_path, filename), 'r') as f:
+            dump.write_block_list(x, y, z, json.loads(f.read()))
+        count += 1
+
+    dump.close()
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert JSON block dump directory into single file block dump'
+    )
+    parser.add_argument(
+        '--json_path',
+        default='./dump/blocks',
+    )
+    parser.add_argument(
+        '--dump_path',
+        default='./dump/blocks.sqlite',
+    )
+    args = parser.parse_args()
+
+    print('Converted {} files'.format(convert_json_dump(args.json_path, args.dump_path)))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import logging
+import queue
+import threading
+
+_logger = logging.getLogger(__name__)
+
+
+def iter_df_block_positions(block_size_x, block_size_y, block_size_z):
+    """
+    Scan order of DF blocks used by conversion. Z is the innermost axis, so every (x, y) column is finished
+    before next one starts.
+
+    :return: generator of (x, y, z)
+    """
+    for x in range(block_size_x):
+        for y in range(block_size_y):
+            for z in range(block_size_z):
+                yield x, y, z
+
+
+class DFBlockPrefetcher(object):
+    """
+    Loads DF blocks in background thread, so that waiting for DFHack (or disk) overlaps with conversion
+    of already loaded blocks. Blocks are loaded one by one by single thread and returned in the order of positions.
+    """
+    _END = object()
+
+    def __init__(self, load_block, positions, queue_size=8):
+        """
+        :param load_block: function(x, y, z) that returns loaded block data
+        :param positions: iterable of (x, y, z) in order of loading
+        :param queue_size: max number of loaded blocks waiting for processing, 0 disables background loading
+        """
+        self.load_block = load_block
+        self.positions = positions
+        self.queue_size = queue_size
+
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def __iter__(self):
+        """
+        :return: generator of ((x, y, z), block data)
+        """
+        if self.queue_size <= 0:
+            for pos in self.positions:
+                yield pos, self.load_block(*pos)
+            return
+
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._thread = threading.Thread(target=self._run, name='DFBlockPrefetcher', daemon=True)
+        self._thread.start()
+
+        try:
+            while True:
+                item = self._queue.get()
+                if item is self._END:
+                    break
+                pos, data, exc = item
+                if exc is not None:
+                    raise exc
+                yield pos, data
+        finally:
+            self.close()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            for pos in self.positions:
+                if self._stop.is_set():
+                    return
+                if not self._put((pos, self.load_block(*pos), None)):
+                    return
+        except Exception as e:
+            _logger.debug('Loading of DF block failed', exc_info=True)
+            self._put((None, None, e))
+            return
+        self._put(self._END)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
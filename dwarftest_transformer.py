@@ -2,15 +2,39 @@
 # encoding: utf-8
 
 import os
+import shutil
 import logging
 import json
 import re
 import numpy as np
 import copy
 import hashlib
+import heapq
+
+from minetest_world import ContentRegistry
+from coordinates import CoordinateMapper
+from texture_baker import TextureBaker
+import metrics
+import mt_lighting
 
 _logger = logging.getLogger(__name__)
 
+LUA_STRING_ESCAPE_RE = re.compile(rb'[^ -~]|["\\]')
+
+
+def to_lua_string(value):
+    """
+    :return: Lua 5.1 string literal, non-ASCII and control bytes are written as decimal escapes
+    """
+    if value is None:
+        return 'nil'
+
+    escaped = LUA_STRING_ESCAPE_RE.sub(
+        lambda m: b'\\' + m.group() if m.group() in b'"\\' else '\\{:03d}'.format(m.group()[0]).encode('ascii'),
+        str(value).encode('utf-8')
+    )
+    return '"' + escaped.decode('ascii') + '"'
+
 
 class DwarftestTransformer(object):
     # size of DF objects in DF tiles
@@ -33,10 +57,38 @@ class DwarftestTransformer(object):
     # templates
     TEXTURE_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), './templates/textures')
 
-    def __init__(self, minetest_world, df_region_offset=(0, 0, 0), complex_block_scale=None):
+    # material list written into world mod, 'lua' is loaded by init.lua without JSON parsing
+    MATERIAL_LIST_FORMATS = ['lua', 'json']
+
+    # sound kind of node by mt_node material, see node_sounds in init.lua of world mod
+    MT_NODE_SOUNDS = {
+        'soil': 'dirt',
+        'stone': 'hard',
+        'ice': 'hard',
+        'wood': 'wood',
+        'mushroom': 'wood',
+        'grass': 'grass',
+        'smooth': 'hard',
+        'leaves': 'leaves',
+    }
+
+    def __init__(self, minetest_world, df_region_offset=(0, 0, 0), complex_block_scale=None, skip_air_blocks=False,
+                 spread_undefined_nodes=False, compute_lighting=False):
+        """
+        :param skip_air_blocks: blocks made only of air are not written, world should use 'singlenode' mapgen
+        :param spread_undefined_nodes: undefined nodes of completed blocks are filled with horizontally
+            neighbouring nodes instead of air
+        :param compute_lighting: blocks are written with computed light and lighting_complete flags, so that
+            MT does not have to light the world again
+        """
 
         self.minetest_world = minetest_world
+        self.content_registry = minetest_world.content_registry
         self.df_region_offset = df_region_offset  # used to move center of DF world to 0,0,0 in MT
+        self.skip_air_blocks = skip_air_blocks
+        self.skipped_air_blocks = 0
+        self.spread_undefined_nodes = spread_undefined_nodes
+        self.compute_lighting = compute_lighting
 
         # Size of one DF tile/block in Minetest nodes
 
@@ -48,10 +100,50 @@ class DwarftestTransformer(object):
             self.complex_block_scale['tile_y'],
             self.complex_block_scale['tile_z_floor'] + self.complex_block_scale['tile_z_wall'],
         )
+        self.coordinates = CoordinateMapper(
+            df_region_offset, self.block_scale, df_region_tile_size=self.DF_REGION_TILE_SIZE,
+            df_block_tile_size=self.DF_BLOCK_TILE_SIZE[:2], mt_block_node_size=self.MT_BLOCK_NODE_SIZE
+        )
+
+        # MT content ids of static nodes
+
+        self.mt_air_id = self.content_registry.get_id(self.MT_AIR_CONTENT_ID)
+        self.mt_water_id = self.content_registry.get_id(self.MT_WATER_CONTENT_ID)
+        self.mt_lava_id = self.content_registry.get_id(self.MT_LAVA_CONTENT_ID)
 
         # List of unfinished MT blocks
 
+        self.mt_block_size = self.MT_BLOCK_NODE_SIZE[0] * self.MT_BLOCK_NODE_SIZE[1] * self.MT_BLOCK_NODE_SIZE[2]
         self.mt_blocks = {}  # key: mt_block_pos
+        self.mt_blocks_fill = {}  # key: mt_block_pos, value: number of set nodes
+        self.mt_blocks_ready = []  # completely filled mt_block_pos waiting for dump
+        self.mt_blocks_dumped = set()  # mt_block_pos written to DB, pruned behind DF scan, see is_mt_block_dumped()
+        self.mt_blocks_peak = 0  # max number of unfinished MT blocks
+        self.mt_content_used = np.zeros((ContentRegistry.MAX_ID + 1, ), dtype=bool)  # content ids in dumped blocks
+
+        # incremental conversion, see set_manifest()
+
+        self.manifest = None
+        self.mt_blocks_patched = set()  # unfinished mt_block_pos loaded from DB
+        self.df_blocks_pending = {}  # key: DF block position, value: (digest, set of mt_block_pos) not recorded yet
+
+        # volume conversion, see set_voxel_volume()
+
+        self.voxel_volume = None
+
+        # DF scan order, used by streaming conversion to complete MT blocks that can't change anymore
+
+        self.df_scan = None
+        self.mt_blocks_last_column = []  # heap of (scan index of last DF column touching block, mt_block_pos)
+        self.mt_blocks_dumped_last_column = []  # same heap of mt_blocks_dumped
+        self.mt_blocks_unlit = []  # heap of (scan index of last DF column touching neighbouring blocks, mt_block_pos)
+
+        # lighting
+
+        self.mt_heightmaps = {}  # key: (mt_block_x, mt_block_z), value: heightmap of node columns, see mt_lighting
+        self.content_light_flags = None  # light flags indexed by content id, see get_content_light_flags()
+        self.mt_light_classes = {}  # key: completed mt_block_pos, value: light classes of nodes, see mt_lighting
+        self.mt_light_classes_last_column = []  # heap of (scan index of last DF column of neighbours, mt_block_pos)
 
         # tile types
 
@@ -63,6 +155,11 @@ class DwarftestTransformer(object):
         self.material_list = []
         self.material_df_lookup = {}
 
+        # tile material variants, key: (material df_tuple, tiletype df_id, shape override)
+
+        self.tile_material_cache = {}
+        self.tile_material_cache_stats = {'hits': 0, 'misses': 0}
+
         mt_air_mat = {
             'name': 'air',
             'color': (0, 0, 0),
@@ -86,108 +183,723 @@ class DwarftestTransformer(object):
     # coordinates conversions
 
     def df2mt_pos(self, region_pos, tile_pos):
-        # apply region offset
-        region_pos = (
-            region_pos[0] - self.df_region_offset[0],
-            region_pos[1] - self.df_region_offset[1],
-            region_pos[2] - self.df_region_offset[2],
-        )
+        """
+        :return: MT node position (x, y, z) of DF tile, see CoordinateMapper.df2mt_pos() for arrays of positions
+        """
+        return tuple(int(v) for v in self.coordinates.df2mt_pos(region_pos, tile_pos))
 
-        # absolute DF tile position
-        df_pos = (
-            region_pos[0] * self.DF_REGION_TILE_SIZE[0] + tile_pos[0],
-            region_pos[1] * self.DF_REGION_TILE_SIZE[1] + tile_pos[1],
-            region_pos[2] * self.DF_REGION_TILE_SIZE[2] + tile_pos[2],
-        )
+    # block manipulation
 
-        # convert to MT node position
-        mt_pos = (  # NOTE: MT pos is (X, Z, Y)
-            df_pos[0] * self.block_scale[0],
-            df_pos[2] * self.block_scale[2],
-            df_pos[1] * self.block_scale[1],
-        )
+    def set_mt_nodes(self, mt_pos, content_ids):
+        """
+        Sets box of nodes, every affected MT block is written with one slice assignment.
 
-        return mt_pos
+        :param mt_pos: minetest position (x, y, z) of first node of box
+        :param content_ids: numpy array of content ids with shape (size_z, size_y, size_x)
+        """
+        box_size = (content_ids.shape[2], content_ids.shape[1], content_ids.shape[0])
+        bs = self.MT_BLOCK_NODE_SIZE
+        metrics.count('mt_nodes_set', content_ids.size)
 
-    def mt2mt_block_pos(self, mt_pos):
-        mt_block_pos = [
-            int(mt_pos[0] / self.MT_BLOCK_NODE_SIZE[0]),
-            int(mt_pos[1] / self.MT_BLOCK_NODE_SIZE[1]),
-            int(mt_pos[2] / self.MT_BLOCK_NODE_SIZE[2]),
-        ]
+        first_block, template = self.coordinates.get_mt_box_template(mt_pos, box_size)
 
-        mt_block_node_pos = [
-            int(mt_pos[0] - mt_block_pos[0] * self.MT_BLOCK_NODE_SIZE[0]),
-            int(mt_pos[1] - mt_block_pos[1] * self.MT_BLOCK_NODE_SIZE[1]),
-            int(mt_pos[2] - mt_block_pos[2] * self.MT_BLOCK_NODE_SIZE[2]),
-        ]
+        for offset, dst, src in template['blocks']:
+            mt_block_pos = (first_block[0] + offset[0], first_block[1] + offset[1], first_block[2] + offset[2])
 
-        if mt_block_node_pos[0] < 0:
-            mt_block_node_pos[0] = mt_block_node_pos[0] + self.MT_BLOCK_NODE_SIZE[0]
-        if mt_block_node_pos[1] < 0:
-            mt_block_node_pos[1] = mt_block_node_pos[1] + self.MT_BLOCK_NODE_SIZE[1]
-        if mt_block_node_pos[2] < 0:
-            mt_block_node_pos[2] = mt_block_node_pos[2] + self.MT_BLOCK_NODE_SIZE[2]
+            nodes = self.get_mt_block(mt_block_pos).reshape(bs[2], bs[1], bs[0])
+            block_content_ids = nodes['content_id']
 
-        mt_block_node_index = mt_block_node_pos[0] + \
-            (mt_block_node_pos[1] * self.MT_BLOCK_NODE_SIZE[1]) + \
-            (mt_block_node_pos[2] * self.MT_BLOCK_NODE_SIZE[0]*self.MT_BLOCK_NODE_SIZE[1])
+            newly_set = np.count_nonzero(block_content_ids[dst] == self.content_registry.UNSET_ID)
+            block_content_ids[dst] = content_ids[src]
+            nodes['param1'][dst] = 0
+            nodes['param2'][dst] = 0
 
-        return tuple(mt_block_pos), tuple(mt_block_node_pos), mt_block_node_index
+            if self.compute_lighting:
+                origin_y = mt_block_pos[1] * bs[1] + dst[1].start
+                self.update_mt_heightmap(mt_block_pos, (dst[0], dst[2]), origin_y, content_ids[src])
 
-    # block manipulation
+            if newly_set:
+                self.add_mt_block_fill(mt_block_pos, newly_set)
 
-    def set_mt_node(self, mt_pos, val):
+    def get_mt_block(self, mt_block_pos):
         """
-        :param mt_pos: minetest position (x, y, z)
-        :param val: (content_id, param1, param2)
+        :return: nodes of unfinished MT block, new block is created if needed
         """
-        mt_block_pos, mt_block_node_pos, mt_block_node_index = self.mt2mt_block_pos(mt_pos)
-
         # init not used block
-        if mt_block_pos not in self.mt_blocks:
-            self.mt_blocks[mt_block_pos] = np.zeros(
-                (self.MT_BLOCK_NODE_SIZE[0]*self.MT_BLOCK_NODE_SIZE[1]*self.MT_BLOCK_NODE_SIZE[2], ),
-                dtype=self.minetest_world.BLOCK_NUMPY_DTYPE
-            )
-            self.mt_blocks[mt_block_pos][:] = (None, 0, 0)
+        nodes = self.mt_blocks.get(mt_block_pos)
+        if nodes is None:
+            # detect if we already wrote block to DB
+            if self.is_mt_block_dumped(mt_block_pos):
+                raise Exception('Block was already dumped to database')
+
+            if self.manifest is not None and self.manifest.has_mt_block(*mt_block_pos):
+                nodes = self.load_mt_block(mt_block_pos)
+            else:
+                nodes = np.zeros((self.mt_block_size, ), dtype=self.minetest_world.BLOCK_NUMPY_DTYPE)
+            self.mt_blocks[mt_block_pos] = nodes
+            self.mt_blocks_fill[mt_block_pos] = 0
+            self.mt_blocks_peak = max(self.mt_blocks_peak, len(self.mt_blocks))
 
-        # detect if we already wrote block to DB
-        if self.mt_blocks[mt_block_pos] is None:
-            raise Exception('Block was already dumped to database')
+            if self.df_scan:
+                first_column, last_column = self.get_df_column_range(mt_block_pos)
+                if first_column >= self.df_scan['first']:  # block with columns of other transformer stays partial
+                    heapq.heappush(self.mt_blocks_last_column, (last_column, mt_block_pos))
 
-        # detect out of range
-        if mt_block_node_index >= self.mt_blocks[mt_block_pos].size or mt_block_node_index < 0:
-            raise Exception('Node index {} is out of range! [mt_pos={}, mt_block_pos={}, mt_block_node_pos={}]'.format(
-                mt_block_node_index, mt_pos, mt_block_pos, mt_block_node_pos))
+        return nodes
 
-        # set node value
-        self.mt_blocks[mt_block_pos][mt_block_node_index] = val
+    def load_mt_block(self, mt_block_pos):
+        """
+        Loads already converted MT block from DB, so that only nodes of changed DF blocks are replaced. Block has
+        no undefined nodes, it is completed by complete_mt_block() like blocks at edge of DF map.
+
+        :return: nodes of MT block
+        """
+        nodes = self.minetest_world.read_block_nodes(*mt_block_pos)
+        if nodes is None:  # skipped air block
+            nodes = np.zeros((self.mt_block_size, ), dtype=self.minetest_world.BLOCK_NUMPY_DTYPE)
+            nodes['content_id'] = self.mt_air_id
+
+        if self.compute_lighting:
+            self.update_mt_block_heightmap(mt_block_pos, nodes)
+
+        self.mt_blocks_patched.add(mt_block_pos)
+        metrics.count('mt_blocks_patched')
+        return nodes
+
+    def merge_mt_block(self, mt_block_pos, nodes):
+        """
+        Merges partially filled MT block (e.g. from other transformer), set nodes overwrite current values.
+        """
+        block = self.get_mt_block(mt_block_pos)
+        mask = nodes['content_id'] != self.content_registry.UNSET_ID
+
+        newly_set = np.count_nonzero(mask & (block['content_id'] == self.content_registry.UNSET_ID))
+        block[mask] = nodes[mask]
+
+        if self.compute_lighting:
+            self.update_mt_block_heightmap(mt_block_pos, block)
+
+        if newly_set:
+            self.add_mt_block_fill(mt_block_pos, newly_set)
+
+    def pop_mt_blocks(self):
+        """
+        Removes all unfinished MT blocks from transformer.
+
+        :return: dict of unfinished MT blocks, key: mt_block_pos
+        """
+        mt_blocks = self.mt_blocks
+        self.mt_blocks = {}
+        self.mt_blocks_fill = {}
+        self.mt_blocks_ready = []
+        self.mt_blocks_last_column = []
+        self.mt_blocks_unlit = []
+        return mt_blocks
+
+    def add_mt_block_fill(self, mt_block_pos, count):
+        self.mt_blocks_fill[mt_block_pos] += count
+        if self.mt_blocks_fill[mt_block_pos] == self.mt_block_size:
+            self.add_mt_block_ready(mt_block_pos)
+
+    def add_mt_block_ready(self, mt_block_pos):
+        """
+        Completed block is written by next dump_mt_blocks(). With lighting, streaming conversion keeps block until
+        DF columns of all neighbouring blocks were parsed and neighbouring blocks were completed, so that light
+        is computed from complete heightmaps and light classes of neighbouring blocks.
+        """
+        if self.compute_lighting:
+            self.add_mt_light_classes(mt_block_pos)
+
+        if not (self.df_scan and self.compute_lighting):
+            self.mt_blocks_ready.append(mt_block_pos)
+            return
+
+        first_column, last_column = self.get_df_column_range(mt_block_pos, margin=1)
+        if first_column < self.df_scan['first']:  # heightmaps of other transformer, kept until complete_mt_blocks()
+            last_column = float('inf')
+        heapq.heappush(self.mt_blocks_unlit, (last_column, mt_block_pos))
 
     def complete_mt_blocks(self):
-        for mt_block_pos in self.mt_blocks:
-            if self.mt_blocks[mt_block_pos] is None:
-                continue
-            for i in range(self.mt_blocks[mt_block_pos].size):
-                if self.mt_blocks[mt_block_pos][i]['content_id'] is not None:
-                    continue
-                self.mt_blocks[mt_block_pos][i] = (self.MT_AIR_CONTENT_ID, 0, 0)
-        # TODO: try to spread defined nodes into undefined area
+        with metrics.timer('transformer.complete_mt_blocks'):
+            for mt_block_pos in self.mt_blocks:
+                self.complete_mt_block(mt_block_pos)
+
+        # all DF columns were parsed, all heightmaps are known
+        while self.mt_blocks_unlit:
+            _, mt_block_pos = heapq.heappop(self.mt_blocks_unlit)
+            self.mt_blocks_ready.append(mt_block_pos)
+
+    def complete_mt_block(self, mt_block_pos):
+        if self.mt_blocks_fill[mt_block_pos] == self.mt_block_size:
+            return
+        nodes = self.mt_blocks[mt_block_pos]
+
+        if self.spread_undefined_nodes:
+            self.spread_mt_block_nodes(nodes)
+            if self.compute_lighting:
+                self.update_mt_block_heightmap(mt_block_pos, nodes)
+
+        # params of undefined nodes are already zero
+        nodes['content_id'][nodes['content_id'] == self.content_registry.UNSET_ID] = self.mt_air_id
+        metrics.count('mt_blocks_completed_partial')
+
+        self.mt_blocks_fill[mt_block_pos] = self.mt_block_size
+        self.add_mt_block_ready(mt_block_pos)
+
+    def spread_mt_block_nodes(self, nodes):
+        """
+        Fills undefined nodes with content of horizontally neighbouring defined nodes, one node step per iteration,
+        so that terrain at edge of DF map continues to the border of MT block.
+        """
+        bs = self.MT_BLOCK_NODE_SIZE
+        content_ids = nodes.reshape(bs[2], bs[1], bs[0])['content_id']  # [z, y, x]
+        unset_id = self.content_registry.UNSET_ID
+
+        for _ in range(bs[0] + bs[2]):
+            undefined = content_ids == unset_id
+            if not undefined.any():
+                break
+
+            # content of first defined neighbour in -z, +z, -x, +x direction
+            spread = np.zeros_like(content_ids)
+            for axis in (0, 2):
+                for shift in (1, -1):
+                    neighbour = np.zeros_like(content_ids)
+                    dst = [slice(None)] * 3
+                    src = [slice(None)] * 3
+                    dst[axis] = slice(1, None) if shift == 1 else slice(None, -1)
+                    src[axis] = slice(None, -1) if shift == 1 else slice(1, None)
+                    neighbour[tuple(dst)] = content_ids[tuple(src)]
+
+                    take = (spread == unset_id) & (neighbour != unset_id)
+                    spread[take] = neighbour[take]
+
+            fill = undefined & (spread != unset_id)
+            if not fill.any():
+                break  # layers without any defined node
+            content_ids[fill] = spread[fill]
+
+    # Lighting
+
+    def get_content_light_flags(self):
+        """
+        Light flags of content ids, based on node definitions of dwarftest mod. Flags are rebuilt when new
+        content ids are registered.
+
+        :return: dict of numpy arrays indexed by content id: 'sunlight_propagates', 'light_propagates' (bool),
+            'light_source' (light level) and 'light_class' (see mt_lighting.get_light_classes())
+        """
+        flags = self.content_light_flags
+        if flags is not None and len(flags['light_source']) == len(self.content_registry):
+            return flags
+
+        mt_node_shapes = {mat['mt_id']: mat.get('mt_node', {}).get('shape') for mat in self.material_list}
+
+        count = len(self.content_registry)
+        flags = {
+            'sunlight_propagates': np.zeros((count, ), dtype=bool),
+            'light_propagates': np.zeros((count, ), dtype=bool),
+            'light_source': np.zeros((count, ), dtype=np.uint8),
+        }
+
+        for content_id, name in enumerate(self.content_registry.names):
+            shape = mt_node_shapes.get(name)
+
+            # undefined nodes are completed with air
+            if content_id == self.content_registry.UNSET_ID or name == self.MT_AIR_CONTENT_ID or \
+                    shape in ['stair', 'fortification']:
+                flags['sunlight_propagates'][content_id] = True
+                flags['light_propagates'][content_id] = True
+            elif name == self.MT_WATER_CONTENT_ID or shape == 'leaves':
+                flags['light_propagates'][content_id] = True
+            elif name == self.MT_LAVA_CONTENT_ID:
+                flags['light_propagates'][content_id] = True
+                flags['light_source'][content_id] = mt_lighting.LIGHT_MAX - 1
+
+        flags['light_class'] = mt_lighting.get_light_classes(flags)
+        self.content_light_flags = flags
+        return flags
+
+    def add_mt_light_classes(self, mt_block_pos):
+        """
+        Keeps light classes of completed block, they are used by lighting of neighbouring blocks even after
+        the block was dumped. In streaming conversion, classes are pruned once all neighbouring blocks were lit.
+        """
+        bs = self.MT_BLOCK_NODE_SIZE
+        content_ids = self.mt_blocks[mt_block_pos]['content_id'].reshape(bs[2], bs[1], bs[0])
+        self.mt_light_classes[mt_block_pos] = self.get_content_light_flags()['light_class'][content_ids]
+
+        if self.df_scan:
+            first_column, last_column = self.get_df_column_range(mt_block_pos, margin=2)
+            if first_column < self.df_scan['first']:  # neighbours lit by other transformer, see pop_mt_light_classes()
+                last_column = float('inf')
+            heapq.heappush(self.mt_light_classes_last_column, (last_column, mt_block_pos))
+
+    def pop_mt_light_classes(self):
+        """
+        Removes light classes of all completed MT blocks from transformer.
+
+        :return: dict of light classes, key: mt_block_pos
+        """
+        light_classes = self.mt_light_classes
+        self.mt_light_classes = {}
+        self.mt_light_classes_last_column = []
+        return light_classes
+
+    def prune_mt_light_classes(self):
+        """
+        Removes light classes of blocks whose neighbours were all lit, blocks behind evicted DF columns.
+        """
+        heap = self.mt_light_classes_last_column
+        while heap and heap[0][0] <= self.df_scan['evicted']:
+            _, mt_block_pos = heapq.heappop(heap)
+            self.mt_light_classes.pop(mt_block_pos, None)
+
+    def update_mt_heightmap(self, mt_block_pos, node_slice, origin_y, content_ids):
+        """
+        :param node_slice: (z slice, x slice) of node columns in MT block
+        :param origin_y: MT y of first node in content_ids
+        :param content_ids: numpy array indexed by [z, y, x], nodes set in node columns
+        """
+        blocks_sunlight = ~self.get_content_light_flags()['sunlight_propagates'][content_ids]
+        top = mt_lighting.get_heightmap_top(blocks_sunlight, origin_y)
+
+        key = (mt_block_pos[0], mt_block_pos[2])
+        heightmap = self.mt_heightmaps.get(key)
+        if heightmap is None:
+            heightmap = self.mt_heightmaps[key] = np.full(
+                (self.MT_BLOCK_NODE_SIZE[2], self.MT_BLOCK_NODE_SIZE[0]), mt_lighting.HEIGHTMAP_NONE, dtype=np.int32)
+
+        np.maximum(heightmap[node_slice], top, out=heightmap[node_slice])
+
+    def update_mt_block_heightmap(self, mt_block_pos, nodes):
+        bs = self.MT_BLOCK_NODE_SIZE
+        self.update_mt_heightmap(mt_block_pos, (slice(None), slice(None)), mt_block_pos[1] * bs[1],
+                                 nodes.reshape(bs[2], bs[1], bs[0])['content_id'])
+
+    def merge_mt_heightmaps(self, heightmaps):
+        """
+        Merges heightmaps of other transformer (e.g. from worker process).
+        """
+        for key, heightmap in heightmaps.items():
+            if key in self.mt_heightmaps:
+                np.maximum(self.mt_heightmaps[key], heightmap, out=self.mt_heightmaps[key])
+            else:
+                self.mt_heightmaps[key] = heightmap
+
+    def get_mt_heightmap_area(self, mt_block_pos, margin):
+        """
+        :return: (heightmap, known), numpy arrays indexed by [z, x] covering node columns of MT block
+            and `margin` node columns around it, known is False for columns that were not converted yet
+        """
+        bs = self.MT_BLOCK_NODE_SIZE
+        heightmap = np.full((3 * bs[2], 3 * bs[0]), mt_lighting.HEIGHTMAP_NONE, dtype=np.int32)
+        known = np.zeros(heightmap.shape, dtype=bool)
+
+        for dz in range(3):
+            for dx in range(3):
+                area = (slice(dz * bs[2], (dz + 1) * bs[2]), slice(dx * bs[0], (dx + 1) * bs[0]))
+                block_heightmap = self.mt_heightmaps.get((mt_block_pos[0] + dx - 1, mt_block_pos[2] + dz - 1))
+                if block_heightmap is not None:
+                    heightmap[area] = block_heightmap
+                    known[area] = True
+                elif dz == 1 and dx == 1:
+                    known[area] = True  # columns of block without any set node are completed with air
+
+        crop = (slice(bs[2] - margin, 2 * bs[2] + margin), slice(bs[0] - margin, 2 * bs[0] + margin))
+        return heightmap[crop], known[crop]
+
+    def get_mt_light_class_area(self, mt_block_pos, nodes, margin):
+        """
+        :return: (light classes, unknown), numpy array indexed by [z, y, x] covering nodes of MT block and `margin`
+            nodes around it, and list of (x, y, z) offsets of neighbouring blocks without light classes
+        """
+        bs = self.MT_BLOCK_NODE_SIZE
+        light_classes = np.zeros((3 * bs[2], 3 * bs[1], 3 * bs[0]), dtype=np.uint8)
+        unknown = []
+
+        for dz in range(3):
+            for dy in range(3):
+                for dx in range(3):
+                    offset = (dx - 1, dy - 1, dz - 1)
+                    if offset == (0, 0, 0):
+                        block_classes = self.get_content_light_flags()['light_class'][
+                            nodes.reshape(bs[2], bs[1], bs[0])['content_id']]
+                    else:
+                        block_classes = self.mt_light_classes.get(
+                            (mt_block_pos[0] + offset[0], mt_block_pos[1] + offset[1], mt_block_pos[2] + offset[2]))
+                    if block_classes is None:
+                        unknown.append(offset)
+                        continue
+                    light_classes[dz * bs[2]:(dz + 1) * bs[2], dy * bs[1]:(dy + 1) * bs[1],
+                                  dx * bs[0]:(dx + 1) * bs[0]] = block_classes
+
+        crop = (slice(bs[2] - margin, 2 * bs[2] + margin), slice(bs[1] - margin, 2 * bs[1] + margin),
+                slice(bs[0] - margin, 2 * bs[0] + margin))
+        return light_classes[crop], unknown
+
+    def light_mt_block(self, mt_block_pos, nodes):
+        """
+        Sets param1 of completed MT block to computed light.
+
+        :return: lighting_complete flags of block, bits of directions to neighbouring blocks that are not known
+            are unset if block has light sources near their border, so that MT spreads light between them
+        """
+        bs = self.MT_BLOCK_NODE_SIZE
+        margin = mt_lighting.LIGHT_SPREAD_MARGIN
+        heightmap, known = self.get_mt_heightmap_area(mt_block_pos, margin)
+        light_classes, unknown = self.get_mt_light_class_area(mt_block_pos, nodes, margin)
+
+        with metrics.timer('transformer.light_mt_block'):
+            param1 = mt_lighting.compute_block_light(light_classes, mt_block_pos[1] * bs[1], heightmap, known, margin)
+        nodes['param1'] = param1.reshape(-1)
+
+        inner = (slice(margin, margin + bs[2]), slice(margin, margin + bs[1]), slice(margin, margin + bs[0]))
+        sources = (light_classes[inner] & mt_lighting.LIGHT_CLASS_SOURCE) != 0
+        lighting_complete = mt_lighting.LIGHTING_COMPLETE
+        if sources.any():
+            for offset in unknown:
+                if sources[mt_lighting.get_border_slices(offset, sources.shape, margin)].any():
+                    lighting_complete &= ~mt_lighting.get_lighting_incomplete_bits(offset)
+        if lighting_complete != mt_lighting.LIGHTING_COMPLETE:
+            metrics.count('mt_blocks_lighting_incomplete')
+        return lighting_complete
+
+    def get_mt_blocks_memory(self):
+        """
+        :return: (current, peak) memory used by unfinished MT blocks in bytes
+        """
+        block_bytes = self.mt_block_size * self.minetest_world.BLOCK_NUMPY_DTYPE.itemsize
+        return len(self.mt_blocks) * block_bytes, self.mt_blocks_peak * block_bytes
+
+    # Streaming conversion
+
+    def set_df_scan_order(self, region_pos, block_size_x, block_size_y, first_column=(0, 0)):
+        """
+        Enables streaming conversion. DF block columns (x, y) must be parsed in order given by
+        iter_df_block_positions() and evict_mt_blocks() must be called after every finished column.
+        MT blocks are then completed as soon as no following DF column can change them.
+
+        :param first_column: (x, y) of first parsed DF column, MT blocks with tiles of previous columns (parsed
+            by other transformer) are not completed
+        """
+        self.df_scan = {
+            'region_pos': region_pos,
+            'block_size': (block_size_x, block_size_y),
+            'origin': self.df2mt_pos(region_pos, (0, 0, 0)),  # MT position of first tile of DF map
+            'first': first_column[0] * block_size_y + first_column[1],
+            'evicted': first_column[0] * block_size_y + first_column[1] - 1,  # last column of evict_mt_blocks()
+        }
+
+    def get_df_column_scan_index(self, x, y):
+        return x * self.df_scan['block_size'][1] + y
+
+    def get_df_column_range(self, mt_block_pos, margin=0):
+        """
+        :param margin: number of neighbouring MT blocks in X and Z directions that are included
+        :return: (scan index of first, scan index of last) DF block column that has tiles in MT blocks
+        """
+        origin = self.df_scan['origin']
+        bs = self.MT_BLOCK_NODE_SIZE
+
+        def get_df_column(node_x, node_z):
+            # MT node -> DF tile -> DF block, NOTE: MT pos is (X, Z, Y)
+            df_x = ((node_x - origin[0]) // self.block_scale[0]) // self.DF_BLOCK_TILE_SIZE[0]
+            df_y = ((node_z - origin[2]) // self.block_scale[1]) // self.DF_BLOCK_TILE_SIZE[1]
+            df_x = min(max(df_x, 0), self.df_scan['block_size'][0] - 1)
+            df_y = min(max(df_y, 0), self.df_scan['block_size'][1] - 1)
+            return self.get_df_column_scan_index(df_x, df_y)
+
+        first = get_df_column((mt_block_pos[0] - margin) * bs[0], (mt_block_pos[2] - margin) * bs[2])
+        last = get_df_column((mt_block_pos[0] + margin + 1) * bs[0] - 1, (mt_block_pos[2] + margin + 1) * bs[2] - 1)
+        return first, last
+
+    def get_last_df_column(self, mt_block_pos):
+        """
+        :return: scan index of last DF block column that has tiles in MT block
+        """
+        return self.get_df_column_range(mt_block_pos)[1]
+
+    def evict_mt_blocks(self, x, y):
+        """
+        Completes MT blocks that can't be changed by DF block columns following column (x, y).
+        """
+        scan_index = self.get_df_column_scan_index(x, y)
+        self.df_scan['evicted'] = scan_index
+
+        with metrics.timer('transformer.complete_mt_blocks'):
+            while self.mt_blocks_last_column and self.mt_blocks_last_column[0][0] <= scan_index:
+                _, mt_block_pos = heapq.heappop(self.mt_blocks_last_column)
+                if mt_block_pos in self.mt_blocks:
+                    self.complete_mt_block(mt_block_pos)
+
+        # completed blocks whose neighbours were completed too
+        while self.mt_blocks_unlit and self.mt_blocks_unlit[0][0] <= scan_index:
+            _, mt_block_pos = heapq.heappop(self.mt_blocks_unlit)
+            self.mt_blocks_ready.append(mt_block_pos)
+
+        # dumped blocks behind scan are recognized by is_mt_block_dumped() without set
+        while self.mt_blocks_dumped_last_column and self.mt_blocks_dumped_last_column[0][0] <= scan_index:
+            _, mt_block_pos = heapq.heappop(self.mt_blocks_dumped_last_column)
+            self.mt_blocks_dumped.discard(mt_block_pos)
+
+    def is_mt_block_dumped(self, mt_block_pos):
+        """
+        :return: True if MT block was already written to DB
+        """
+        if mt_block_pos in self.mt_blocks_dumped:
+            return True
+        # all blocks behind evicted DF columns were completed and dumped
+        return self.df_scan is not None and mt_block_pos not in self.mt_blocks and \
+            self.get_last_df_column(mt_block_pos) <= self.df_scan['evicted']
 
     def dump_mt_blocks(self):
-        for mt_block_pos in self.mt_blocks:
-            if self.mt_blocks[mt_block_pos] is None:
-                continue
-            if any(x is None for x in self.mt_blocks[mt_block_pos]['content_id']):
+        """
+        Writes completed MT blocks in one transaction, blocks are serialized together by
+        MinetestWorld.build_map_blocks() (in parallel with compression workers).
+        """
+        positions = []
+        blocks = []
+        for mt_block_pos in self.mt_blocks_ready:
+            nodes = self.mt_blocks.pop(mt_block_pos)
+            del self.mt_blocks_fill[mt_block_pos]
+            self.mt_blocks_dumped.add(mt_block_pos)
+            if self.df_scan:
+                heapq.heappush(self.mt_blocks_dumped_last_column, (self.get_last_df_column(mt_block_pos), mt_block_pos))
+            self.mt_content_used[nodes['content_id']] = True
+
+            # patched block has to overwrite its previous version even if it is air now
+            patched = mt_block_pos in self.mt_blocks_patched
+            self.mt_blocks_patched.discard(mt_block_pos)
+
+            if self.skip_air_blocks and not patched and (nodes['content_id'] == self.mt_air_id).all():
+                self.skipped_air_blocks += 1
+                metrics.count('mt_air_blocks_skipped')
                 continue
 
             _logger.debug('Saving block {} into database'.format(mt_block_pos))
-            block = self.minetest_world.build_map_block(self.mt_blocks[mt_block_pos])
-            self.minetest_world.write_block(mt_block_pos[0], mt_block_pos[1], mt_block_pos[2], block)
-            self.mt_blocks[mt_block_pos] = None
+            if patched:  # heightmap of unchanged columns is not known, MT computes light of block
+                lighting_complete = 0
+            elif self.compute_lighting:
+                lighting_complete = self.light_mt_block(mt_block_pos, nodes)
+            else:
+                lighting_complete = 0
+            positions.append(mt_block_pos)
+            blocks.append((nodes, lighting_complete))
+        dumped = self.mt_blocks_ready
+        self.mt_blocks_ready = []
+        metrics.count('mt_blocks_flushed', len(blocks))
+
+        with metrics.timer('world.build_map_block'):
+            blocks = self.minetest_world.build_map_blocks(blocks)
 
+        self.minetest_world.write_blocks((x, y, z, block) for (x, y, z), block in zip(positions, blocks))
         self.minetest_world.commit_sql_connections()
 
+        if self.df_scan:
+            self.prune_mt_light_classes()
+
+        if self.manifest is not None:
+            self.update_manifest(dumped)
+
+    # Incremental conversion
+
+    def set_manifest(self, manifest):
+        """
+        Enables incremental conversion. DF block lists have to be parsed by parse_changed_df_blocks(), unchanged
+        DF blocks are skipped and MT blocks of changed DF blocks are loaded from DB and patched.
+
+        :param manifest: ConversionManifest of converted world
+        """
+        self.manifest = manifest
+
+    def get_df_blocks_digest(self, block_arrays):
+        """
+        :param block_arrays: list of (map position, dict of tile arrays from get_df_block_arrays())
+        :return: digest of tiles, materials and liquids of DF blocks
+        """
+        h = hashlib.blake2b(digest_size=16)
+        for map_pos, arrays in block_arrays:
+            h.update(np.array(map_pos, dtype=np.int32).tobytes())
+            for name in ('tiles', 'mat_types', 'mat_indexes', 'water', 'magma'):
+                h.update(np.ascontiguousarray(arrays[name], dtype=np.int32).tobytes())
+        return h.digest()
+
+    def get_df_block_mt_block_positions(self, region_pos, map_pos):
+        """
+        :return: set of mt_block_pos with nodes of DF block
+        """
+        return set(self.coordinates.get_df_block_mt_block_positions(region_pos, map_pos))
+
+    def parse_changed_df_blocks(self, region_pos, df_pos, block_list):
+        """
+        Parses DF blocks returned for requested position df_pos only if they changed since they were recorded
+        in manifest. Materials of unchanged blocks are still registered, so that material mod is complete.
+
+        :return: True if blocks were parsed
+        """
+        block_arrays = [(self.get_df_block_map_pos(block), self.get_df_block_arrays(block)) for block in block_list]
+        digest = self.get_df_blocks_digest(block_arrays)
+
+        if self.manifest.get_digest(*df_pos) == digest:
+            for _, arrays in block_arrays:
+                self.df_tiles_to_mt_content_ids(**arrays)
+            metrics.count('df_blocks_unchanged', len(block_list))
+            return False
+
+        self.parse_df_blocks(region_pos, block_list)
+
+        mt_block_positions = set()
+        for map_pos, _ in block_arrays:
+            mt_block_positions |= self.get_df_block_mt_block_positions(region_pos, map_pos)
+        self.df_blocks_pending[df_pos] = (digest, mt_block_positions)
+
+        return True
+
+    def update_manifest(self, dumped):
+        """
+        Records dumped MT blocks and DF blocks whose MT blocks were all dumped.
+
+        :param dumped: list of dumped mt_block_pos
+        """
+        self.manifest.add_mt_blocks(dumped)
+
+        for df_pos, (digest, mt_block_positions) in list(self.df_blocks_pending.items()):
+            if all(self.is_mt_block_dumped(pos) for pos in mt_block_positions):
+                self.manifest.set_df_block(df_pos[0], df_pos[1], df_pos[2], digest, sorted(mt_block_positions))
+                del self.df_blocks_pending[df_pos]
+
+        self.manifest.commit()
+
+    def update_df_blocks(self, region_pos, block_list):
+        """
+        Converts DF blocks changed after world was converted (e.g. in running fortress) and writes affected
+        MT blocks, which are loaded from DB and patched. Requires manifest of converted world, see set_manifest().
+
+        :param block_list: DF blocks of any positions, blocks of same DF block position are grouped together
+        :return: number of DF blocks that differ from manifest
+        """
+        # MT blocks can be written again by every update, scan order of conversion does not apply
+        self.mt_blocks_dumped = set()
+        self.df_scan = None
+        self.mt_blocks_last_column = []
+        self.mt_blocks_dumped_last_column = []
+        self.mt_blocks_unlit = []
+        self.pop_mt_light_classes()
+
+        df_blocks = {}
+        for block in block_list:
+            map_pos = self.get_df_block_map_pos(block)
+            df_pos = (map_pos[0] // self.DF_BLOCK_TILE_SIZE[0], map_pos[1] // self.DF_BLOCK_TILE_SIZE[1], map_pos[2])
+            df_blocks.setdefault(df_pos, []).append(block)
+
+        changed = 0
+        for df_pos, blocks in df_blocks.items():
+            if self.parse_changed_df_blocks(region_pos, df_pos, blocks):
+                changed += 1
+
+        self.complete_mt_blocks()
+        self.dump_mt_blocks()
+        return changed
+
+    # Volume conversion
+
+    def set_voxel_volume(self, voxel_volume):
+        """
+        Enables volume conversion. Parsed DF blocks are written into voxel volume instead of MT blocks, MT blocks
+        are emitted from volume by dump_voxel_volume() after all DF blocks were parsed.
+
+        Materials stored with complete volume are registered, so that volume of previous conversion can be
+        emitted (and material mod built) without parsing DF blocks.
+
+        :param voxel_volume: VoxelVolume covering all parsed DF blocks
+        """
+        self.voxel_volume = voxel_volume
+
+        mt_ids = {mat['mt_id'] for mat in self.material_list}
+        for mat in voxel_volume.info.get('materials', []):
+            if mat['mt_id'] not in mt_ids:
+                self.material_list.append(mat)
+                mt_ids.add(mat['mt_id'])
+
+    def dump_voxel_volume(self):
+        """
+        Slices voxel volume into MT blocks, completes and writes them one layer of MT blocks (same MT z) at a time.
+        Layer is written after next layer was read, so that lighting knows heightmaps of all neighbouring blocks.
+        """
+        volume = self.voxel_volume
+        content_id_map = volume.get_content_id_map(self.content_registry)
+        ready = []
+
+        for mt_block_z, slab in volume.iter_block_slabs():
+            if content_id_map is not None:
+                slab = content_id_map[slab]
+
+            with metrics.timer('transformer.complete_mt_blocks'):
+                for by, bx in np.ndindex(*slab.shape[:2]):
+                    mt_block_pos = (volume.first_block[0] + bx, volume.first_block[1] + by, mt_block_z)
+                    nodes = np.zeros((self.mt_block_size, ), dtype=self.minetest_world.BLOCK_NUMPY_DTYPE)
+                    nodes['content_id'] = slab[by, bx].reshape(-1)
+
+                    self.mt_blocks[mt_block_pos] = nodes
+                    self.mt_blocks_fill[mt_block_pos] = 0
+                    self.add_mt_block_fill(
+                        mt_block_pos, np.count_nonzero(nodes['content_id'] != self.content_registry.UNSET_ID))
+                    self.complete_mt_block(mt_block_pos)
+
+                    if self.compute_lighting:
+                        self.update_mt_block_heightmap(mt_block_pos, nodes)
+
+            self.mt_blocks_peak = max(self.mt_blocks_peak, len(self.mt_blocks))
+            ready, self.mt_blocks_ready = self.mt_blocks_ready, ready
+            self.dump_mt_blocks()
+
+            # previous layer was lit, light classes of layer before it are not needed
+            self.mt_light_classes = {pos: light_classes for pos, light_classes in self.mt_light_classes.items()
+                                     if pos[2] >= mt_block_z - 1}
+
+        self.mt_blocks_ready = ready
+        self.dump_mt_blocks()
+
+    # Worker processes
+
+    def get_worker_state(self):
+        """
+        :return: picklable state used by from_worker_state()
+        """
+        return {
+            'df_region_offset': self.df_region_offset,
+            'complex_block_scale': self.complex_block_scale,
+            'skip_air_blocks': self.skip_air_blocks,
+            'spread_undefined_nodes': self.spread_undefined_nodes,
+            'compute_lighting': self.compute_lighting,
+            'content_names': self.content_registry.names,
+            'tiletype_list': self.tiletype_list,
+            'material_list': self.material_list,
+            'tile_material_cache': self.tile_material_cache,
+        }
+
+    @classmethod
+    def from_worker_state(cls, minetest_world, state):
+        """
+        Creates transformer with same tile types, materials and content ids as transformer that created state.
+        minetest_world gets its own content registry.
+        """
+        minetest_world.content_registry = ContentRegistry(state['content_names'])
+
+        dt = cls(minetest_world, df_region_offset=state['df_region_offset'],
+                 complex_block_scale=state['complex_block_scale'], skip_air_blocks=state['skip_air_blocks'],
+                 spread_undefined_nodes=state['spread_undefined_nodes'],
+                 compute_lighting=state['compute_lighting'])
+
+        dt.tiletype_list = state['tiletype_list']
+        dt.tiletype_df_lookup = {tiletype['df_id']: tiletype for tiletype in dt.tiletype_list}
+        dt.material_list = state['material_list']
+        dt.material_df_lookup = {mat['df_tuple']: mat for mat in dt.material_list}
+        dt.tile_material_cache = state['tile_material_cache']
+
+        return dt
+
     # Tile Types
 
     def load_df_tiletype_list(self, df_tiletype_list):
@@ -242,17 +954,50 @@ class DwarftestTransformer(object):
             self.material_list.append(mt_mat)
             self.material_df_lookup[mt_mat['df_tuple']] = mt_mat
 
-    def build_material_mod(self):
+    def mark_mt_ids_used(self, mt_ids):
+        """
+        Marks content names as used in map blocks, e.g. names of blocks converted by previous run.
+        """
+        for mt_id in mt_ids:
+            if mt_id is not None:
+                self.mt_content_used[self.content_registry.get_id(mt_id)] = True
+
+    def get_used_mt_ids(self):
+        """
+        :return: set of content names used in dumped MT blocks
+        """
+        return {self.content_registry.get_name(int(i)) for i in np.flatnonzero(self.mt_content_used)}
+
+    def build_material_mod(self, prune_unused=False, material_list_format='lua', bake_textures=False,
+                           texture_workers=4):
+        """
+        :param prune_unused: only materials used in dumped MT blocks are written, so that Minetest does not
+            register thousands of nodes that are not in map
+        :param material_list_format: 'lua' writes material_list.lua with resolved node definitions, 'json' writes
+            material_list.json that is interpreted by init.lua
+        :param bake_textures: colorized node textures are written into textures of world mod instead of being
+            built by [colorize texture modifiers in clients
+        :param texture_workers: number of threads writing baked textures
+        :return: dict with number of registered, used and written materials, size of material list file and
+            texture baking stats
+        """
+        if material_list_format not in self.MATERIAL_LIST_FORMATS:
+            raise Exception('Unknown material list format {}'.format(material_list_format))
+
         # get paths
 
         dwarftest_mod_path = os.path.join(self.minetest_world.path, 'worldmods', 'dwarftest')
-        dwarftest_mod_material_list_path = os.path.join(dwarftest_mod_path, 'material_list.json')
         dwarftest_mod_textures_path = os.path.join(dwarftest_mod_path, 'textures')
 
-        if not os.path.exists(dwarftest_mod_path) or not os.path.exists(dwarftest_mod_material_list_path) or \
-            not os.path.exists(dwarftest_mod_textures_path):
+        if not os.path.exists(dwarftest_mod_path) or not os.path.exists(dwarftest_mod_textures_path):
             raise Exception('Could not find Dwarftest world mod paths!')
 
+        # world can be created by older version, init.lua has to be able to load material list
+        shutil.copyfile(
+            os.path.join(self.minetest_world.TEMPLATE_PATH, 'worldmods', 'dwarftest', 'init.lua'),
+            os.path.join(dwarftest_mod_path, 'init.lua')
+        )
+
         # filter material list
         material_list = []
         for mat in self.material_list:
@@ -261,33 +1006,89 @@ class DwarftestTransformer(object):
                 continue
             material_list.append(mat)
 
-        # fill material_list.json
+        used_mt_ids = self.get_used_mt_ids()
+        stats = {
+            'format': material_list_format,
+            'registered': len(material_list),
+            'used': sum(1 for mat in material_list if mat['mt_id'] in used_mt_ids),
+        }
+        if prune_unused:
+            material_list = [mat for mat in material_list if mat['mt_id'] in used_mt_ids]
 
-        with open(dwarftest_mod_material_list_path, 'w') as f:
-            f.write(json.dumps(material_list))
+        # baked textures are shared by materials of same template and color and kept between builds
 
-        # # generate node textures
-        #
-        # for mat in material_list:
-        #     mat_type_str = mat['df_id'].split(':')[0]
-        #
-        #     # init base color image
-        #     pixel_data = np.zeros((16, 16, 4), dtype=np.uint8)
-        #     pixel_data[:, :, 0] = mat['color'][0] if mat['color'] else 255
-        #     pixel_data[:, :, 1] = mat['color'][1] if mat['color'] else 255
-        #     pixel_data[:, :, 2] = mat['color'][2] if mat['color'] else 255
-        #     pixel_data[:, :, 3] = 255
-        #     img = Image.fromarray(pixel_data, 'RGBA')
-        #
-        #     # apply template
-        #     template_name = mat_type_str + '.png'
-        #     # TODO
-        #     # img = Image.open(stream)
-        #     # img.paste(new_layer, (0, 0), new_layer)
-        #
-        #     # save image
-        #     tex_name = mat['mt_id'].replace(':', '_') + '.png'
-        #     img.save(os.path.join(dwarftest_mod_textures_path, tex_name))
+        texture_baker = TextureBaker(dwarftest_mod_textures_path, workers=texture_workers) if bake_textures else None
+
+        # fill material_list.lua or material_list.json, init.lua prefers material_list.lua
+
+        if material_list_format == 'lua':
+            data = self.get_material_list_lua(material_list, texture_baker=texture_baker)
+        elif texture_baker is not None:
+            data = json.dumps([
+                dict(mat, mt_texture=self.get_material_node_def(mat, texture_baker=texture_baker)[1])
+                for mat in material_list
+            ])
+        else:
+            data = json.dumps(material_list)
+
+        for name in self.MATERIAL_LIST_FORMATS:
+            path = os.path.join(dwarftest_mod_path, 'material_list.{}'.format(name))
+            if name == material_list_format:
+                with open(path, 'w') as f:
+                    f.write(data)
+            elif os.path.exists(path):
+                os.remove(path)
+
+        stats['written'] = len(material_list)
+        stats['file_bytes'] = len(data.encode('utf-8'))
+
+        if texture_baker is not None:
+            stats['textures'] = texture_baker.bake()
+            stats['textures']['removed'] = texture_baker.remove_unused()
+
+        return stats
+
+    def get_material_node_def(self, mat, texture_baker=None):
+        """
+        :param texture_baker: TextureBaker, texture is name of baked texture instead of [colorize texture modifier
+        :return: (node kind, texture, sound kind) of material node, node kind is one of 'wall', 'stair',
+            'fortification' and 'leaves'
+        """
+        mt_node = mat.get('mt_node') or {}
+
+        if mt_node.get('shape') in ['stair', 'fortification']:
+            kind = mt_node['shape']
+            base_tex = 'dwarftest_template_{}.png'.format(mt_node['shape'])
+        else:
+            kind = 'leaves' if mt_node.get('shape') == 'leaves' else 'wall'
+            base_tex = 'dwarftest_template_{}.png'.format(mt_node.get('material') or 'empty')
+
+        if texture_baker is not None:
+            texture = texture_baker.get_texture_name(base_tex, mat['color'])
+        else:
+            texture = '{}^[colorize:#{:02x}{:02x}{:02x}80'.format(base_tex, *mat['color'])
+        sound = self.MT_NODE_SOUNDS.get(mt_node.get('material'), 'dirt')
+
+        return kind, texture, sound
+
+    def get_material_list_lua(self, material_list, texture_baker=None):
+        """
+        :param texture_baker: see get_material_node_def()
+        :return: Lua chunk returning table of {mt_id, description, node kind, texture, sound kind, red, green, blue}
+        """
+        lines = [
+            '-- Generated by Dwarftest converter, see register_material() in init.lua',
+            'return {',
+        ]
+        for mat in material_list:
+            kind, texture, sound = self.get_material_node_def(mat, texture_baker=texture_baker)
+            lines.append('{{{},{},{},{},{},{},{},{}}},'.format(
+                to_lua_string(mat['mt_id']), to_lua_string(mat['name']), to_lua_string(kind),
+                to_lua_string(texture), to_lua_string(sound), *[int(c) for c in mat['color']]
+            ))
+        lines.append('}')
+
+        return '\n'.join(lines) + '\n'
 
     def get_material(self, mat_dict=None, mat_tuple=None):
         if mat_dict:
@@ -300,7 +1101,7 @@ class DwarftestTransformer(object):
             _logger.error('Could not find material for {}'.format(mat_tuple))
             return self.material_df_lookup[(None, None)]
 
-    def get_tile_material(self, material, tiletype, ignore_air=True):
+    def get_tile_material(self, material, tiletype, ignore_air=True, shape=None):
         """
         https://github.com/DFHack/dfhack/blob/master/plugins/proto/RemoteFortressReader.proto#L47
 
@@ -317,10 +1118,26 @@ class DwarftestTransformer(object):
             BROOK, RIVER, ROOT, TREE_MATERIAL, MUSHROOM, UNDERWORLD_GATE
 
         tiletype['variant']: NO_VARIANT, VAR_1, VAR_2, VAR_3, VAR_4
+
+        shape: used instead of tiletype['shape'] if defined
         """
         if ignore_air and material['mt_id'] == self.MT_AIR_CONTENT_ID:
             return None
 
+        # return cached variant
+
+        cache_key = (material['df_tuple'], tiletype['df_id'], shape)
+        tile_mat = self.tile_material_cache.get(cache_key)
+        if tile_mat is not None:
+            self.tile_material_cache_stats['hits'] += 1
+            return tile_mat
+        self.tile_material_cache_stats['misses'] += 1
+
+        if shape is not None:
+            tiletype = dict(tiletype, shape=shape)
+
+        # build variant
+
         tile_mat = copy.deepcopy(material)
         tile_mat['df_tile'] = {
             'shape': tiletype['shape'],
@@ -381,25 +1198,21 @@ class DwarftestTransformer(object):
         # return created/found material version
 
         if tile_mat['df_tuple'] not in self.material_df_lookup:
+            metrics.count('tile_material_variants')
             self.material_list.append(tile_mat)
             self.material_df_lookup[tile_mat['df_tuple']] = tile_mat
 
-        return self.material_df_lookup[tile_mat['df_tuple']]
+        tile_mat = self.tile_material_cache[cache_key] = self.material_df_lookup[tile_mat['df_tuple']]
+        return tile_mat
 
     # parse DF map
 
-    def df_tile_to_mt_nodes(self, tiletype, material, water_height, lava_height):
+    def df_tile_to_mt_fill(self, tiletype, material):
         """
         DF tile includes info about wall-level and floor-level. roof-level is defined by floor-level of tile above it.
 
-        This function should eventually be used to generate other shapes than just wall/floor.
-
-        :returns: [(node_pos_difference, mt_node), ...]
+        :returns: (fill_wall, fill_floor), materials or None for open space
         """
-        converted_nodes = []
-
-        self.get_tile_material(material, tiletype)
-
         #
         # Detect shape
         #
@@ -412,10 +1225,12 @@ class DwarftestTransformer(object):
         # Fortifications
         elif tiletype['shape'] in ['FORTIFICATION', ]:
             fill_wall = self.get_tile_material(material, tiletype)
-            fill_floor = self.get_tile_material(material, dict(tiletype, shape='FLOOR'))
+            fill_floor = self.get_tile_material(material, tiletype, shape='FLOOR')
 
         # Open space
         elif tiletype['shape'] in ['NONE', 'EMPTY', 'BROOK_TOP']:
+            # variant is not used by any node, but it is registered in material list like it always was
+            self.get_tile_material(material, tiletype)
             fill_wall = None
             fill_floor = None
 
@@ -432,7 +1247,7 @@ class DwarftestTransformer(object):
         # Stair Up / Ramp
         elif tiletype['shape'] in ['STAIR_UP', 'RAMP']:
             fill_wall = self.get_tile_material(material, tiletype)
-            fill_floor = self.get_tile_material(material, dict(tiletype, shape='FLOOR'))
+            fill_floor = self.get_tile_material(material, tiletype, shape='FLOOR')
 
         # Stair Down / Ramp Top
         elif tiletype['shape'] in ['STAIR_DOWN', 'RAMP_TOP']:
@@ -447,42 +1262,7 @@ class DwarftestTransformer(object):
         else:
             raise Exception('Unexpected tile shape "{}"'.format(tiletype['shape']))
 
-        #
-        # Detect MT content ids
-        #
-
-        if fill_wall:
-            wall_content_id = fill_wall['mt_id']
-        elif water_height:
-            wall_content_id = self.MT_WATER_CONTENT_ID
-        elif lava_height:
-            wall_content_id = self.MT_LAVA_CONTENT_ID
-        else:
-            wall_content_id = self.MT_AIR_CONTENT_ID
-
-        if fill_floor:
-            floor_content_id = fill_floor['mt_id']
-        elif water_height:
-            floor_content_id = self.MT_WATER_CONTENT_ID
-        elif lava_height:
-            floor_content_id = self.MT_LAVA_CONTENT_ID
-        else:
-            floor_content_id = self.MT_AIR_CONTENT_ID
-
-        #
-        # Build shape
-        #
-
-        for x in range(self.block_scale[0]):
-            for y in range(self.block_scale[1]):
-                for z in range(self.block_scale[2]):
-                    if z < self.complex_block_scale['tile_z_floor']:
-                        mt_node = (floor_content_id, 0, 0)
-                    else:
-                        mt_node = (wall_content_id, 0, 0)
-                    converted_nodes.append(((x, z, y), mt_node))
-
-        return converted_nodes
+        return fill_wall, fill_floor
 
     def parse_df_blocks(self, region_pos, block_list):
         """
@@ -527,45 +1307,125 @@ class DwarftestTransformer(object):
            'mapY': region_y_pos,
            'engravings': list of ???,
            'oceanWaves': list of ???,
+
+        Blocks can also be RemoteFortressReader MapBlock protobuf messages returned by call_method(), which
+        have same fields in snake_case (map_x, mat_type, ...).
         """
-        for block in block_list:
-            if len(block['materials']) != 256:
-                raise Exception(
-                    'List of block materials has invalid length! Try to restart Dwarf Fortress.'
-                )
+        with metrics.timer('transformer.parse_df_blocks'):
+            for block in block_list:
+                self.parse_df_block(region_pos, block)
+
+    @staticmethod
+    def get_df_block_map_pos(block):
+        """
+        :return: (map_x, map_y, map_z) of DF block dict or MapBlock message
+        """
+        if isinstance(block, dict):
+            return block['mapX'], block['mapY'], block['mapZ']
+        return block.map_x, block.map_y, block.map_z
 
-            for i in range(256):
-                # parse "tile" values
+    def get_df_block_arrays(self, block):
+        """
+        :return: dict of numpy arrays with value for every tile: tiles, mat_types, mat_indexes, water, magma
+        """
+        tile_count = self.DF_BLOCK_TILE_SIZE[0] * self.DF_BLOCK_TILE_SIZE[1]
+        materials = block['materials'] if isinstance(block, dict) else block.materials
+        if len(materials) != tile_count:
+            raise Exception(
+                'List of block materials has invalid length! Try to restart Dwarf Fortress.'
+            )
+
+        if not isinstance(block, dict):  # MapBlock message, repeated fields are read without conversion to dict
+            return {
+                'tiles': np.fromiter(block.tiles, dtype=np.int32, count=tile_count),
+                'mat_types': np.fromiter((m.mat_type for m in materials), dtype=np.int32, count=tile_count),
+                'mat_indexes': np.fromiter((m.mat_index for m in materials), dtype=np.int32, count=tile_count),
+                'water': np.fromiter(block.water, dtype=np.int32, count=tile_count),
+                'magma': np.fromiter(block.magma, dtype=np.int32, count=tile_count),
+            }
+
+        if isinstance(block['materials'], np.ndarray):  # loaded from DFBlockDump
+            mat_types = block['materials'][:, 0]
+            mat_indexes = block['materials'][:, 1]
+        else:
+            mat_types = np.fromiter((m['matType'] for m in block['materials']), dtype=np.int32, count=tile_count)
+            mat_indexes = np.fromiter((m['matIndex'] for m in block['materials']), dtype=np.int32, count=tile_count)
+
+        return {
+            'tiles': np.asarray(block['tiles'], dtype=np.int32),
+            'mat_types': mat_types,
+            'mat_indexes': mat_indexes,
+            'water': np.asarray(block['water'], dtype=np.int32),
+            'magma': np.asarray(block['magma'], dtype=np.int32),
+        }
 
-                tiletype = self.get_tiletype(block['tiles'][i])
-                mat = self.get_material(mat_dict=block['materials'][i])
+    def parse_df_block(self, region_pos, block):
+        """
+        Converts all tiles of DF block at once.
+        """
+        # convert tiles to content ids of wall and floor nodes
+
+        wall, floor = self.df_tiles_to_mt_content_ids(**self.get_df_block_arrays(block))
+
+        # expand tiles to nodes, result is indexed by [MT z, MT y, MT x]
+
+        scale_x, scale_y = self.complex_block_scale['tile_x'], self.complex_block_scale['tile_y']
+        tile_shape = (self.DF_BLOCK_TILE_SIZE[1], self.DF_BLOCK_TILE_SIZE[0])  # [DF y, DF x] = [MT z, MT x]
+
+        wall = np.repeat(np.repeat(wall.reshape(tile_shape), scale_y, axis=0), scale_x, axis=1)
+        floor = np.repeat(np.repeat(floor.reshape(tile_shape), scale_y, axis=0), scale_x, axis=1)
+        layers = [floor] * self.complex_block_scale['tile_z_floor'] + [wall] * self.complex_block_scale['tile_z_wall']
+
+        content_ids = np.stack(layers, axis=1)
+
+        # set nodes
+
+        mt_pos = self.df2mt_pos(region_pos, self.get_df_block_map_pos(block))
+        if self.voxel_volume is not None:
+            self.voxel_volume.set_nodes(mt_pos, content_ids)
+        else:
+            self.set_mt_nodes(mt_pos, content_ids)
+
+        metrics.count('df_blocks')
+        metrics.count('df_tiles', self.DF_BLOCK_TILE_SIZE[0] * self.DF_BLOCK_TILE_SIZE[1])
+
+    def df_tiles_to_mt_content_ids(self, tiles, mat_types, mat_indexes, water, magma):
+        """
+        Every distinct (tiletype, material) pair is resolved only once, in order of first occurrence,
+        so tile material variants are registered in same order as when converting tile by tile.
+
+        :return: (wall content ids, floor content ids), numpy arrays with value for every tile
+        """
+        keys = np.stack([tiles, mat_types, mat_indexes], axis=1)
+        pairs, first_index, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+
+        pair_fill = np.zeros((len(pairs), 2), dtype=np.uint16)
+        metrics.count('df_tile_material_pairs', len(pairs))
+        with metrics.timer('transformer.resolve_tile_materials'):
+            for i in np.argsort(first_index):
+                tiletype = self.get_tiletype(int(pairs[i][0]))
+                mat = self.get_material(mat_tuple=(int(pairs[i][1]), int(pairs[i][2])))
                 # layer_mat = self.get_material(mat_dict=block['layerMaterials'][i])  # useless?
                 # vain_mat = self.get_material(mat_dict=block['veinMaterials'][i])  # useless?
                 # base_mat = self.get_material(mat_dict=block['baseMaterials'][i])  # ground floor?
                 # cons_mat = self.get_material(mat_dict=block['constructionItems'][i])  # mat of construction
-                water_height = block['water'][i]
-                lava_height = block['magma'][i]
-
-                # convert tile to nodes
 
-                converted_nodes = self.df_tile_to_mt_nodes(tiletype, mat, water_height, lava_height)
+                fill_wall, fill_floor = self.df_tile_to_mt_fill(tiletype, mat)
+                if fill_wall:
+                    pair_fill[i, 0] = self.content_registry.get_id(fill_wall['mt_id'])
+                if fill_floor:
+                    pair_fill[i, 1] = self.content_registry.get_id(fill_floor['mt_id'])
 
-                # set nodes
+        inverse = inverse.reshape(-1)
+        wall = pair_fill[inverse, 0]
+        floor = pair_fill[inverse, 1]
 
-                tile_pos = (
-                    int(i % self.DF_BLOCK_TILE_SIZE[0]) + block['mapX'],
-                    int(i / self.DF_BLOCK_TILE_SIZE[0]) + block['mapY'],
-                    int(i / (self.DF_BLOCK_TILE_SIZE[0] * self.DF_BLOCK_TILE_SIZE[1])) + block['mapZ'],
-                )
+        # open space is filled with liquid or air
+        liquid = np.where(water > 0, self.mt_water_id, np.where(magma > 0, self.mt_lava_id, self.mt_air_id))
+        wall = np.where(wall != self.content_registry.UNSET_ID, wall, liquid).astype(np.uint16)
+        floor = np.where(floor != self.content_registry.UNSET_ID, floor, liquid).astype(np.uint16)
 
-                mt_pos = self.df2mt_pos(region_pos, tile_pos)
-                for node_pos, mt_node in converted_nodes:
-                    mt_node_pos = (
-                        mt_pos[0] + node_pos[0],
-                        mt_pos[1] + node_pos[1],
-                        mt_pos[2] + node_pos[2],
-                    )
-                    self.set_mt_node(mt_node_pos, mt_node)
+        return wall, floor
 
     # def parse_df_tile_layers(self, region_pos, tile_layers):  # TODO: might be wrong use of data?
     #     """
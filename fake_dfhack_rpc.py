@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import logging
+import re
+import time
+import types
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+
+class WaveNoise(object):
+    """
+    Smooth deterministic noise made of plane waves with random directions, values have roughly unit variance.
+    """
+
+    def __init__(self, rng, dimensions, scale, count=8):
+        directions = rng.normal(size=(count, dimensions))
+        self.directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+        self.frequencies = rng.uniform(0.5, 1.5, size=count) * 2 * np.pi / scale
+        self.phases = rng.uniform(0, 2 * np.pi, size=count)
+
+    def __call__(self, *coords):
+        value = 0.0
+        for direction, frequency, phase in zip(self.directions, self.frequencies, self.phases):
+            projection = sum(d * c for d, c in zip(direction, coords))
+            value = value + np.sin(projection * frequency + phase)
+        return value * np.sqrt(2.0 / len(self.phases))
+
+
+class SyntheticDFMap(object):
+    """
+    Generates embark with layered soil and stone, caverns, magma sea, lakes, trees and small fortification.
+    Payloads have same format as results of GetTiletypeList, GetMaterialList and GetBlockList.
+    """
+    BLOCK_TILE_SIZE = 16
+
+    # name: (shape, material, special)
+    TILETYPES = {
+        'OpenSpace': ('EMPTY', 'AIR', 'NONE'),
+        'StoneWall': ('WALL', 'STONE', 'NORMAL'),
+        'StoneFloor1': ('FLOOR', 'STONE', 'NORMAL'),
+        'StoneBoulder': ('BOULDER', 'STONE', 'NORMAL'),
+        'StoneStairUD': ('STAIR_UPDOWN', 'STONE', 'NORMAL'),
+        'MineralWall': ('WALL', 'MINERAL', 'NORMAL'),
+        'SoilWall': ('WALL', 'SOIL', 'NORMAL'),
+        'SoilFloor1': ('FLOOR', 'SOIL', 'NORMAL'),
+        'SoilRamp': ('RAMP', 'SOIL', 'NORMAL'),
+        'RampTop': ('RAMP_TOP', 'AIR', 'NONE'),
+        'GrassLightFloor1': ('FLOOR', 'GRASS_LIGHT', 'NORMAL'),
+        'GrassDarkFloor1': ('FLOOR', 'GRASS_DARK', 'NORMAL'),
+        'Shrub': ('SHRUB', 'PLANT', 'NORMAL'),
+        'TreeTrunkPillar': ('TREE_SHAPE', 'TREE_MATERIAL', 'NORMAL'),
+        'TreeBranches': ('BRANCH', 'TREE_MATERIAL', 'NORMAL'),
+        'TreeTwigs': ('TWIG', 'TREE_MATERIAL', 'NORMAL'),
+        'ConstructedWall': ('WALL', 'CONSTRUCTION', 'NORMAL'),
+        'ConstructedFortification': ('FORTIFICATION', 'CONSTRUCTION', 'NORMAL'),
+        'ConstructedFloor': ('FLOOR', 'CONSTRUCTION', 'NORMAL'),
+    }
+
+    STONES = ['GRANITE', 'DIORITE', 'GABBRO', 'BASALT', 'LIMESTONE', 'SANDSTONE', 'MARBLE', 'SLATE']
+    SOILS = ['LOAM', 'SANDY_CLAY', 'SILT', 'PEAT']
+    MINERALS = ['NATIVE_GOLD', 'HEMATITE', 'MAGNETITE', 'GALENA', 'COAL_BITUMINOUS']
+    TREES = ['OAK', 'PINE', 'WILLOW']
+    GRASSES = ['GRASS_TEMPERATE', 'BLUEGRASS']
+
+    AIR_MAT = (-1, -1)
+    PLANT_MAT_TYPE = 419
+
+    def __init__(self, block_size_x=4, block_size_y=4, block_size_z=48, seed=0):
+        """
+        :param block_size_x, block_size_y: embark size in DF blocks of 16x16 tiles
+        :param block_size_z: number of z levels
+        """
+        self.block_size = (block_size_x, block_size_y, block_size_z)
+        self.tile_size = (block_size_x * self.BLOCK_TILE_SIZE, block_size_y * self.BLOCK_TILE_SIZE)
+
+        rng = np.random.RandomState(seed)
+
+        self.build_tiletype_list()
+        self.build_material_list()
+
+        # column fields, indexed by [DF y, DF x]
+
+        size_z = block_size_z
+        self.tile_y, self.tile_x = np.mgrid[0:self.tile_size[1], 0:self.tile_size[0]]
+        tx, ty = self.tile_x, self.tile_y
+
+        self.surface_z = np.clip(
+            np.round(size_z * 0.75 + WaveNoise(rng, 2, 64)(tx, ty) * max(size_z * 0.06, 1)), 4, size_z - 8
+        ).astype(np.int32)
+        self.soil_depth = (2 + np.round(np.abs(WaveNoise(rng, 2, 24)(tx, ty)) * 2)).astype(np.int32)
+        self.layer_offset = np.round(WaveNoise(rng, 2, 48)(tx, ty) * 2).astype(np.int32)
+        self.dark_grass = WaveNoise(rng, 2, 16)(tx, ty) > 0.5
+        self.shrubs = rng.rand(*tx.shape) < 0.03
+        self.boulders = rng.rand(*tx.shape) < 0.005
+        self.water_level = int(np.percentile(self.surface_z, 15))
+
+        # ramps on slopes, where some neighbour column is higher
+        padded = np.pad(self.surface_z, 1, mode='edge')
+        higher = np.zeros(self.surface_z.shape, dtype=bool)
+        for dy, dx in [(0, 1), (2, 1), (1, 0), (1, 2)]:
+            higher |= padded[dy:dy + self.tile_size[1], dx:dx + self.tile_size[0]] > self.surface_z
+        self.ramps = higher
+
+        # trees, trunk height and canopy level and distance from trunk for every column
+        self.tree_height = np.zeros(tx.shape, dtype=np.int32)
+        self.tree_material = np.zeros(tx.shape, dtype=np.int32)
+        self.canopy_z = np.full(tx.shape, -1000, dtype=np.int32)
+        self.canopy_dist = np.full(tx.shape, 1000, dtype=np.int32)
+
+        tree_mask = (rng.rand(*tx.shape) < 0.01) & (self.surface_z > self.water_level) & ~self.ramps
+        for y, x in zip(*np.nonzero(tree_mask)):
+            height = rng.randint(3, 6)
+            self.tree_height[y, x] = height
+            self.tree_material[y, x] = rng.randint(len(self.TREES))
+            top = self.surface_z[y, x] + height
+
+            area = (slice(max(y - 2, 0), y + 3), slice(max(x - 2, 0), x + 3))
+            dist = np.maximum(np.abs(self.tile_y[area] - y), np.abs(self.tile_x[area] - x))
+            closer = dist < self.canopy_dist[area]
+            self.canopy_dist[area] = np.where(closer, dist, self.canopy_dist[area])
+            self.canopy_z[area] = np.where(closer, top, self.canopy_z[area])
+            self.tree_material[area] = np.where(closer, self.tree_material[y, x], self.tree_material[area])
+
+        # small fortification in the middle of embark, with stair shaft down to the caverns
+        center = (self.tile_size[1] // 2, self.tile_size[0] // 2)
+        dist = np.maximum(np.abs(ty - center[0]), np.abs(tx - center[1]))
+        self.fort_z = int(self.surface_z[center])
+        self.fort_walls = dist == 6
+        self.fort_fortifications = self.fort_walls & ((tx + ty) % 3 == 0)
+        self.fort_floor = dist < 6
+        self.shaft = (ty == center[0]) & (tx == center[1])
+
+        # caverns, magma sea
+        self.cavern_band = (max(int(size_z * 0.25), 3), max(int(size_z * 0.45), 4))
+        self.cavern_water_z = self.cavern_band[0] + 1
+        self.cavern_noise = WaveNoise(rng, 3, 20)
+        self.mineral_noise = WaveNoise(rng, 3, 6)
+        self.magma_z = 1
+
+        # changes of generated map, see set_tile()
+        # key: (block x, block y, z), value: dict of tile index: (tiletype, material, water, magma)
+        self.tile_overrides = {}
+        self.block_versions = {}  # key: (block x, block y, z), value: number of changes of block
+
+    def build_tiletype_list(self):
+        self.tiletype_list = []
+        self.tiletype_ids = {}
+        for name, (shape, material, special) in self.TILETYPES.items():
+            self.tiletype_ids[name] = len(self.tiletype_list)
+            self.tiletype_list.append({
+                'id': len(self.tiletype_list),
+                'name': name,
+                'caption': re.sub(r'(?<!^)([A-Z])', r' \1', name).lower(),
+                'shape': shape,
+                'special': special,
+                'material': material,
+                'variant': 'VAR_1' if shape in ['FLOOR', 'WALL'] else 'NO_VARIANT',
+                'direction': '--------',
+            })
+
+    def build_material_list(self):
+        self.material_list = []
+        self.material_ids = {}  # key: name used by generator, value: (mat_type, mat_index)
+
+        def add(name, df_id, mat_type, mat_index, color):
+            self.material_ids[name] = (mat_type, mat_index)
+            self.material_list.append({
+                'matPair': {'matType': mat_type, 'matIndex': mat_index},
+                'id': df_id,
+                'name': name.lower().replace('_', ' '),
+                'stateColor': {'red': color[0], 'green': color[1], 'blue': color[2]},
+            })
+
+        add('AIR', 'AIR', self.AIR_MAT[0], self.AIR_MAT[1], (0, 0, 0))
+
+        inorganic = [(name, (110 + 15 * i, 100 + 10 * i, 90 + 5 * i)) for i, name in enumerate(self.STONES)] + \
+            [(name, (140, 90 + 20 * i, 40)) for i, name in enumerate(self.SOILS)] + \
+            [(name, (200, 150 + 20 * i, 30)) for i, name in enumerate(self.MINERALS)]
+        for i, (name, color) in enumerate(inorganic):
+            add(name, 'INORGANIC:{}'.format(name), 0, i, color)
+
+        plants = [(name, '{}:WOOD'.format(name), (120, 80, 40)) for name in self.TREES] + \
+            [(name, '{}:LEAF'.format(name), (40, 140, 40)) for name in self.GRASSES]
+        for i, (name, suffix, color) in enumerate(plants):
+            add(name, 'PLANT:{}'.format(suffix), self.PLANT_MAT_TYPE + i, 0, color)
+
+    def get_block(self, x, y, z):
+        """
+        :param x, y: DF block position
+        :param z: DF z level
+        :return: MapBlock dict in format of GetBlockList result
+        """
+        bs = self.BLOCK_TILE_SIZE
+        area = (slice(y * bs, (y + 1) * bs), slice(x * bs, (x + 1) * bs))
+        surface = self.surface_z[area]
+        soil_bottom = surface - self.soil_depth[area]
+        tx, ty = self.tile_x[area], self.tile_y[area]
+        shape = surface.shape
+        t = self.tiletype_ids
+
+        tiles = np.full(shape, t['OpenSpace'], dtype=np.int32)
+        mat_type = np.full(shape, self.AIR_MAT[0], dtype=np.int32)
+        mat_index = np.full(shape, self.AIR_MAT[1], dtype=np.int32)
+        water = np.zeros(shape, dtype=np.int32)
+        magma = np.zeros(shape, dtype=np.int32)
+
+        def put(mask, tiletype, material):
+            tiles[mask] = t[tiletype]
+            mat = self.material_ids[material] if isinstance(material, str) else material
+            mat_type[mask] = mat[0]
+            mat_index[mask] = mat[1]
+
+        def put_materials(mask, tiletype, names, index):
+            for i, name in enumerate(names):
+                put(mask & (index % len(names) == i), tiletype, name)
+
+        # stone layers, mineral veins, soil
+
+        stone = z < soil_bottom
+        put_materials(stone, 'StoneWall', self.STONES, (z + self.layer_offset[area]) // 4)
+        put_materials(stone & (self.mineral_noise(tx, ty, z) > 1.6), 'MineralWall', self.MINERALS, tx // 8 + ty // 8)
+        put_materials((z >= soil_bottom) & (z < surface), 'SoilWall', self.SOILS, surface - z - 1)
+
+        # surface
+
+        floor = z == surface
+        put(floor & ~self.dark_grass[area], 'GrassLightFloor1', self.GRASSES[0])
+        put(floor & self.dark_grass[area], 'GrassDarkFloor1', self.GRASSES[1])
+        put(floor & self.shrubs[area], 'Shrub', self.GRASSES[0])
+        put(floor & self.boulders[area], 'StoneBoulder', self.STONES[0])
+        put(floor & (surface <= self.water_level), 'SoilFloor1', self.SOILS[0])
+        put(floor & self.ramps[area], 'SoilRamp', self.SOILS[0])
+        put((z == surface + 1) & self.ramps[area], 'RampTop', 'AIR')
+
+        open_air = z > surface
+        water[(open_air | floor) & (z <= self.water_level)] = 7
+
+        # trees
+
+        tree_materials = self.tree_material[area]
+        canopy_dz = np.abs(z - self.canopy_z[area])
+        canopy_dist = self.canopy_dist[area]
+        for i, name in enumerate(self.TREES):
+            is_tree = (tree_materials == i) & open_air
+            put(is_tree & (canopy_dz <= 1) & (canopy_dist == 1), 'TreeBranches', name)
+            put(is_tree & (((canopy_dz <= 1) & (canopy_dist == 2)) | ((z == self.canopy_z[area] + 1) &
+                                                                      (canopy_dist == 0))), 'TreeTwigs', name)
+            put(is_tree & (z <= surface + self.tree_height[area]), 'TreeTrunkPillar', name)
+
+        # fortification
+
+        if self.fort_z < z <= self.fort_z + 3:
+            put(self.fort_walls[area], 'ConstructedWall', self.STONES[0])
+            put(self.fort_fortifications[area], 'ConstructedFortification', self.STONES[0])
+        elif z == self.fort_z:
+            put(self.fort_floor[area], 'ConstructedFloor', self.STONES[0])
+
+        # caverns with lake at the bottom, stair shaft from fortification
+
+        if self.cavern_band[0] <= z < self.cavern_band[1]:
+            cavern = stone & (self.cavern_noise(tx, ty, z) > 0.8)
+            cavern_below = (z - 1 >= self.cavern_band[0]) & (self.cavern_noise(tx, ty, z - 1) > 0.8)
+            put(cavern, 'OpenSpace', 'AIR')
+            put(cavern & ~cavern_below, 'StoneFloor1', self.STONES[z % len(self.STONES)])
+            water[cavern & (z <= self.cavern_water_z)] = 7
+
+        put(self.shaft[area] & (z >= self.cavern_band[0]) & (z <= self.fort_z), 'StoneStairUD', self.STONES[0])
+
+        # magma sea
+
+        if z == self.magma_z:
+            put(np.ones(shape, dtype=bool), 'OpenSpace', 'AIR')
+            magma[:] = 7
+
+        # tiles changed by set_tile()
+
+        for index, (tiletype, material, water_level, magma_level) in self.tile_overrides.get((x, y, z), {}).items():
+            tile = np.unravel_index(index, shape)
+            tiles[tile] = t[tiletype]
+            mat_type[tile], mat_index[tile] = self.material_ids[material]
+            water[tile] = water_level
+            magma[tile] = magma_level
+
+        return {
+            'mapX': x * bs,
+            'mapY': y * bs,
+            'mapZ': z,
+            'tiles': tiles.reshape(-1).tolist(),
+            'materials': [{'matType': mat[0], 'matIndex': mat[1]}
+                          for mat in zip(mat_type.reshape(-1).tolist(), mat_index.reshape(-1).tolist())],
+            'water': water.reshape(-1).tolist(),
+            'magma': magma.reshape(-1).tolist(),
+            'hidden': [False] * (bs * bs),
+        }
+
+    def get_tile(self, x, y, z):
+        """
+        :param x, y: DF tile position
+        :param z: DF z level
+        :return: (tiletype name, material name, water, magma) of tile
+        """
+        bs = self.BLOCK_TILE_SIZE
+        block = self.get_block(x // bs, y // bs, z)
+        index = (y % bs) * bs + x % bs
+
+        mat = block['materials'][index]
+        material = next(name for name, pair in self.material_ids.items() if pair == (mat['matType'], mat['matIndex']))
+        return self.tiletype_list[block['tiles'][index]]['name'], material, block['water'][index], block['magma'][index]
+
+    def set_tile(self, x, y, z, tiletype, material, water=0, magma=0):
+        """
+        Changes tile of generated map, like fortress activity (digging, constructions, liquid flow) does.
+
+        :param x, y: DF tile position
+        :param z: DF z level
+        :param tiletype: name from TILETYPES
+        :param material: name of material used by generator, e.g. 'GRANITE' or 'AIR'
+        """
+        bs = self.BLOCK_TILE_SIZE
+        key = (x // bs, y // bs, z)
+        self.tile_overrides.setdefault(key, {})[(y % bs) * bs + x % bs] = (tiletype, material, water, magma)
+        self.block_versions[key] = self.block_versions.get(key, 0) + 1
+
+    def get_block_list(self, min_x, max_x, min_y, max_y, min_z, max_z):
+        """
+        :return: BlockList dict with blocks in given range, max values are exclusive
+        """
+        blocks = []
+        for x in range(max(min_x, 0), min(max_x, self.block_size[0])):
+            for y in range(max(min_y, 0), min(max_y, self.block_size[1])):
+                for z in range(max(min_z, 0), min(max_z, self.block_size[2])):
+                    blocks.append(self.get_block(x, y, z))
+        return {'mapBlocks': blocks, 'mapX': 0, 'mapY': 0}
+
+
+class SyntheticFortressActivity(object):
+    """
+    Scripted changes of SyntheticDFMap around its fortification, used to test live sync. Walls are dug out to floors,
+    open tiles get constructed walls or water. Changes are random but same for same seed.
+    """
+    # floor left by digging of wall
+    DUG_FLOORS = {
+        'StoneWall': 'StoneFloor1',
+        'MineralWall': 'StoneFloor1',
+        'SoilWall': 'SoilFloor1',
+        'ConstructedWall': 'ConstructedFloor',
+    }
+
+    def __init__(self, synthetic_map, events_per_second=2.0, radius=12, seed=1):
+        """
+        :param radius: max horizontal distance of changed tiles from center of embark
+        """
+        self.synthetic_map = synthetic_map
+        self.events_per_second = events_per_second
+        self.radius = radius
+        self.rng = np.random.RandomState(seed)
+        self.start_time = None
+        self.events = 0
+
+    def apply_events(self, count):
+        """
+        :return: list of (x, y, z, tiletype) of changed tiles
+        """
+        m = self.synthetic_map
+        center = (m.tile_size[0] // 2, m.tile_size[1] // 2)
+        changes = []
+
+        for _ in range(count):
+            x = int(np.clip(center[0] + self.rng.randint(-self.radius, self.radius + 1), 0, m.tile_size[0] - 1))
+            y = int(np.clip(center[1] + self.rng.randint(-self.radius, self.radius + 1), 0, m.tile_size[1] - 1))
+            z = int(np.clip(m.fort_z + self.rng.randint(-8, 4), 0, m.block_size[2] - 1))
+            tiletype, material, water, _ = m.get_tile(x, y, z)
+
+            if tiletype in self.DUG_FLOORS:  # dig designation completed
+                tiletype = self.DUG_FLOORS[tiletype]
+            elif tiletype == 'OpenSpace' and self.rng.rand() < 0.5:  # construction
+                tiletype, material, water = 'ConstructedWall', m.STONES[0], 0
+            elif tiletype == 'OpenSpace' or tiletype.endswith('Floor1'):  # liquid flow
+                water = 0 if water else 7
+            else:
+                continue
+
+            m.set_tile(x, y, z, tiletype, material, water=water)
+            changes.append((x, y, z, tiletype))
+
+        self.events += count
+        return changes
+
+    def update(self):
+        """
+        Applies events due since first update.
+        """
+        now = time.time()
+        if self.start_time is None:
+            self.start_time = now
+        due = int((now - self.start_time) * self.events_per_second) - self.events
+        if due > 0:
+            self.apply_events(due)
+
+
+def dict_to_message(value):
+    """
+    Converts result dict into object with attributes named like protobuf message fields (mapBlocks -> map_blocks).
+    """
+    if isinstance(value, dict):
+        return types.SimpleNamespace(**{
+            re.sub(r'([A-Z])', lambda m: '_' + m.group(1).lower(), key): dict_to_message(val)
+            for key, val in value.items()
+        })
+    if isinstance(value, list) and value and isinstance(value[0], dict):
+        return [dict_to_message(val) for val in value]
+    return value
+
+
+def message_to_input_dict(message):
+    """
+    Converts input message into dict accepted by call_method_dict() (min_x -> minX).
+    """
+    if message is None:
+        return None
+    if hasattr(message, 'DESCRIPTOR'):
+        from google.protobuf import json_format
+        return json_format.MessageToDict(message)
+    return {
+        re.sub(r'_([a-z])', lambda m: m.group(1).upper(), key): val
+        for key, val in vars(message).items()
+    }
+
+
+class FakeDFHackRPC(object):
+    """
+    Stand-in for DFHackRPC serving SyntheticDFMap, implements only methods used by main.py.
+    call_method() takes input message and returns objects with message-like attributes, call_method_dict() takes
+    and returns dicts.
+
+    Like RemoteFortressReader, GetBlockList returns only blocks that changed since they were returned last time.
+    """
+
+    def __init__(self, synthetic_map, activity=None):
+        """
+        :param activity: SyntheticFortressActivity changing map before every GetBlockList call
+        """
+        self.synthetic_map = synthetic_map
+        self.activity = activity
+        self.sent_block_versions = {}  # key: (block x, block y, z), value: version of block returned last time
+
+    def bind_all_methods(self):
+        pass
+
+    def close_connection(self):
+        pass
+
+    def call_method(self, name, input_msg=None):
+        """
+        :param input_msg: protobuf message or object with message-like attributes (see build_block_request())
+        :return: (result object with message-like attributes, text), text is always None
+        """
+        result, text = self.call_method_dict(name, message_to_input_dict(input_msg))
+        return dict_to_message(result), text
+
+    def call_method_dict(self, name, input_dict=None):
+        """
+        :return: (result dict, text), text is always None
+        """
+        _logger.debug('Fake RPC call {}({})'.format(name, input_dict))
+        m = self.synthetic_map
+        input_dict = input_dict or {}
+
+        if name in ['GetVersion', 'GetDFVersion']:
+            result = {'value': 'synthetic'}
+        elif name == 'GetVersionInfo':
+            result = {'remoteFortressReaderVersion': 'synthetic'}
+        elif name == 'GetMapInfo':
+            result = {
+                'blockSizeX': m.block_size[0], 'blockSizeY': m.block_size[1], 'blockSizeZ': m.block_size[2],
+                'blockPosX': 0, 'blockPosY': 0, 'blockPosZ': 0,
+                'worldName': 'Synthetic', 'worldNameEnglish': 'Synthetic',
+                'saveName': 'synthetic_{}x{}x{}'.format(*m.block_size),
+            }
+        elif name == 'GetEmbarkInfo':
+            result = {
+                'available': True, 'regionX': 0, 'regionY': 0,
+                'regionSizeX': m.block_size[0] // 3, 'regionSizeY': m.block_size[1] // 3,
+            }
+        elif name == 'GetWorldMap':
+            result = {'centerX': 0, 'centerY': 0, 'centerZ': 0}
+        elif name == 'GetTiletypeList':
+            result = {'tiletypeList': m.tiletype_list}
+        elif name == 'GetMaterialList':
+            result = {'materialList': m.material_list}
+        elif name == 'GetBlockList':
+            if self.activity is not None:
+                self.activity.update()
+            result = self.get_changed_block_list(
+                input_dict.get('minX', 0), input_dict.get('maxX', m.block_size[0]),
+                input_dict.get('minY', 0), input_dict.get('maxY', m.block_size[1]),
+                input_dict.get('minZ', 0), input_dict.get('maxZ', m.block_size[2]),
+            )
+        else:
+            raise Exception('Method {} is not implemented by fake DFHack RPC'.format(name))
+
+        return result, None
+
+    def get_changed_block_list(self, min_x, max_x, min_y, max_y, min_z, max_z):
+        """
+        :return: BlockList dict with blocks in given range that were not returned yet in their current version
+        """
+        m = self.synthetic_map
+        blocks = []
+        for x in range(max(min_x, 0), min(max_x, m.block_size[0])):
+            for y in range(max(min_y, 0), min(max_y, m.block_size[1])):
+                for z in range(max(min_z, 0), min(max_z, m.block_size[2])):
+                    version = m.block_versions.get((x, y, z), 0)
+                    if self.sent_block_versions.get((x, y, z)) != version:
+                        blocks.append(m.get_block(x, y, z))
+                        self.sent_block_versions[(x, y, z)] = version
+        return {'mapBlocks': blocks, 'mapX': 0, 'mapY': 0}
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import time
+import logging
+
+import metrics
+from remote_fortress_reader import get_block_list, get_map_blocks
+
+_logger = logging.getLogger(__name__)
+
+
+class LiveSync(object):
+    """
+    Mirrors running fortress into converted world. RemoteFortressReader returns from GetBlockList only DF blocks
+    that changed since they were returned last time, so every cycle polls map and converts only returned
+    DF blocks. MT blocks with nodes of changed DF blocks are loaded from map database, patched and written again.
+
+    Polling costs one GetBlockList request per batch of DF block columns, by default one request per column, so
+    cycle of whole map is O(map size) even if nothing changed. Window limits number of requests per cycle, following
+    cycles continue where previous one stopped and whole map is polled once every (batches / window) cycles.
+
+    Transformer has to use manifest of converted world, see DwarftestTransformer.set_manifest(). Blocks loaded
+    by running Minetest server are not reloaded from database.
+    """
+
+    def __init__(self, rpc, transformer, region_pos, block_size, request_message=False, batch_size=(1, 1), window=0,
+                 build_material_mod=None):
+        """
+        :param block_size: (x, y, z) size of DF map in DF blocks
+        :param request_message: call GetBlockList with BlockRequest message, see get_block_list()
+        :param batch_size: (x, y) number of DF block columns requested by one GetBlockList
+        :param window: max number of GetBlockList requests per cycle, 0 polls whole map every cycle
+        :param build_material_mod: function() called when changed DF blocks registered new materials
+        """
+        self.rpc = rpc
+        self.transformer = transformer
+        self.region_pos = region_pos
+        self.block_size = block_size
+        self.request_message = request_message
+        self.batch_size = batch_size
+        self.window = window
+        self.build_material_mod = build_material_mod
+
+        self.cycles = 0
+        self.batches = self.get_batches()
+        self.next_batch = 0
+
+    def get_batches(self):
+        """
+        :return: list of (min_x, max_x, min_y, max_y) DF block ranges of GetBlockList requests covering whole map
+        """
+        batches = []
+        for x in range(0, self.block_size[0], self.batch_size[0]):
+            for y in range(0, self.block_size[1], self.batch_size[1]):
+                batches.append((x, min(x + self.batch_size[0], self.block_size[0]),
+                                y, min(y + self.batch_size[1], self.block_size[1])))
+        return batches
+
+    def poll_df_blocks(self):
+        """
+        Requests whole map, or next `window` batches of it, one batch of DF block columns at a time.
+
+        :return: list of MapBlock messages changed since last poll
+        """
+        count = len(self.batches)
+        if self.window:
+            count = min(self.window, count)
+
+        blocks = []
+        for i in range(count):
+            min_x, max_x, min_y, max_y = self.batches[(self.next_batch + i) % len(self.batches)]
+            with metrics.timer('rpc.GetBlockList', histogram=True):
+                block_list = get_block_list(self.rpc, min_x, max_x, min_y, max_y, 0, self.block_size[2],
+                                            request_message=self.request_message)
+            blocks.extend(get_map_blocks(block_list))
+
+        self.next_batch = (self.next_batch + count) % len(self.batches)
+        metrics.count('live_sync_requests', count)
+        return blocks
+
+    def run_cycle(self):
+        """
+        :return: dict with stats of cycle
+        """
+        dt = self.transformer
+        mw = dt.minetest_world
+        start = time.perf_counter()
+
+        blocks = self.poll_df_blocks()
+        polled = time.perf_counter()
+
+        materials = len(dt.material_list)
+        rows = mw.map_write_stats['rows']
+        changed = dt.update_df_blocks(self.region_pos, blocks) if blocks else 0
+        converted = time.perf_counter()
+
+        new_materials = len(dt.material_list) - materials
+        if new_materials and self.build_material_mod is not None:
+            self.build_material_mod()
+
+        self.cycles += 1
+        metrics.count('live_sync_df_blocks', changed)
+
+        return {
+            'cycle': self.cycles,
+            'df_blocks': len(blocks),
+            'df_blocks_changed': changed,
+            'mt_blocks': mw.map_write_stats['rows'] - rows,
+            'new_materials': new_materials,
+            'poll_seconds': polled - start,
+            'convert_seconds': converted - polled,
+            'seconds': time.perf_counter() - start,
+        }
+
+    def run(self, interval=1.0, cycles=0, report=None):
+        """
+        Runs cycles until interrupted, new cycle starts `interval` seconds after start of previous one (or
+        immediately after slower cycle), so changes are written with latency of at most two cycles.
+
+        :param cycles: number of cycles, 0 runs until KeyboardInterrupt
+        :param report: function(stats) called after every cycle
+        """
+        try:
+            while not cycles or self.cycles < cycles:
+                start = time.perf_counter()
+                stats = self.run_cycle()
+                if report is not None:
+                    report(stats)
+                _logger.debug('Live sync cycle {cycle}: {df_blocks_changed} DF blocks changed'.format(**stats))
+
+                if not cycles or self.cycles < cycles:
+                    time.sleep(max(0.0, interval - (time.perf_counter() - start)))
+        except KeyboardInterrupt:
+            print('Live sync stopped')
@@ -3,16 +3,22 @@
 
 import logging
 import argparse
-import json
+import re
+import cProfile
 import sys
 import os
 import shutil
 
 from minetest_world import MinetestWorld
 from dwarftest_transformer import DwarftestTransformer
-
-sys.path.append(os.path.join(os.path.dirname(__file__), './DFHackRPC'))
-from dfhack_rpc import DFHackRPC
+from df_block_prefetcher import DFBlockPrefetcher, iter_df_block_positions
+from df_block_dump import DFBlockDump
+from parallel_conversion import convert_parallel
+from conversion_manifest import ConversionManifest
+from voxel_volume import VoxelVolume
+from live_sync import LiveSync
+from remote_fortress_reader import get_block_list, get_map_blocks
+import metrics
 
 
 def main():  # TODO: map is flipped on X axis!!!
@@ -47,8 +53,149 @@ def main():  # TODO: map is flipped on X axis!!!
         '--path',
         default='./build',
     )
+    parser.add_argument(
+        '--prefetch_depth',
+        type=int, default=8, help='Number of DF blocks loaded ahead of conversion, 0 disables prefetching. '
+                                  'Default is 8'
+    )
+    parser.add_argument(
+        '--skip_air_blocks',
+        action='store_true', help='Do not write MT blocks made only of air, world will use singlenode mapgen'
+    )
+    parser.add_argument(
+        '--spread_undefined_nodes',
+        action='store_true', help='Fill MT nodes outside of DF map with neighbouring nodes instead of air'
+    )
+    parser.add_argument(
+        '--compute_lighting',
+        action='store_true', help='Write blocks with computed light, so that fixlight is not needed'
+    )
+    parser.add_argument(
+        '--prune_materials',
+        action='store_true', help='Write only materials used in map blocks into material_list.json, '
+                                  'speeds up start of Minetest server'
+    )
+    parser.add_argument(
+        '--material_list_format',
+        choices=DwarftestTransformer.MATERIAL_LIST_FORMATS, default='lua',
+        help='Format of material list read by world mod, lua is loaded faster. Default is lua'
+    )
+    parser.add_argument(
+        '--bake_textures',
+        action='store_true', help='Write colorized node textures into world mod instead of colorizing them in '
+                                  'clients, unchanged textures are kept from previous builds. Requires Pillow'
+    )
+    parser.add_argument(
+        '--texture_workers',
+        type=int, default=4, help='Number of threads writing baked textures. Default is 4'
+    )
+    parser.add_argument(
+        '--compression_level',
+        type=int, default=-1, choices=range(-1, 10), metavar='{-1..9}',
+        help='zlib level of map blocks, lower levels are faster but make bigger map.sqlite. '
+             'Default is -1 (zlib default, same as 6)'
+    )
+    parser.add_argument(
+        '--compression_workers',
+        type=int, default=4, help='Number of threads compressing map blocks, 0 compresses them in main thread. '
+                                  'Default is 4'
+    )
+    parser.add_argument(
+        '--map_sqlite_pragma',
+        action='append', default=[], metavar='NAME=VALUE',
+        help='Override map.sqlite pragma set for conversion, can be repeated, e.g. --map_sqlite_pragma '
+             'synchronous=NORMAL. Defaults are page_size=16384, journal_mode=WAL, synchronous=OFF and '
+             'cache_size=-131072 (KiB). synchronous=OFF is fastest, but map.sqlite can be corrupted if converter '
+             'or system crashes while writing, use NORMAL or FULL for worlds that can not be converted again'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int, default=0, help='Number of worker processes used for conversion, requires --load_dump. '
+                                  'Default is 0 (conversion in main process)'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true', help='Convert only DF blocks that changed since last conversion into same world and '
+                                  'patch affected MT blocks, also resumes interrupted conversion'
+    )
+    parser.add_argument(
+        '--voxel_volume',
+        action='store_true', help='Write DF blocks into memory mapped volume in world directory first and emit '
+                                  'MT blocks from it in second pass'
+    )
+    parser.add_argument(
+        '--reuse_voxel_volume',
+        action='store_true', help='Emit MT blocks from volume written by previous --voxel_volume conversion '
+                                  'without fetching DF blocks'
+    )
+    parser.add_argument(
+        '--follow',
+        action='store_true', help='After conversion keep polling DFHack and convert DF blocks changed in running '
+                                  'fortress, implies --incremental. With --synthetic, synthetic fortress is changed '
+                                  'by scripted activity. Every cycle polls whole map with one GetBlockList request '
+                                  'per DF block column, X*Y requests even if nothing changed, see --follow_batch and '
+                                  '--follow_window'
+    )
+    parser.add_argument(
+        '--follow_interval',
+        type=float, default=1.0, help='Seconds between starts of --follow poll cycles. Default is 1.0'
+    )
+    parser.add_argument(
+        '--follow_cycles',
+        type=int, default=0, help='Number of --follow poll cycles. Default is 0 (until interrupted)'
+    )
+    parser.add_argument(
+        '--follow_batch',
+        metavar='X,Y', default='1,1', help='Number of DF block columns requested by one --follow GetBlockList '
+                                           'request, fewer but bigger requests. Default is 1,1'
+    )
+    parser.add_argument(
+        '--follow_window',
+        type=int, default=0, help='Max number of GetBlockList requests per --follow cycle, next cycle continues '
+                                  'where previous one stopped. Default is 0 (whole map every cycle)'
+    )
+    parser.add_argument(
+        '--block_request_message',
+        action='store_true', help='Request DF blocks with BlockRequest message instead of dict, skips slow conversion '
+                                  'of BlockList into dict. Not tested with DFHack yet, always used with --synthetic'
+    )
+    parser.add_argument(
+        '--synthetic',
+        metavar='X,Y,Z', help='Convert synthetic embark of X*Y DF blocks and Z levels instead of connecting '
+                              'to DFHack, e.g. 4,4,48'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true', help='Write timers, counters and RPC latency histogram into profile_report.json '
+                                  'in build directory'
+    )
+    parser.add_argument(
+        '--profile_pstats',
+        action='store_true', help='Run conversion under cProfile and write profile.pstats into build directory'
+    )
     args = parser.parse_args()
 
+    if args.workers and not args.load_dump:
+        parser.error('--workers requires --load_dump')
+    if args.workers and args.incremental:
+        parser.error('--incremental can not be used with --workers')
+    if (args.voxel_volume or args.reuse_voxel_volume) and (args.workers or args.incremental):
+        parser.error('--voxel_volume and --reuse_voxel_volume can not be used with --workers or --incremental')
+    if args.follow and (args.load_dump or args.skip_block_build or args.voxel_volume or args.reuse_voxel_volume):
+        parser.error('--follow can not be used with --load_dump, --skip_block_build, --voxel_volume '
+                     'or --reuse_voxel_volume')
+    map_sqlite_pragmas = dict(MinetestWorld.CONVERSION_MAP_SQLITE_PRAGMAS)
+    for pragma in args.map_sqlite_pragma:
+        name, _, value = pragma.partition('=')
+        if not re.match(r'^[a-z_]+$', name) or not re.match(r'^-?\w+$', value):
+            parser.error('--map_sqlite_pragma must be NAME=VALUE, got "{}"'.format(pragma))
+        map_sqlite_pragmas[name] = value
+    if args.follow:
+        args.incremental = True
+        args.follow_batch = tuple(int(v) for v in args.follow_batch.split(','))
+        if len(args.follow_batch) != 2 or min(args.follow_batch) < 1 or args.follow_window < 0:
+            parser.error('--follow_batch must be two positive numbers X,Y and --follow_window must not be negative')
+
     logging.basicConfig()
     _logger = logging.getLogger()
 
@@ -57,11 +204,16 @@ def main():  # TODO: map is flipped on X axis!!!
     else:
         _logger.setLevel(logging.WARNING)
 
-    # Init dump directories
+    # Init block dump
+
+    path_dump_blocks = './dump/blocks.sqlite'
+    if args.save_dump and not os.path.exists(os.path.dirname(path_dump_blocks)):
+        os.makedirs(os.path.dirname(path_dump_blocks))
+    if args.load_dump and not os.path.exists(path_dump_blocks):
+        raise Exception('Block dump {} does not exist, old JSON dumps can be converted '
+                        'with df_block_dump.py'.format(path_dump_blocks))
 
-    path_dump_blocks = './dump/blocks'
-    if args.save_dump and not os.path.exists(path_dump_blocks):
-        os.makedirs(path_dump_blocks)
+    block_dump = DFBlockDump(path_dump_blocks) if args.save_dump or args.load_dump else None
 
     # Init build directory
 
@@ -87,12 +239,23 @@ def main():  # TODO: map is flipped on X axis!!!
     # Init DFHack RPC
 
     try:
-        rpc = DFHackRPC()
+        if args.synthetic:
+            from fake_dfhack_rpc import SyntheticDFMap, SyntheticFortressActivity, FakeDFHackRPC
+            synthetic_map = SyntheticDFMap(*[int(v) for v in args.synthetic.split(',')])
+            rpc = FakeDFHackRPC(
+                synthetic_map, activity=SyntheticFortressActivity(synthetic_map) if args.follow else None)
+        else:
+            sys.path.append(os.path.join(os.path.dirname(__file__), './DFHackRPC'))
+            from dfhack_rpc import DFHackRPC
+            rpc = DFHackRPC()
         rpc.bind_all_methods()
     except Exception:
         _logger.exception('Init of DFHack API connection failed!')
         return 1
 
+    # message input of call_method() was tested only with fake RPC
+    request_message = args.block_request_message or bool(args.synthetic)
+
     # Print versions
 
     print('DFHack version: ', end='')
@@ -144,8 +307,14 @@ def main():  # TODO: map is flipped on X axis!!!
     print('complex_block_scale = {}'.format(complex_block_scale))
 
     path_world = os.path.join(path_worlds, world_name)
-    mw = MinetestWorld(path_world, allow_overwrite=True)
-    dt = DwarftestTransformer(mw, df_region_offset=df_region_offset, complex_block_scale=complex_block_scale)
+    mw = MinetestWorld(path_world, allow_overwrite=True, map_sqlite_pragmas=map_sqlite_pragmas,
+                       compression_level=args.compression_level, compression_workers=args.compression_workers)
+    dt = DwarftestTransformer(mw, df_region_offset=df_region_offset, complex_block_scale=complex_block_scale,
+                              skip_air_blocks=args.skip_air_blocks,
+                              spread_undefined_nodes=args.spread_undefined_nodes,
+                              compute_lighting=args.compute_lighting)
+    if args.skip_air_blocks:
+        mw.set_mapgen('singlenode')
 
     print('-------------------------------------------')
 
@@ -155,48 +324,113 @@ def main():  # TODO: map is flipped on X axis!!!
 
     # enums, _ = rpc.call_method_dict('ListEnums')
 
-    material_list, _ = rpc.call_method_dict('GetMaterialList')
+    with metrics.timer('rpc.GetMaterialList', histogram=True):
+        material_list, _ = rpc.call_method_dict('GetMaterialList')
     dt.load_df_material_list(material_list['materialList'])
 
-    tiletype_list, _ = rpc.call_method_dict('GetTiletypeList')
+    with metrics.timer('rpc.GetTiletypeList', histogram=True):
+        tiletype_list, _ = rpc.call_method_dict('GetTiletypeList')
     dt.load_df_tiletype_list(tiletype_list['tiletypeList'])
 
     print('-------------------------------------------')
 
     # process tiles/nodes
 
+    profiler = cProfile.Profile() if args.profile_pstats else None
+    if profiler:
+        profiler.enable()
+
     if not args.skip_block_build:
 
         print('Processing DF Blocks...')
 
-        region_pos = (map_info.block_pos_x, map_info.block_pos_y, map_info.block_pos_z)
-        for x in range(map_info.block_size_x):
-            for y in range(map_info.block_size_y):
-                print('Block x={} y={} z=0-{}'.format(x, y, map_info.block_size_z))
-
+        def load_df_block(x, y, z):
+            """
+            :return: list of MapBlock dicts (from dump) or MapBlock messages (from DFHack)
+            """
+            if args.load_dump:
+                with metrics.timer('dump.read_block_list'):
+                    return block_dump.read_block_list(x, y, z)['mapBlocks']
+            else:
                 # NOTE: reading more than 16*16*1=256 tiles causes problems
-                for z in range(map_info.block_size_z):
-                    path_dump_blocks_this = os.path.join(path_dump_blocks, '{}_{}_{}.json'.format(x, y, z))
-
-                    if args.load_dump:
-                        with open(path_dump_blocks_this, 'r') as f:
-                            block_list = json.loads(f.read())
-                    else:
-                        block_list, _ = rpc.call_method_dict('GetBlockList', {
-                            # 'blocksNeeded': 1,
-                            'minX': x, 'maxX': x+1,
-                            'minY': y, 'maxY': y+1,
-                            'minZ': z, 'maxZ': z+1,
-                        })
-                    if args.save_dump:
-                        with open(path_dump_blocks_this, 'w') as f:
-                            f.write(json.dumps(block_list))
-
-                    dt.parse_df_blocks(region_pos, block_list['mapBlocks'])
-
-                # save completely filled block to MT database
+                with metrics.timer('rpc.GetBlockList', histogram=True):
+                    block_list = get_block_list(rpc, x, x+1, y, y+1, z, z+1, request_message=request_message)
+            if args.save_dump:
+                with metrics.timer('dump.write_block_list'):
+                    block_dump.write_block_list(x, y, z, block_list)
+
+            return get_map_blocks(block_list)
+
+        region_pos = (map_info.block_pos_x, map_info.block_pos_y, map_info.block_pos_z)
+        positions = iter_df_block_positions(map_info.block_size_x, map_info.block_size_y, map_info.block_size_z)
+
+        # manifest of converted DF blocks, outdated manifest is removed by full conversion
+
+        block_size = (map_info.block_size_x, map_info.block_size_y, map_info.block_size_z)
+        volume_config = {
+            'df_region_offset': df_region_offset,
+            'complex_block_scale': complex_block_scale,
+            'region_pos': region_pos,
+            'block_size': block_size,
+        }
+
+        path_manifest = os.path.join(path_world, ConversionManifest.FILENAME)
+        manifest = None
+        if args.incremental:
+            manifest = ConversionManifest(path_world)
+            manifest.check_config(dict(
+                volume_config,
+                skip_air_blocks=args.skip_air_blocks,
+                spread_undefined_nodes=args.spread_undefined_nodes,
+                compute_lighting=args.compute_lighting,
+            ))
+            print('Manifest: {} DF blocks already converted'.format(len(manifest)))
+            dt.set_manifest(manifest)
+        elif os.path.exists(path_manifest):
+            os.remove(path_manifest)
+
+        # voxel volume of DF map, MT blocks are emitted from it after all DF blocks were parsed
+
+        volume = None
+        if args.reuse_voxel_volume:
+            volume = VoxelVolume.open(path_world)
+            if not volume.check_config(volume_config):
+                raise Exception('Voxel volume was converted with different config, run conversion with '
+                                '--voxel_volume again')
+            positions = []
+        elif args.voxel_volume:
+            volume = VoxelVolume.create(path_world, dt.coordinates, region_pos, block_size)
+        if volume is not None:
+            print('Voxel volume: {} MT blocks ({:.1f} MiB)'.format(
+                volume.block_count, volume.data.nbytes / 1024**2))
+            dt.set_voxel_volume(volume)
+
+        if args.workers:
+            convert_parallel(dt, path_dump_blocks, region_pos, block_size, args.workers)
+            positions = []
+        elif volume is None:
+            dt.set_df_scan_order(region_pos, map_info.block_size_x, map_info.block_size_y)
+
+        progress = metrics.ProgressReporter(map_info.block_size_x * map_info.block_size_y * map_info.block_size_z)
+        done = 0
+
+        for (x, y, z), map_blocks in DFBlockPrefetcher(load_df_block, positions, queue_size=args.prefetch_depth):
+            if manifest is not None:
+                dt.parse_changed_df_blocks(region_pos, (x, y, z), map_blocks)
+            else:
+                dt.parse_df_blocks(region_pos, map_blocks)
+
+            # save completely filled block to MT database
+            if volume is None and z == map_info.block_size_z - 1:
+                dt.evict_mt_blocks(x, y)
                 dt.dump_mt_blocks()
 
+            done += 1
+            pending_bytes = dt.get_mt_blocks_memory()[0]
+            metrics.set_gauge('mt_blocks_pending', len(dt.mt_blocks))
+            metrics.set_gauge('mt_blocks_pending_bytes', pending_bytes)
+            progress.update(done, 'pending MT blocks {} ({:.1f} MiB)'.format(len(dt.mt_blocks), pending_bytes / 1024**2))
+
         # print('Processing DF EmbarkTiles..')
         #
         # for x in range(embark_info.region_size_x):
@@ -212,27 +446,120 @@ def main():  # TODO: map is flipped on X axis!!!
         #
         #         dt.dump_mt_blocks()
 
-        print('Completing partial blocks')
+        print('Tile material cache: hits={hits}, misses={misses}'.format(**dt.tile_material_cache_stats))
+
+        print('Peak unfinished MT blocks: {} ({:.1f} MiB)'.format(
+            dt.mt_blocks_peak, dt.get_mt_blocks_memory()[1] / 1024**2))
+
+        if volume is not None:
+            if not args.reuse_voxel_volume:
+                volume.finish(mw.content_registry.names, dt.material_list, volume_config)
+
+            print('Saving blocks from voxel volume to database')
+
+            with metrics.timer('transformer.dump_voxel_volume'):
+                dt.dump_voxel_volume()
+            volume.close()
+        else:
+            print('Completing partial blocks')
+
+            dt.complete_mt_blocks()
 
-        dt.complete_mt_blocks()
+            print('Saving blocks to database')
 
-        print('Saving blocks to database')
+            dt.dump_mt_blocks()
 
-        dt.dump_mt_blocks()
+        print('Saved {} blocks ({:.1f} rows/sec), skipped {} air blocks'.format(
+            mw.map_write_stats['rows'], mw.get_map_write_rate(), dt.skipped_air_blocks))
+        print('Map block cache: {:.1%} hit rate, uniform_hits={uniform_hits}, hits={hits}, misses={misses}'.format(
+            mw.get_map_block_cache_hit_rate(), **mw.map_block_cache_stats))
+        compression_stats = mw.get_map_block_compression_stats()
+        print('Compression: level {level}, {workers} workers, {blocks} blocks, {mib:.1f} MiB of node data '
+              'compressed to {ratio:.1%} in {seconds:.2f}s of zlib'.format(
+                  mib=compression_stats['bytes'] / 1024**2,
+                  ratio=compression_stats['compressed_bytes'] / max(1, compression_stats['bytes']),
+                  **compression_stats))
+        if manifest is not None:
+            print('Incremental conversion: {} DF blocks unchanged, {} MT blocks patched'.format(
+                metrics.get_counter('df_blocks_unchanged'), metrics.get_counter('mt_blocks_patched')))
+            if not args.follow:
+                manifest.close()
 
         print('-------------------------------------------')
 
     # build material mod
 
+    material_stats = None
     if not args.skip_material_build:
         print('Building material mod')
-        dt.build_material_mod()
+        if args.prune_materials and (args.incremental or args.skip_block_build):
+            # blocks of previous conversion were not converted again, but can use any material
+            for _, _, names in mw.iter_blocks():
+                dt.mark_mt_ids_used(names)
+        with metrics.timer('transformer.build_material_mod'):
+            material_stats = dt.build_material_mod(prune_unused=args.prune_materials,
+                                                   material_list_format=args.material_list_format,
+                                                   bake_textures=args.bake_textures,
+                                                   texture_workers=args.texture_workers)
+        print('Materials: {registered} registered, {used} used in map, {written} written into material_list.{format} '
+              '({size:.1f} KiB)'.format(size=material_stats['file_bytes'] / 1024, **material_stats))
+        if args.bake_textures:
+            print('Textures: {textures} used, {baked} baked, {cached} cached, {removed} removed '
+                  '({seconds:.2f} s)'.format(**material_stats['textures']))
         print('-------------------------------------------')
 
+    # mirror changes of running fortress
+
+    if args.follow:
+        print('Following fortress every {:.1f}s, press Ctrl+C to stop'.format(args.follow_interval))
+
+        def build_material_mod():
+            dt.build_material_mod(prune_unused=args.prune_materials, material_list_format=args.material_list_format,
+                                  bake_textures=args.bake_textures, texture_workers=args.texture_workers)
+            print('New materials written into material mod, restart Minetest server to register them')
+
+        def report(stats):
+            if stats['df_blocks']:
+                print('Cycle {cycle}: {df_blocks_changed}/{df_blocks} DF blocks changed, {mt_blocks} MT blocks '
+                      'written in {seconds:.3f}s (poll {poll_seconds:.3f}s)'.format(**stats))
+
+        live_sync = LiveSync(rpc, dt, region_pos, block_size, request_message=request_message,
+                             batch_size=args.follow_batch, window=args.follow_window,
+                             build_material_mod=None if args.skip_material_build else build_material_mod)
+        live_sync.run(interval=args.follow_interval, cycles=args.follow_cycles, report=report)
+        manifest.close()
+
+        print('-------------------------------------------')
+
+    # write profiling results
+
+    if profiler:
+        profiler.disable()
+        path_pstats = os.path.join(args.path, 'profile.pstats')
+        profiler.dump_stats(path_pstats)
+        print('cProfile stats written to {}'.format(path_pstats))
+
+    if args.profile:
+        path_report = os.path.join(args.path, 'profile_report.json')
+        metrics.write_report(path_report, extra={
+            'tile_material_cache': dt.tile_material_cache_stats,
+            'map_block_cache': dict(mw.map_block_cache_stats, hit_rate=mw.get_map_block_cache_hit_rate()),
+            'map_write': dict(mw.map_write_stats, rows_per_sec=mw.get_map_write_rate()),
+            'map_block_compression': mw.get_map_block_compression_stats(),
+            'mt_blocks_peak': dt.mt_blocks_peak,
+            'mt_blocks_peak_bytes': dt.get_mt_blocks_memory()[1],
+            'materials': len(dt.material_list),
+            'material_list': material_stats,
+        })
+        print('Profile report written to {}'.format(path_report))
+
     # save world + close connection
 
     print('Saving and exiting..')
 
+    if block_dump:
+        block_dump.close()
+
     mw.commit_sql_connections()
     mw.close_sql_connections()
     rpc.close_connection()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import json
+import logging
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+_logger = logging.getLogger(__name__)
+
+# upper bounds of histogram buckets in seconds, last bucket is unbounded
+HISTOGRAM_BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0]
+
+
+class Metrics(object):
+    """
+    Cumulative timers, counters, histograms and gauges of conversion run. Process wide instance is used through
+    module functions, e.g. `with metrics.timer('world.write_blocks'):` or `metrics.count('df_tiles', 256)`.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.start_time = time.time()
+            self.timers = {}  # key: name, value: {'seconds': float, 'count': int}
+            self.counters = {}  # key: name, value: int
+            self.histograms = {}  # key: name, value: dict, see observe()
+            self.gauges = {}  # key: name, value: {'value': number, 'peak': number}
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            t = self.timers.get(name)
+            if t is None:
+                t = self.timers[name] = {'seconds': 0.0, 'count': 0}
+            t['seconds'] += seconds
+            t['count'] += 1
+
+    @contextmanager
+    def timer(self, name, histogram=False):
+        """
+        :param histogram: duration is also added to histogram of same name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.add_time(name, seconds)
+            if histogram:
+                self.observe(name, seconds)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            h = self.histograms.get(name)
+            if h is None:
+                h = self.histograms[name] = {
+                    'buckets': HISTOGRAM_BUCKETS,
+                    'counts': [0] * (len(HISTOGRAM_BUCKETS) + 1),
+                    'count': 0, 'sum': 0.0, 'min': seconds, 'max': seconds,
+                }
+
+            index = len(HISTOGRAM_BUCKETS)
+            for i, bound in enumerate(HISTOGRAM_BUCKETS):
+                if seconds <= bound:
+                    index = i
+                    break
+
+            h['counts'][index] += 1
+            h['count'] += 1
+            h['sum'] += seconds
+            h['min'] = min(h['min'], seconds)
+            h['max'] = max(h['max'], seconds)
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            g = self.gauges.get(name)
+            if g is None:
+                g = self.gauges[name] = {'value': value, 'peak': value}
+            g['value'] = value
+            g['peak'] = max(g['peak'], value)
+
+    def get_counter(self, name):
+        return self.counters.get(name, 0)
+
+    def get_timer_seconds(self, name):
+        return self.timers.get(name, {}).get('seconds', 0.0)
+
+    def get_elapsed(self):
+        return time.time() - self.start_time
+
+    def get_report(self, extra=None):
+        """
+        :param extra: dict of other stats included in report (e.g. cache stats)
+        :return: JSON serializable dict
+        """
+        with self.lock:
+            report = {
+                'elapsed_seconds': self.get_elapsed(),
+                'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,  # ru_maxrss is in KiB
+                'timers': {name: dict(t) for name, t in sorted(self.timers.items())},
+                'counters': dict(sorted(self.counters.items())),
+                'histograms': {name: dict(h, counts=list(h['counts'])) for name, h in sorted(self.histograms.items())},
+                'gauges': {name: dict(g) for name, g in sorted(self.gauges.items())},
+            }
+        if extra:
+            report.update(extra)
+        return report
+
+    def write_report(self, path, extra=None):
+        with open(path, 'w') as f:
+            json.dump(self.get_report(extra), f, indent=2)
+
+
+class ProgressReporter(object):
+    """
+    Prints throughput and ETA of conversion at most once per interval.
+    """
+
+    def __init__(self, total, interval=10.0, metrics=None):
+        """
+        :param total: number of DF blocks that will be processed
+        """
+        self.total = total
+        self.interval = interval
+        self.metrics = metrics or _metrics
+        self.start_time = time.time()
+        self.last_time = self.start_time
+
+    def update(self, done, extra=None):
+        """
+        :param done: number of processed DF blocks
+        :param extra: text appended to progress line
+        """
+        now = time.time()
+        if now - self.last_time < self.interval and done < self.total:
+            return
+        self.last_time = now
+
+        elapsed = max(now - self.start_time, 1e-9)
+        rate = done / elapsed
+        eta = (self.total - done) / rate if rate else 0.0
+
+        print('DF blocks {}/{} ({:.1%}), {:.1f} blocks/s, {:.0f} tiles/s, elapsed {}, ETA {}{}'.format(
+            done, self.total, done / self.total if self.total else 1.0, rate,
+            self.metrics.get_counter('df_tiles') / elapsed,
+            format_seconds(elapsed), format_seconds(eta), ', ' + extra if extra else ''
+        ))
+
+
+def format_seconds(seconds):
+    seconds = int(round(seconds))
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+# process wide metrics
+
+_metrics = Metrics()
+
+reset = _metrics.reset
+add_time = _metrics.add_time
+timer = _metrics.timer
+count = _metrics.count
+observe = _metrics.observe
+set_gauge = _metrics.set_gauge
+get_counter = _metrics.get_counter
+get_timer_seconds = _metrics.get_timer_seconds
+get_report = _metrics.get_report
+write_report = _metrics.write_report
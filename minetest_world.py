@@ -3,10 +3,24 @@
 
 import os
 import shutil
+import hashlib
 import sqlite3
 import struct
+import time
 import zlib
+import logging
+import collections
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+try:
+    import zstandard  # map blocks of Minetest 5.5+ (version 29) are zstd-compressed
+except ImportError:
+    zstandard = None
+
+_logger = logging.getLogger(__name__)
 
 
 def get_block_as_integer(x, y, z):
@@ -17,11 +31,10 @@ def get_block_as_integer(x, y, z):
 
 
 def to_int64(u):
-    while u >= 2**63:
-        u -= 2**64
-    while u <= -2**63:
-        u += 2**64
-    return u
+    """
+    :return: u wrapped into signed 64-bit range
+    """
+    return (u + 2**63) % 2**64 - 2**63
 
 
 def get_integer_as_block(i):
@@ -30,13 +43,61 @@ def get_integer_as_block(i):
     :return: (x, y, z)
     """
     x = unsigned_to_signed(i % 4096, 2048)
-    i = int((i - x) / 4096)
+    i = (i - x) // 4096
     y = unsigned_to_signed(i % 4096, 2048)
-    i = int((i - y) / 4096)
+    i = (i - y) // 4096
     z = unsigned_to_signed(i % 4096, 2048)
     return x, y, z
 
 
+def get_blocks_as_integers(x, y, z):
+    """
+    Vectorized get_block_as_integer().
+
+    :param x, y, z: numpy arrays or ints
+    :return: numpy int64 array of database block indexes
+    """
+    return np.asarray(z, dtype=np.int64) * 16777216 + np.asarray(y, dtype=np.int64) * 4096 + \
+        np.asarray(x, dtype=np.int64)
+
+
+def get_integers_as_blocks(i):
+    """
+    Vectorized get_integer_as_block().
+
+    :param i: numpy array of database block indexes
+    :return: (x, y, z) numpy int64 arrays
+    """
+    i = np.asarray(i, dtype=np.int64)
+    x = (i + 2048) % 4096 - 2048
+    i = (i - x) // 4096
+    y = (i + 2048) % 4096 - 2048
+    i = (i - y) // 4096
+    z = (i + 2048) % 4096 - 2048
+    return x, y, z
+
+
+def get_block_ranges(bbox):
+    """
+    Block positions with same y and z have consecutive database indexes, so every row of bbox is one range.
+    Rows spanning whole x axis are merged.
+
+    :param bbox: ((min_x, min_y, min_z), (max_x, max_y, max_z)), inclusive block positions
+    :return: list of (first, last) database block indexes of blocks in bbox
+    """
+    (min_x, min_y, min_z), (max_x, max_y, max_z) = bbox
+    if max_x < min_x or max_y < min_y or max_z < min_z:
+        return []
+
+    z, y = np.meshgrid(np.arange(min_z, max_z + 1), np.arange(min_y, max_y + 1), indexing='ij')
+    first = get_blocks_as_integers(min_x, y.reshape(-1), z.reshape(-1))
+    last = first + (max_x - min_x)
+
+    starts = np.flatnonzero(np.concatenate([[True], first[1:] != last[:-1] + 1]))
+    ends = np.concatenate([starts[1:] - 1, [first.size - 1]])
+    return [(int(f), int(l)) for f, l in zip(first[starts], last[ends])]
+
+
 def unsigned_to_signed(i, max_positive):
     if i < max_positive:
         return i
@@ -44,6 +105,38 @@ def unsigned_to_signed(i, max_positive):
         return i - 2 * max_positive
 
 
+class ContentRegistry(object):
+    """
+    Maps MT content names to compact integer content ids used in node arrays.
+    Id 0 is reserved for nodes that were not set yet.
+    """
+    UNSET_ID = 0
+    MAX_ID = 0xffff
+
+    def __init__(self, names=None):
+        self.names = [None]  # index: content id
+        self.ids = {}  # key: content name
+
+        for name in (names or [None])[1:]:
+            self.get_id(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_id(self, name):
+        content_id = self.ids.get(name)
+        if content_id is None:
+            content_id = len(self.names)
+            if content_id > self.MAX_ID:
+                raise Exception('Too many content ids, could not register "{}"'.format(name))
+            self.names.append(name)
+            self.ids[name] = content_id
+        return content_id
+
+    def get_name(self, content_id):
+        return self.names[content_id]
+
+
 class MinetestWorld(object):
     """
     https://github.com/minetest/minetest/blob/master/doc/world_format.txt
@@ -53,17 +146,46 @@ class MinetestWorld(object):
         \fixlight (x1, y1, z1) (x2, y2, z2)
     """
     GAME_ID = 'dwarftest'
-    BLOCK_NUMPY_DTYPE = np.dtype([('content_id', 'object'), ('param1', np.uint8), ('param2', np.uint8)])
+    BLOCK_NUMPY_DTYPE = np.dtype([('content_id', np.uint16), ('param1', np.uint8), ('param2', np.uint8)])
     TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), './templates/world')
 
+    # map.sqlite pragmas for fast bulk conversion, page_size is used only when creating new database. With
+    # synchronous=OFF crash of converter or system while writing can leave corrupted database, it is safe only for
+    # worlds that can be converted again. Overridden by --map_sqlite_pragma of main.py
+    CONVERSION_MAP_SQLITE_PRAGMAS = {
+        'page_size': 16384,
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -131072,  # KiB
+    }
+
+    # max number of non-uniform serialized blocks kept in cache
+    MAP_BLOCK_CACHE_SIZE = 4096
+    # max number of uniform serialized blocks kept in cache, node value includes light (param1) and lighting_complete
+    # is part of key, so lit worlds have many variants of air and liquid blocks
+    MAP_BLOCK_UNIFORM_CACHE_SIZE = 1024
+
     # Open/Close
 
-    def __init__(self, path, allow_overwrite=False):
+    def __init__(self, path, allow_overwrite=False, map_sqlite_pragmas=None, compression_level=-1,
+                 compression_workers=0):
+        """
+        :param map_sqlite_pragmas: dict, key: pragma name, value: pragma value set on map.sqlite connection,
+            e.g. CONVERSION_MAP_SQLITE_PRAGMAS
+        :param compression_level: zlib level of map block data, -1 is zlib default
+        :param compression_workers: number of threads encoding map blocks in build_map_blocks(), 0 encodes
+            blocks in calling thread
+        """
         self.path = path
+        self.map_sqlite_pragmas = map_sqlite_pragmas or {}
+        self.map_write_stats = {'rows': 0, 'seconds': 0.0}
         self.auth_sqlite_connection = None
         self.auth_sqlite_cursor = None
         self.map_sqlite_connection = None
         self.map_sqlite_cursor = None
+        self.content_registry = ContentRegistry()
+        self.init_map_block_cache()
+        self.init_map_block_compression(compression_level, compression_workers)
 
         # create directory
 
@@ -94,6 +216,10 @@ class MinetestWorld(object):
         self.auth_sqlite_connection.close()
         self.map_sqlite_connection.close()
 
+        if self.compression_executor is not None:
+            self.compression_executor.shutdown()
+            self.compression_executor = None
+
     # Init world files
 
     def init_auth_txt(self):
@@ -135,6 +261,16 @@ class MinetestWorld(object):
         with open(path, 'w') as f:
             f.write('[end_of_params]\n')
 
+    def set_mapgen(self, mg_name):
+        """
+        Mapgen is used by Minetest for blocks missing in database, e.g. 'singlenode' generates only air.
+        """
+        with open(os.path.join(self.path, 'map_meta.txt'), 'w') as f:
+            f.write(
+                'mg_name = {}\n'
+                '[end_of_params]\n'.format(mg_name)
+            )
+
     def init_world_mt(self):
         path = os.path.join(self.path, 'world.mt')
         if os.path.exists(path):
@@ -182,6 +318,11 @@ class MinetestWorld(object):
         self.map_sqlite_connection = sqlite3.connect(db_path)
         self.map_sqlite_cursor = self.map_sqlite_connection.cursor()
 
+        for name, value in self.map_sqlite_pragmas.items():
+            if name == 'page_size' and db_exists:
+                continue
+            self.map_sqlite_cursor.execute('PRAGMA {}={}'.format(name, value))
+
         if not db_exists:
             self.map_sqlite_cursor.execute('''
             CREATE TABLE `blocks` (`pos` INT NOT NULL PRIMARY KEY,`data` BLOB);
@@ -189,45 +330,172 @@ class MinetestWorld(object):
 
     # Map Block
 
-    def build_map_block(self, nodes):
+    def init_map_block_cache(self):
+        self.map_block_uniform_cache = collections.OrderedDict()  # key: node value, LRU
+        self.map_block_cache = collections.OrderedDict()  # key: digest of nodes, LRU
+        self.map_block_cache_stats = {'uniform_hits': 0, 'hits': 0, 'misses': 0}
+
+    def init_map_block_compression(self, level=-1, workers=0):
+        self.compression_level = level
+        self.compression_workers = workers
+        self.compression_executor = None  # created by first build_map_blocks() call
+
+    def get_map_block_compression_stats(self):
+        """
+        :return: dict with zlib level, number of compressed blocks, bytes of node data before and after compression
+            and seconds spent in zlib (summed over threads)
+        """
+        return {
+            'level': self.compression_level,
+            'workers': self.compression_workers,
+            'blocks': metrics.get_counter('world.node_data_compressed'),
+            'bytes': metrics.get_counter('world.node_data_bytes'),
+            'compressed_bytes': metrics.get_counter('world.node_data_compressed_bytes'),
+            'seconds': metrics.get_timer_seconds('world.compress_node_data'),
+        }
+
+    def build_map_blocks(self, blocks):
+        """
+        Same as build_map_block() for list of blocks. With compression_workers, blocks missing in cache are encoded
+        by thread pool (zlib releases GIL), identical blocks of list are encoded only once.
+
+        :param blocks: list of (nodes, lighting_complete)
+        :return: list of bytes in order of blocks
+        """
+        if not self.compression_workers:
+            return [self.build_map_block(nodes, lighting_complete=lighting_complete)
+                    for nodes, lighting_complete in blocks]
+
+        if self.compression_executor is None:
+            self.compression_executor = ThreadPoolExecutor(max_workers=self.compression_workers)
+
+        results = [None] * len(blocks)
+        pending = {}  # key: cache key, value: (cache, future, indexes of blocks)
+
+        for i, (nodes, lighting_complete) in enumerate(blocks):
+            cache, cache_key = self.get_map_block_cache_key(nodes, lighting_complete)
+            results[i] = self.get_cached_map_block(cache, cache_key)
+            if results[i] is not None:
+                continue
+
+            if cache_key in pending:  # same block is already encoded, counted as cache hit
+                self.map_block_cache_stats['uniform_hits' if cache is self.map_block_uniform_cache else 'hits'] += 1
+                pending[cache_key][2].append(i)
+                continue
+
+            self.map_block_cache_stats['misses'] += 1
+            future = self.compression_executor.submit(self.encode_map_block, nodes, None, lighting_complete)
+            pending[cache_key] = (cache, future, [i])
+
+        for cache_key, (cache, future, indexes) in pending.items():
+            block = future.result()
+            self.put_cached_map_block(cache, cache_key, block)
+            for i in indexes:
+                results[i] = block
+
+        return results
+
+    def get_map_block_cache_key(self, nodes, lighting_complete):
+        """
+        :return: (cache, cache key), blocks made of single node value are cached by that value, other blocks
+            by digest of their nodes
+        """
+        values = np.ascontiguousarray(nodes).view(np.uint32)
+        if (values == values[0]).all():
+            return self.map_block_uniform_cache, (int(values[0]), lighting_complete)
+        return self.map_block_cache, (hashlib.blake2b(values.tobytes(), digest_size=16).digest(), lighting_complete)
+
+    def get_cached_map_block(self, cache, cache_key):
         """
+        :return: cached block or None, cache stats are updated
+        """
+        block = cache.get(cache_key)
+        if block is None:
+            return None
+
+        self.map_block_cache_stats['uniform_hits' if cache is self.map_block_uniform_cache else 'hits'] += 1
+        cache.move_to_end(cache_key)
+        return block
+
+    def put_cached_map_block(self, cache, cache_key, block):
+        cache[cache_key] = block
+        max_size = self.MAP_BLOCK_UNIFORM_CACHE_SIZE if cache is self.map_block_uniform_cache \
+            else self.MAP_BLOCK_CACHE_SIZE
+        if len(cache) > max_size:
+            cache.popitem(last=False)
+
+    def build_map_block(self, nodes, palette=None, lighting_complete=0):
+        """
+        Blocks using content ids of self.content_registry are cached. Blocks made of single node value
+        (solid stone, air, ..) are cached by that value, other blocks by digest of their nodes.
+
         :param nodes: numpy array of length 4096 and dtype of self.BLOCK_NUMPY_DTYPE
+        :param palette: sequence of content names indexed by nodes['content_id'], default is names
+            from self.content_registry
+        :param lighting_complete: lighting_complete flags of block, see encode_map_block()
         :return: bytes
         """
-        assert nodes.size == 4096
-        nodes = nodes.copy()
-        block = b''
+        if palette is not None:
+            return self.encode_map_block(nodes, palette, lighting_complete)
+
+        cache, cache_key = self.get_map_block_cache_key(nodes, lighting_complete)
+        block = self.get_cached_map_block(cache, cache_key)
+        if block is None:
+            self.map_block_cache_stats['misses'] += 1
+            block = self.encode_map_block(nodes, lighting_complete=lighting_complete)
+            self.put_cached_map_block(cache, cache_key, block)
+        return block
 
-        # u8 version
-        block += struct.pack('>B', 28)
+    def get_map_block_cache_hit_rate(self):
+        stats = self.map_block_cache_stats
+        total = stats['uniform_hits'] + stats['hits'] + stats['misses']
+        return (stats['uniform_hits'] + stats['hits']) / total if total else 0.0
 
-        # u8 flags
-        block += struct.pack('>B', 0b00000000)
+    def encode_map_block(self, nodes, palette=None, lighting_complete=0):
+        """
+        :param nodes: numpy array of length 4096 and dtype of self.BLOCK_NUMPY_DTYPE
+        :param palette: sequence of content names indexed by nodes['content_id'], default is names
+            from self.content_registry
+        :param lighting_complete: bit per direction and light bank, MT recomputes light of block
+            in directions with unset bits. param1 has to contain light of nodes if bits are set.
+        :return: bytes
+        """
+        assert nodes.size == 4096
 
-        # u16 lighting_complete
-        block += struct.pack('>H', 0b0000000000000000)
+        if palette is None:
+            palette = self.content_registry.names
 
-        # u8 content_width
-        block += struct.pack('>B', 2)
+        # map content ids to name-id mappings in order of first occurrence
+        used_ids, first_index, inverse = np.unique(nodes['content_id'], return_index=True, return_inverse=True)
+        if palette[used_ids[0]] is None:
+            raise Exception('Map block contains nodes without content')
+        mapping_order = np.argsort(first_index)
+        mapping_ids = np.empty(mapping_order.size, dtype=np.uint16)
+        mapping_ids[mapping_order] = np.arange(mapping_order.size, dtype=np.uint16)
+        num_name_id_mappings = [(i, palette[used_ids[j]]) for i, j in enumerate(mapping_order)]
 
-        # u8 params_width
-        block += struct.pack('>B', 2)
+        # flags: 0x01 is_underground, 0x02 day_night_differs, 0x08 not generated
+        flags = 0b00000000
+        if lighting_complete:
+            param1 = nodes['param1'].astype(np.uint8)
+            if ((param1 & 0x0f) != (param1 >> 4)).any():
+                flags |= 0b00000010
 
-        # zlib-compressed node data
+        # u8 version, u8 flags, u16 lighting_complete, u8 content_width, u8 params_width
+        block = struct.pack('>BBHBB', 28, flags, lighting_complete, 2, 2)
 
-        num_name_id_mappings = {}
-        for n in nodes:
-            if n['content_id'] not in num_name_id_mappings:
-                num_name_id_mappings[n['content_id']] = len(num_name_id_mappings)
-            n['content_id'] = num_name_id_mappings[n['content_id']]
-        num_name_id_mappings = [(num_name_id_mappings[name], name) for name in num_name_id_mappings]
+        # zlib-compressed node data
 
-        node_data = [struct.pack('>H', n['content_id']) for n in nodes]
-        node_data += [struct.pack('>B', n['param1']) for n in nodes]
-        node_data += [struct.pack('>B', n['param2']) for n in nodes]
-        node_data = b''.join(node_data)
+        node_data = mapping_ids[inverse.reshape(-1)].astype('>u2').tobytes() + \
+            nodes['param1'].astype(np.uint8).tobytes() + \
+            nodes['param2'].astype(np.uint8).tobytes()
 
-        block += zlib.compress(node_data)
+        with metrics.timer('world.compress_node_data'):
+            compressed_node_data = zlib.compress(node_data, self.compression_level)
+        block += compressed_node_data
+        metrics.count('world.node_data_compressed')
+        metrics.count('world.node_data_bytes', len(node_data))
+        metrics.count('world.node_data_compressed_bytes', len(compressed_node_data))
 
         # zlib-compressed node metadata list
         node_metadata = b''
@@ -246,7 +514,7 @@ class MinetestWorld(object):
         #         u8 is_private -- only for version >= 2. 0 = not private, 1 = private
         # serialized inventory
 
-        block += zlib.compress(node_metadata)
+        block += zlib.compress(node_metadata, self.compression_level)
 
         # u8 static object version
         block += struct.pack('>B', 0)
@@ -274,9 +542,8 @@ class MinetestWorld(object):
 
         name_mappings = []
         for id, name in num_name_id_mappings:
-            name_mappings.append(
-                struct.pack('>H', id) + struct.pack('>H', len(name)) + name.encode('ascii')
-            )
+            name = name.encode('ascii')
+            name_mappings.append(struct.pack('>HH', id, len(name)) + name)
 
         block += b''.join(name_mappings)
 
@@ -293,28 +560,216 @@ class MinetestWorld(object):
         # EOF
         return block
 
+    def decode_map_block(self, data):
+        """
+        Decodes nodes and name-id mappings of map block. Versions 24-28 (zlib-compressed node data, e.g. blocks
+        written by encode_map_block()) and version 29 (zstd-compressed block, requires zstandard package) are
+        supported. Node metadata, static objects and node timers are skipped.
+
+        :param data: bytes
+        :return: (nodes, names), numpy array of length 4096 and dtype of self.BLOCK_NUMPY_DTYPE with content ids
+            indexing list of content names
+        """
+        version = data[0]
+
+        if version == 29:
+            if zstandard is None:
+                raise Exception('Map block version 29 can not be decoded, zstandard package is not installed')
+            data = zstandard.ZstdDecompressor().decompressobj().decompress(data[1:])
+
+            # u8 flags, u16 lighting_complete, u32 timestamp
+            names, offset = self.decode_name_id_mappings(data, 7)
+
+            content_width, params_width = struct.unpack_from('>BB', data, offset)
+            self.check_node_data_widths(version, content_width, params_width)
+            return self.decode_node_data(data[offset + 2:offset + 2 + 4096 * 4]), names
+
+        if not 24 <= version <= 28:
+            raise Exception('Unsupported map block version {}'.format(version))
+
+        # u8 version, u8 flags, u16 lighting_complete (version >= 27), u8 content_width, u8 params_width
+        offset = 4 if version >= 27 else 2
+        content_width, params_width = struct.unpack_from('>BB', data, offset)
+        self.check_node_data_widths(version, content_width, params_width)
+        offset += 2
+
+        # zlib-compressed node data and node metadata list
+
+        decompressor = zlib.decompressobj()
+        node_data = decompressor.decompress(data[offset:])
+        offset = len(data) - len(decompressor.unused_data)
+
+        decompressor = zlib.decompressobj()
+        decompressor.decompress(data[offset:])
+        offset = len(data) - len(decompressor.unused_data)
+
+        # node timers of version 24: u8 length of timer data, u16 num_of_timers
+        if version == 24:
+            timer_length, timer_count = struct.unpack_from('>BH', data, offset)
+            offset += 3 + timer_length * timer_count
+
+        # static objects: u8 version, u16 count, foreach: u8 type, 3x s32 position, u16 data_size, data
+
+        _, static_object_count = struct.unpack_from('>BH', data, offset)
+        offset += 3
+        for _ in range(static_object_count):
+            data_size, = struct.unpack_from('>H', data, offset + 13)
+            offset += 15 + data_size
+
+        # u32 timestamp
+        names, _ = self.decode_name_id_mappings(data, offset + 4)
+
+        return self.decode_node_data(node_data), names
+
+    @staticmethod
+    def check_node_data_widths(version, content_width, params_width):
+        if content_width != 2 or params_width != 2:
+            raise Exception('Unsupported map block version {} (content_width={}, params_width={})'.format(
+                version, content_width, params_width))
+
+    @staticmethod
+    def decode_name_id_mappings(data, offset):
+        """
+        :return: (list of content names indexed by mapping id, offset after mappings)
+        """
+        # u8 name-id-mapping version, u16 num_name_id_mappings
+        _, num_name_id_mappings = struct.unpack_from('>BH', data, offset)
+        offset += 3
+
+        names = [None] * num_name_id_mappings
+        for _ in range(num_name_id_mappings):
+            mapping_id, name_len = struct.unpack_from('>HH', data, offset)
+            offset += 4
+            if mapping_id >= len(names):
+                names.extend([None] * (mapping_id + 1 - len(names)))
+            names[mapping_id] = data[offset:offset + name_len].decode('utf-8')
+            offset += name_len
+
+        return names, offset
+
+    def decode_node_data(self, node_data):
+        """
+        :param node_data: uncompressed node data, u16 content ids, u8 param1 and u8 param2 of 4096 nodes
+        """
+        if len(node_data) < 4096 * 4:
+            raise Exception('Map block node data is too short ({} bytes)'.format(len(node_data)))
+
+        nodes = np.empty((4096, ), dtype=self.BLOCK_NUMPY_DTYPE)
+        nodes['content_id'] = np.frombuffer(node_data, dtype='>u2', count=4096)
+        nodes['param1'] = np.frombuffer(node_data, dtype=np.uint8, count=4096, offset=8192)
+        nodes['param2'] = np.frombuffer(node_data, dtype=np.uint8, count=4096, offset=12288)
+        return nodes
+
+    def map_block_names(self, nodes, names):
+        """
+        Replaces mapping ids of decoded nodes with content ids from self.content_registry.
+        """
+        content_ids = np.array([self.content_registry.get_id(name) if name is not None else 0 for name in names],
+                               dtype=np.uint16)
+        nodes['content_id'] = content_ids[nodes['content_id']]
+        return nodes
+
+    def read_block_data(self, x, y, z):
+        """
+        :return: serialized block or None if block is not in database
+        """
+        row = self.map_sqlite_cursor.execute(
+            'SELECT data FROM blocks WHERE pos=?', (get_block_as_integer(x, y, z), )).fetchone()
+        return row[0] if row else None
+
+    def read_block(self, x, y, z):
+        """
+        :return: (nodes, names) of decoded block, see decode_map_block(), or None if block is not in database
+        """
+        data = self.read_block_data(x, y, z)
+        return self.decode_map_block(data) if data is not None else None
+
+    def read_block_nodes(self, x, y, z):
+        """
+        :return: nodes of block with content ids from self.content_registry, or None if block is not in database
+        """
+        block = self.read_block(x, y, z)
+        return self.map_block_names(*block) if block is not None else None
+
+    def iter_block_data(self, bbox=None):
+        """
+        Blocks in bbox are read with one range query per bbox row, in order of database index.
+
+        :param bbox: ((min_x, min_y, min_z), (max_x, max_y, max_z)), inclusive block positions, default is
+            whole map
+        :return: iterator of ((x, y, z), serialized block)
+        """
+        if bbox is None:
+            queries = [('SELECT pos, data FROM blocks ORDER BY pos', ())]
+        else:
+            queries = [('SELECT pos, data FROM blocks WHERE pos BETWEEN ? AND ? ORDER BY pos', r)
+                       for r in get_block_ranges(bbox)]
+
+        for query, params in queries:
+            rows = self.map_sqlite_connection.execute(query, params).fetchall()
+            if not rows:
+                continue
+
+            x, y, z = get_integers_as_blocks([pos for pos, _ in rows])
+            for i, (_, data) in enumerate(rows):
+                yield (int(x[i]), int(y[i]), int(z[i])), data
+
+    def iter_blocks(self, bbox=None):
+        """
+        :return: iterator of ((x, y, z), nodes, names), see iter_block_data() and decode_map_block()
+        """
+        for pos, data in self.iter_block_data(bbox):
+            nodes, names = self.decode_map_block(data)
+            yield pos, nodes, names
+
     def write_block(self, x, y, z, block):
         block_id = get_block_as_integer(x, y, z)
+        self.map_sqlite_cursor.execute('INSERT OR REPLACE INTO blocks(pos,data) VALUES(?,?)', (block_id, block))
 
-        self.map_sqlite_cursor.execute('SELECT pos FROM blocks WHERE pos=?', (block_id, ))
-        rows = self.map_sqlite_cursor.fetchall()
+    def write_blocks(self, blocks):
+        """
+        Writes all blocks in one transaction.
 
-        if len(rows) > 0:
-            self.map_sqlite_cursor.execute('UPDATE blocks SET data=? WHERE pos=?', (block, block_id))
-        else:
-            self.map_sqlite_cursor.execute('INSERT INTO blocks(pos,data) VALUES(?,?)', (block_id, block))
+        :param blocks: iterable of (x, y, z, block)
+        :return: number of written blocks
+        """
+        start = time.perf_counter()
+
+        rows = [(get_block_as_integer(x, y, z), block) for x, y, z, block in blocks]
+        with self.map_sqlite_connection:
+            self.map_sqlite_cursor.executemany('INSERT OR REPLACE INTO blocks(pos,data) VALUES(?,?)', rows)
+
+        elapsed = time.perf_counter() - start
+        self.map_write_stats['rows'] += len(rows)
+        self.map_write_stats['seconds'] += elapsed
+        metrics.add_time('world.write_blocks', elapsed)
+        metrics.count('world.blocks_written', len(rows))
+
+        if rows:
+            _logger.debug('Wrote {} blocks into database ({:.1f} rows/sec)'.format(len(rows), len(rows) / elapsed))
+
+        return len(rows)
+
+    def get_map_write_rate(self):
+        """
+        :return: average rows/sec of write_blocks calls
+        """
+        if not self.map_write_stats['seconds']:
+            return 0.0
+        return self.map_write_stats['rows'] / self.map_write_stats['seconds']
 
 
 if __name__ == '__main__':
     mw = MinetestWorld('./world', allow_overwrite=True)
 
+    blocks = []
     for x in range(-2, 2):
         for y in range(-2, 2):
             for z in range(-3, 3):
                 nodes = np.zeros((4096, ), dtype=mw.BLOCK_NUMPY_DTYPE)
-                nodes[:] = ('default:stone', 0, 0)
-
-                block = mw.build_map_block(nodes)
-                mw.write_block(x, y, z, block)
+                nodes[:] = (mw.content_registry.get_id('default:stone'), 0, 0)
+                blocks.append((x, y, z, mw.build_map_block(nodes)))
+    mw.write_blocks(blocks)
+    print('Read back {} blocks'.format(sum(1 for _ in mw.iter_blocks(((-2, -2, -3), (1, 1, 2))))))
 
     mw.close_sql_connections()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import numpy as np
+
+# MT light levels
+LIGHT_SUN = 15
+LIGHT_MAX = 14
+
+# all lighting_complete bits set, MT trusts param1 of block and does not recompute its light
+LIGHTING_COMPLETE = 0xffff
+
+# lighting_complete bits of day bank by direction (x, y, z), bits of night bank are 6 bits higher
+LIGHTING_COMPLETE_DAY_BITS = {
+    (1, 0, 0): 0x01, (0, 1, 0): 0x02, (0, 0, 1): 0x04, (0, 0, -1): 0x08, (0, -1, 0): 0x10, (-1, 0, 0): 0x20,
+}
+
+# max number of nodes around MT block from which light is spread into block
+LIGHT_SPREAD_MARGIN = 8
+
+# light class of node, see get_light_classes()
+LIGHT_CLASS_SOURCE = 0x0f
+LIGHT_CLASS_PROPAGATES = 0x10
+LIGHT_CLASS_SUNLIGHT_PROPAGATES = 0x20
+
+# heightmap value of node column without any node blocking sunlight
+HEIGHTMAP_NONE = np.iinfo(np.int32).min
+
+
+def get_heightmap_top(blocks_sunlight, origin_y):
+    """
+    :param blocks_sunlight: numpy bool array indexed by [z, y, x]
+    :param origin_y: MT y of first node in blocks_sunlight
+    :return: numpy array indexed by [z, x] with MT y of highest node blocking sunlight, or HEIGHTMAP_NONE
+    """
+    size_y = blocks_sunlight.shape[1]
+    top = origin_y + size_y - 1 - np.argmax(blocks_sunlight[:, ::-1, :], axis=1)
+    return np.where(blocks_sunlight.any(axis=1), top, HEIGHTMAP_NONE).astype(np.int32)
+
+
+def spread_light(light, conducts, steps=LIGHT_MAX):
+    """
+    Spreads light to neighbouring nodes, light decreases by 1 with every node.
+
+    :param light: numpy int8 array indexed by [z, y, x], light sources
+    :param conducts: numpy bool array of nodes whose light can be increased by neighbours
+    :return: numpy int8 array
+    """
+    for _ in range(steps):
+        neighbour = np.zeros_like(light)
+        for axis in range(3):
+            for shift in (1, -1):
+                dst = [slice(None)] * 3
+                src = [slice(None)] * 3
+                dst[axis] = slice(1, None) if shift == 1 else slice(None, -1)
+                src[axis] = slice(None, -1) if shift == 1 else slice(1, None)
+                np.maximum(neighbour[tuple(dst)], light[tuple(src)], out=neighbour[tuple(dst)])
+
+        spread = np.where(conducts, np.maximum(light, neighbour - 1), light)
+        if np.array_equal(spread, light):
+            break
+        light = spread
+
+    return light
+
+
+def get_light_classes(light_flags):
+    """
+    :param light_flags: dict of numpy arrays indexed by content id: 'sunlight_propagates', 'light_propagates',
+        'light_source'
+    :return: numpy uint8 array indexed by content id, light source level in low nibble, LIGHT_CLASS_* bits
+    """
+    return (np.minimum(light_flags['light_source'], LIGHT_MAX).astype(np.uint8) |
+            np.where(light_flags['light_propagates'], LIGHT_CLASS_PROPAGATES, 0).astype(np.uint8) |
+            np.where(light_flags['sunlight_propagates'], LIGHT_CLASS_SUNLIGHT_PROPAGATES, 0).astype(np.uint8))
+
+
+def get_border_slices(offset, size, margin=LIGHT_SPREAD_MARGIN):
+    """
+    :param offset: (x, y, z) offset of neighbouring MT block, items are -1, 0 or 1
+    :param size: (size_z, size_y, size_x) of MT block
+    :return: slices indexed by [z, y, x] of nodes of MT block that are at most `margin` nodes from neighbour
+    """
+    def border(o, n):
+        if o < 0:
+            return slice(0, margin)
+        if o > 0:
+            return slice(n - margin, n)
+        return slice(None)
+
+    return border(offset[2], size[0]), border(offset[1], size[1]), border(offset[0], size[2])
+
+
+def get_lighting_incomplete_bits(offset):
+    """
+    :param offset: (x, y, z) offset of neighbouring MT block, items are -1, 0 or 1
+    :return: lighting_complete bits of both banks in directions of neighbour
+    """
+    bits = 0
+    for axis in range(3):
+        if offset[axis]:
+            direction = tuple(offset[axis] if i == axis else 0 for i in range(3))
+            bits |= LIGHTING_COMPLETE_DAY_BITS[direction]
+    return bits | (bits << 6)
+
+
+def compute_block_light(light_classes, origin_y, heightmap, heightmap_known, margin=LIGHT_SPREAD_MARGIN):
+    """
+    Computes param1 (day light in low nibble, night light in high nibble) of MT block nodes.
+
+    Nodes above the highest node blocking sunlight in their column get full sunlight. Light sources light both
+    banks. Light is then spread through nodes that let light through, in the block and in `margin` nodes
+    around it, so that sources and sunlight of neighbouring blocks reach into the block. Nodes of unknown
+    neighbouring blocks have light class 0, they do not pass light and are not light sources, but they are
+    still sunlit if their columns are in the heightmap.
+
+    :param light_classes: numpy uint8 array indexed by [z, y, x] of block nodes and `margin` nodes around them,
+        see get_light_classes()
+    :param origin_y: MT y of first node of block
+    :param heightmap: numpy array indexed by [z, x], heightmap of block columns with `margin` columns around them
+    :param heightmap_known: numpy bool array of heightmap columns that were already converted
+    :return: numpy uint8 array indexed by [z, y, x]
+    """
+    size_z, size_y, size_x = [n - 2 * margin for n in light_classes.shape]
+    inner = (slice(margin, margin + size_z), slice(margin, margin + size_y), slice(margin, margin + size_x))
+
+    propagates = (light_classes & LIGHT_CLASS_PROPAGATES) != 0
+    sources = (light_classes & LIGHT_CLASS_SOURCE).astype(np.int8)
+    lit_inner = propagates[inner] | (sources[inner] > 0)
+    if not lit_inner.any():
+        return np.zeros(lit_inner.shape, dtype=np.uint8)
+
+    # direct sunlight
+
+    node_y = origin_y - margin + np.arange(size_y + 2 * margin)
+    sunlit = heightmap_known[:, None, :] & (heightmap[:, None, :] < node_y[None, :, None])
+    sunlit[inner] &= (light_classes[inner] & LIGHT_CLASS_SUNLIGHT_PROPAGATES) != 0
+
+    # day bank: sunlight and light sources, night bank: light sources
+
+    day = np.maximum(np.where(sunlit, LIGHT_SUN, 0).astype(np.int8), sources)
+    conducts = propagates & ~sunlit
+    if conducts.any():
+        day = spread_light(day, conducts)
+
+    night = np.zeros(light_classes.shape, dtype=np.int8)
+    if sources.any():
+        night = spread_light(sources, propagates)
+
+    day = np.where(lit_inner, day[inner], 0).astype(np.uint8)
+    night = np.where(lit_inner, night[inner], 0).astype(np.uint8)
+    return day | (night << 4)
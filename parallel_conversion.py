@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from minetest_world import MinetestWorld
+from dwarftest_transformer import DwarftestTransformer
+from df_block_dump import DFBlockDump
+
+_worker = {}
+
+
+class MapBlockCollector(MinetestWorld):
+    """
+    Used instead of MinetestWorld in worker processes. Does not touch world files, serialized blocks are
+    sent through block queue as soon as they are written and MinetestWorld in main process writes them.
+    Blocks are compressed serially, worker processes already run in parallel.
+    """
+
+    def __init__(self, block_queue, compression_level=-1):
+        """
+        :param block_queue: multiprocessing queue of lists of (x, y, z, block)
+        """
+        self.path = None
+        self.content_registry = None
+        self.block_queue = block_queue
+        self.block_count = 0  # number of blocks sent through queue
+        self.init_map_block_cache()
+        self.init_map_block_compression(compression_level)
+
+    def commit_sql_connections(self):
+        pass
+
+    def close_sql_connections(self):
+        pass
+
+    def write_block(self, x, y, z, block):
+        self.write_blocks([(x, y, z, block)])
+
+    def write_blocks(self, blocks):
+        blocks = list(blocks)
+        if blocks:
+            self.block_queue.put(blocks)
+            self.block_count += len(blocks)
+        return len(blocks)
+
+    def pop_block_count(self):
+        block_count = self.block_count
+        self.block_count = 0
+        return block_count
+
+
+def split_column_groups(dt, region_pos, block_size_x, block_size_y, group_count):
+    """
+    Splits DF block columns into groups of neighbouring X slabs. Group borders are moved to DF columns
+    that start at MT block border if possible, so that MT blocks are not shared by multiple groups.
+
+    :return: list of lists of (x, y)
+    """
+    group_count = max(1, min(group_count, block_size_x))
+
+    def is_aligned(x):
+        mt_pos = dt.df2mt_pos(region_pos, (x * dt.DF_BLOCK_TILE_SIZE[0], 0, 0))
+        return mt_pos[0] % dt.MT_BLOCK_NODE_SIZE[0] == 0
+
+    aligned = [x for x in range(1, block_size_x) if is_aligned(x)]
+    step = block_size_x / group_count
+
+    borders = []
+    for i in range(1, group_count):
+        border = int(round(i * step))
+        near = [x for x in aligned if abs(x - border) <= step / 2]
+        if near:
+            border = min(near, key=lambda x: abs(x - border))
+        if borders and border <= borders[-1]:
+            continue
+        borders.append(border)
+
+    groups = []
+    for start, end in zip([0] + borders, borders + [block_size_x]):
+        groups.append([(x, y) for x in range(start, end) for y in range(block_size_y)])
+
+    return groups
+
+
+def _init_worker(transformer_state, dump_path, region_pos, block_size, block_queue, compression_level):
+    collector = MapBlockCollector(block_queue, compression_level)
+    dt = DwarftestTransformer.from_worker_state(collector, transformer_state)
+    _worker['transformer'] = dt
+    _worker['dump'] = DFBlockDump(dump_path)
+    _worker['region_pos'] = region_pos
+    _worker['block_size'] = block_size
+    _worker['content_count'] = len(dt.content_registry)
+
+
+def _convert_column_group(columns):
+    """
+    :return: dict with number of blocks sent through block queue, unfinished MT blocks, light classes of blocks
+        with neighbours lit in main process, heightmaps, used content ids, content names registered by worker
+        (with ids from content_count of main process) and tile material variants registered by group in order
+        of first occurrence
+    """
+    dt = _worker['transformer']
+    dump = _worker['dump']
+
+    # variants are resolved again by every group, cache is then filled in order of first occurrence in group
+    # no matter which groups were converted by worker before
+    dt.tile_material_cache = {}
+
+    # MT blocks shared with other groups stay unfinished and are merged in main process
+    block_size = _worker['block_size']
+    dt.set_df_scan_order(_worker['region_pos'], block_size[0], block_size[1], first_column=columns[0])
+
+    for x, y in columns:
+        for z in range(block_size[2]):
+            dt.parse_df_blocks(_worker['region_pos'], dump.read_block_list(x, y, z)['mapBlocks'])
+        dt.evict_mt_blocks(x, y)
+        dt.dump_mt_blocks()
+
+    heightmaps = dt.mt_heightmaps
+    dt.mt_heightmaps = {}
+    used_content_ids = np.flatnonzero(dt.mt_content_used)
+    dt.mt_content_used[:] = False
+
+    return {
+        'block_count': dt.minetest_world.pop_block_count(),
+        'partial_blocks': dt.pop_mt_blocks(),
+        'light_classes': dt.pop_mt_light_classes(),
+        'heightmaps': heightmaps,
+        'used_content_ids': used_content_ids,
+        'content_names': dt.content_registry.names[_worker['content_count']:],
+        'materials': list(dt.tile_material_cache.values()),
+    }
+
+
+def convert_parallel(dt, dump_path, region_pos, block_size, workers):
+    """
+    Converts DF blocks from DFBlockDump in worker processes. Serialized blocks are streamed to this process
+    while workers run and written by dt.minetest_world, MT blocks shared by multiple column groups are merged
+    into dt. Partial blocks are left in dt, and should be finished with complete_mt_blocks() and dump_mt_blocks().
+
+    Tile material variants are registered by workers, dt gets them in same order as in serial conversion.
+
+    :param dt: DwarftestTransformer with loaded tile types and materials
+    :param block_size: (block_size_x, block_size_y, block_size_z) of DF map
+    :param workers: number of worker processes
+    """
+    groups = split_column_groups(dt, region_pos, block_size[0], block_size[1], workers * 4)
+
+    material_count = len(dt.material_list)
+    content_count = len(dt.content_registry)
+    group_materials = [None] * len(groups)
+
+    mp_context = multiprocessing.get_context()
+    block_queue = mp_context.Queue()
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp_context,
+        initializer=_init_worker,
+        initargs=(dt.get_worker_state(), dump_path, region_pos, block_size, block_queue,
+                  dt.minetest_world.compression_level),
+    ) as executor:
+        futures = {executor.submit(_convert_column_group, columns): i for i, columns in enumerate(groups)}
+        pending = set(futures)
+        block_count = 0  # blocks sent by finished groups
+        written = 0
+
+        # results of groups can arrive before their last blocks, queue is read until all blocks were written
+        while pending or written < block_count:
+            try:
+                written += dt.minetest_world.write_blocks(block_queue.get(timeout=0.1))
+            except queue.Empty:
+                pass
+
+            for future in [future for future in pending if future.done()]:
+                pending.remove(future)
+                result = future.result()
+                block_count += result['block_count']
+
+                # materials first, so that light flags of new content ids know their node shapes
+                for mat in result['materials']:
+                    if mat['df_tuple'] not in dt.material_df_lookup:
+                        dt.material_list.append(mat)
+                        dt.material_df_lookup[mat['df_tuple']] = mat
+                group_materials[futures[future]] = result['materials']
+
+                content_id_map = np.arange(content_count + len(result['content_names']), dtype=np.uint16)
+                content_id_map[content_count:] = [dt.content_registry.get_id(name)
+                                                  for name in result['content_names']]
+
+                dt.merge_mt_heightmaps(result['heightmaps'])
+                dt.mt_light_classes.update(result['light_classes'])
+                dt.mt_content_used[content_id_map[result['used_content_ids']]] = True
+
+                for mt_block_pos, nodes in result['partial_blocks'].items():
+                    nodes['content_id'] = content_id_map[nodes['content_id']]
+                    dt.merge_mt_block(mt_block_pos, nodes)
+
+                print('Column group {}/{} done'.format(len(futures) - len(pending), len(groups)))
+
+    # order of tile material variants in serial conversion, groups follow scan order
+    materials = dt.material_list[:material_count]
+    df_tuples = {mat['df_tuple'] for mat in materials}
+    for group in group_materials:
+        for mat in group:
+            if mat['df_tuple'] not in df_tuples:
+                materials.append(mat)
+                df_tuples.add(mat['df_tuple'])
+    dt.material_list = materials
+    dt.material_df_lookup = {mat['df_tuple']: mat for mat in materials}
+
+    dt.dump_mt_blocks()
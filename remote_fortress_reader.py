@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import logging
+import os
+import sys
+import types
+
+_logger = logging.getLogger(__name__)
+
+DFHACK_RPC_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'DFHackRPC')
+
+
+def load_remote_fortress_reader():
+    """
+    :return: RemoteFortressReader_pb2 module generated in DFHackRPC, None if protobuf or module is not available
+    """
+    try:
+        import google.protobuf  # noqa: F401
+    except ImportError:
+        return None
+
+    try:
+        import RemoteFortressReader_pb2
+        return RemoteFortressReader_pb2
+    except ImportError:
+        pass
+
+    for root, dirs, files in os.walk(DFHACK_RPC_PATH):
+        if 'RemoteFortressReader_pb2.py' in files:
+            sys.path.append(root)
+            import RemoteFortressReader_pb2
+            return RemoteFortressReader_pb2
+
+    return None
+
+
+def message_to_dict(message):
+    """
+    Same conversion as DFHackRPC call_method_dict(), fields with default values are included.
+    """
+    from google.protobuf import json_format
+
+    try:
+        return json_format.MessageToDict(message, always_print_fields_with_no_presence=True)
+    except TypeError:  # protobuf < 5.26
+        return json_format.MessageToDict(message, including_default_value_fields=True)
+
+
+def build_block_request(min_x, max_x, min_y, max_y, min_z, max_z):
+    """
+    Without DFHackRPC (synthetic map), object with same attributes as BlockRequest message is returned.
+
+    :return: BlockRequest message for GetBlockList
+    """
+    pb2 = load_remote_fortress_reader()
+    if pb2 is None:
+        _logger.debug('RemoteFortressReader_pb2 is not available, BlockRequest is not a protobuf message')
+        return types.SimpleNamespace(
+            min_x=min_x, max_x=max_x, min_y=min_y, max_y=max_y, min_z=min_z, max_z=max_z)
+    return pb2.BlockRequest(min_x=min_x, max_x=max_x, min_y=min_y, max_y=max_y, min_z=min_z, max_z=max_z)
+
+
+def get_block_list(rpc, min_x, max_x, min_y, max_y, min_z, max_z, request_message=False):
+    """
+    By default GetBlockList is called with call_method_dict() like it always was. With request_message it is called
+    with BlockRequest message and BlockList message is returned directly, conversion to dict is slow. Message input
+    of call_method() was tested only with FakeDFHackRPC, not with DFHackRPC connected to DFHack.
+
+    :param request_message: call GetBlockList with call_method() and BlockRequest message
+    :return: BlockList message, or BlockList dict without request_message, use get_map_blocks() on both
+    """
+    if request_message:
+        block_list, _ = rpc.call_method('GetBlockList', build_block_request(min_x, max_x, min_y, max_y, min_z, max_z))
+    else:
+        block_list, _ = rpc.call_method_dict('GetBlockList', {
+            'minX': min_x, 'maxX': max_x, 'minY': min_y, 'maxY': max_y, 'minZ': min_z, 'maxZ': max_z,
+        })
+    return block_list
+
+
+def get_map_blocks(block_list):
+    """
+    :param block_list: BlockList message or dict
+    :return: MapBlock messages or dicts, both are accepted by DwarftestTransformer.parse_df_blocks()
+    """
+    if isinstance(block_list, dict):
+        return block_list.get('mapBlocks', [])
+    return block_list.map_blocks
@@ -311,6 +311,100 @@ minetest.register_node("dwarftest:lava_source", {
 -- Dynamic node definitions
 --
 
+local node_sounds = {
+	dirt = dwarftest.node_sound_dirt,
+	hard = dwarftest.node_sound_hard,
+	wood = dwarftest.node_sound_wood,
+	grass = dwarftest.node_sound_grass,
+	leaves = dwarftest.node_sound_leaves,
+}
+
+-- node definition by node kind
+
+local node_builders = {}
+
+function node_builders.stair(description, tex, sounds, r, g, b)
+	return {
+		description = description,
+		drawtype = "glasslike",
+		tiles = {tex},
+		paramtype = "light",
+		groups = {
+			oddly_breakable_by_hand = 1,
+		},
+		is_ground_content = false,
+		sunlight_propagates = true,
+		walkable = false,
+		climbable = true,
+		post_effect_color = {r=r, g=g, b=b, a=64},
+		sounds = sounds,
+	}
+end
+
+function node_builders.fortification(description, tex, sounds)
+	return {
+		description = description,
+		drawtype = "glasslike",
+		tiles = {tex},
+		paramtype = "light",
+		groups = {
+			oddly_breakable_by_hand = 1,
+		},
+		is_ground_content = false,
+		sunlight_propagates = true,
+		sounds = sounds,
+	}
+end
+
+function node_builders.leaves(description, tex, sounds)
+	return {
+		description = description,
+		drawtype = "allfaces_optional",
+		visual_scale = 1.3,
+		tiles = {tex},
+		paramtype = "light",
+		groups = {
+			oddly_breakable_by_hand = 1,
+		},
+		is_ground_content = false,
+		sounds = sounds,
+	}
+end
+
+function node_builders.wall(description, tex, sounds)  -- normal wall
+	return {
+		description = description,
+		tiles = {tex},
+		groups = {
+			oddly_breakable_by_hand = 1,
+		},
+		is_ground_content = false,
+		sounds = sounds,
+	}
+end
+
+local function register_material(mt_id, description, kind, tex, sound, r, g, b)
+	minetest.register_node(mt_id, node_builders[kind](description, tex, node_sounds[sound](), r, g, b))
+end
+
+-- material_list.lua is generated by converter with all per material decisions resolved:
+-- {mt_id, description, node kind, texture, sound kind, red, green, blue}
+
+local modpath = minetest.get_modpath("dwarftest")
+local material_list_lua = io.open(modpath.."/material_list.lua", "rb")
+
+if material_list_lua then
+	material_list_lua:close()
+
+	local material_list = dofile(modpath.."/material_list.lua")
+	for i = 1, #material_list do
+		local mat = material_list[i]
+		register_material(mat[1], mat[2], mat[3], mat[4], mat[5], mat[6], mat[7], mat[8])
+	end
+end
+
+-- material_list.json is written instead of material_list.lua by converter with --material_list_format json
+
 local function read_file(path)
     local file = io.open(path, "rb") -- r read mode and b binary mode
     if not file then return nil end
@@ -319,128 +413,52 @@ local function read_file(path)
     return content
 end
 
-material_list_path = minetest.get_modpath("dwarftest").."/material_list.json"
-material_list_json = read_file(material_list_path);
-material_list = minetest.parse_json(material_list_json)
+local material_list_json = not material_list_lua and read_file(modpath.."/material_list.json")
+local material_list = material_list_json and minetest.parse_json(material_list_json) or {}
 --minetest.log("error", minetest.serialize(material_list));
 
+local material_sounds = {
+	soil = "dirt",
+	stone = "hard",
+	ice = "hard",
+	wood = "wood",
+	mushroom = "wood",
+	grass = "grass",
+	smooth = "hard",
+	leaves = "leaves",
+}
+
 for i = 1, #material_list do
 --	minetest.log("error", minetest.serialize(material_list[i]));
 	local mat = material_list[i]
+	local mt_node = mat.mt_node or {}
 
 	-- get base material texture
 
 	local base_tex
-	local mod_tex
+	local mod_tex = ""
 
-	if mat.mt_node == nil or mat.mt_node.material == nil then
+	if mt_node.material == nil then
 		base_tex = "dwarftest_template_empty.png"
 	else  -- stone, soil, ice, wood, mushroom, grass, smooth, leaves
-		base_tex = string.format("dwarftest_template_%s.png", mat.mt_node.material)
+		base_tex = string.format("dwarftest_template_%s.png", mt_node.material)
 	end
 
-	if mat.mt_node ~= nil and mat.mt_node.shape == "stair" then
-		base_tex = ""
-		mod_tex = "dwarftest_template_stair.png"
-	elseif mat.mt_node ~= nil and mat.mt_node.shape == "fortification" then
+	if mt_node.shape == "stair" or mt_node.shape == "fortification" then
 		base_tex = ""
-		mod_tex = "dwarftest_template_fortification.png"
-	else
-		mod_tex = ""
+		mod_tex = string.format("dwarftest_template_%s.png", mt_node.shape)
 	end
 
-	local tex_name = string.format(
+	-- mt_texture is baked by converter with --bake_textures
+	local tex_name = mat.mt_texture or string.format(
 		"%s%s^[colorize:#%02x%02x%02x80", base_tex, mod_tex, mat.color[1], mat.color[2], mat.color[3]
 	)
 
-	-- get sound
-
-	local sound_fcn
-
-	if mat.mt_node ~= nil and mat.mt_node.material == "soil" then
-		sound_fcn = dwarftest.node_sound_dirt
-	elseif mat.mt_node ~= nil and mat.mt_node.material == "stone" then
-		sound_fcn = dwarftest.node_sound_hard
-	elseif mat.mt_node ~= nil and mat.mt_node.material == "ice" then
-		sound_fcn = dwarftest.node_sound_hard
-	elseif mat.mt_node ~= nil and mat.mt_node.material == "wood" then
-		sound_fcn = dwarftest.node_sound_wood
-	elseif mat.mt_node ~= nil and mat.mt_node.material == "mushroom" then
-		sound_fcn = dwarftest.node_sound_wood
-	elseif mat.mt_node ~= nil and mat.mt_node.material == "grass" then
-		sound_fcn = dwarftest.node_sound_grass
-	elseif mat.mt_node ~= nil and mat.mt_node.material == "smooth" then
-		sound_fcn = dwarftest.node_sound_hard
-	elseif mat.mt_node ~= nil and mat.mt_node.material == "leaves" then
-		sound_fcn = dwarftest.node_sound_leaves
-	else
-		sound_fcn = dwarftest.node_sound_dirt
-	end
-
 	-- create node based on its shape
 
-	if mat.mt_node ~= nil and mat.mt_node.shape == "stair" then
-
-		minetest.register_node(mat.mt_id, {
-			description = mat.name,
-			drawtype = "glasslike",
-			tiles = {tex_name},
-			paramtype = "light",
-			groups = {
-				oddly_breakable_by_hand = 1,
-			},
-			is_ground_content = false,
-			sunlight_propagates = true,
-			walkable = false,
-			climbable = true,
-			post_effect_color = {r=mat.color[1], g=mat.color[2], b=mat.color[3], a=64},
-			sounds = sound_fcn(),
-		})
-
-	elseif mat.mt_node ~= nil and mat.mt_node.shape == "fortification" then
-
-		minetest.register_node(mat.mt_id, {
-			description = mat.name,
-			drawtype = "glasslike",
-			tiles = {tex_name},
-			paramtype = "light",
-			groups = {
-				oddly_breakable_by_hand = 1,
-			},
-			is_ground_content = false,
-			sunlight_propagates = true,
-			sounds = sound_fcn(),
-		})
-
-	elseif mat.mt_node ~= nil and mat.mt_node.shape == "leaves" then
-
-		minetest.register_node(mat.mt_id, {
-			description = mat.name,
-			drawtype = "allfaces_optional",
-			visual_scale = 1.3,
-			tiles = {tex_name},
-			paramtype = "light",
-			groups = {
-				oddly_breakable_by_hand = 1,
-			},
-			is_ground_content = false,
-			sounds = sound_fcn(),
-		})
-
-	else -- normal wall
-
-		minetest.register_node(mat.mt_id, {
-			description = mat.name,
-			tiles = {tex_name},
-			groups = {
-				oddly_breakable_by_hand = 1,
-			},
-			is_ground_content = false,
-			sounds = sound_fcn(),
-		})
-
-	end
-
+	local kind = node_builders[mt_node.shape] and mt_node.shape or "wall"
+	register_material(mat.mt_id, mat.name, kind, tex_name, material_sounds[mt_node.material] or "dirt",
+		mat.color[1], mat.color[2], mat.color[3])
 end
 
 ---
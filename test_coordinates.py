@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import itertools
+import random
+import unittest
+import numpy as np
+
+from coordinates import CoordinateMapper
+from minetest_world import get_block_as_integer, to_int64, get_integer_as_block, get_blocks_as_integers, \
+    get_integers_as_blocks
+
+DF_REGION_TILE_SIZE = (48, 48, 1)
+DF_BLOCK_TILE_SIZE = (16, 16)
+MT_BLOCK_NODE_SIZE = (16, 16, 16)
+
+
+# scalar reference formulas, node by node like the loops of converter before CoordinateMapper
+
+def reference_df2mt_pos(df_region_offset, block_scale, region_pos, tile_pos):
+    df_pos = [(region_pos[i] - df_region_offset[i]) * DF_REGION_TILE_SIZE[i] + tile_pos[i] for i in range(3)]
+    # NOTE: MT pos is (X, Z, Y)
+    return df_pos[0] * block_scale[0], df_pos[2] * block_scale[2], df_pos[1] * block_scale[1]
+
+
+def reference_mt2mt_block_pos(mt_pos):
+    """
+    Block position is rounded down, old converter truncated it towards zero and put negative nodes into wrong blocks.
+    """
+    mt_block_pos = [int(mt_pos[i] // MT_BLOCK_NODE_SIZE[i]) for i in range(3)]
+    node_pos = [mt_pos[i] - mt_block_pos[i] * MT_BLOCK_NODE_SIZE[i] for i in range(3)]
+    node_index = node_pos[0] + node_pos[1] * MT_BLOCK_NODE_SIZE[0] + \
+        node_pos[2] * MT_BLOCK_NODE_SIZE[0] * MT_BLOCK_NODE_SIZE[1]
+    return tuple(mt_block_pos), node_index
+
+
+def reference_map_df_block(df_region_offset, block_scale, region_pos, map_pos):
+    """
+    :return: dict, key: (MT block position, node index), value: (DF tile x, DF tile y, node x, node y, node z)
+        of nodes of one DF block level
+    """
+    nodes = {}
+    for tx in range(DF_BLOCK_TILE_SIZE[0]):
+        for ty in range(DF_BLOCK_TILE_SIZE[1]):
+            tile_pos = (map_pos[0] + tx, map_pos[1] + ty, map_pos[2])
+            mt_pos = reference_df2mt_pos(df_region_offset, block_scale, region_pos, tile_pos)
+            for sx in range(block_scale[0]):
+                for sy in range(block_scale[1]):
+                    for sz in range(block_scale[2]):
+                        key = reference_mt2mt_block_pos((mt_pos[0] + sx, mt_pos[1] + sz, mt_pos[2] + sy))
+                        assert key not in nodes
+                        nodes[key] = (tx, ty, sx, sy, sz)
+    return nodes
+
+
+def reference_to_int64(u):
+    while u >= 2**63:
+        u -= 2**64
+    while u <= -2**63:
+        u += 2**64
+    return u
+
+
+def reference_get_integer_as_block(i):
+    def unsigned_to_signed(i, max_positive):
+        if i < max_positive:
+            return i
+        else:
+            return i - 2 * max_positive
+
+    x = unsigned_to_signed(i % 4096, 2048)
+    i = int((i - x) / 4096)
+    y = unsigned_to_signed(i % 4096, 2048)
+    i = int((i - y) / 4096)
+    z = unsigned_to_signed(i % 4096, 2048)
+    return x, y, z
+
+
+class TestCoordinateMapper(unittest.TestCase):
+    # region offsets put some of the DF blocks to negative MT positions
+    CASES = [
+        ((0, 0, 0), (1, 1, 1), (0, 0, 0)),
+        ((0, 0, 0), (2, 2, 3), (1, 2, 5)),
+        ((3, 2, 10), (2, 2, 3), (1, 1, 2)),
+        ((3, 2, 10), (3, 1, 5), (5, 3, 3)),
+        ((1, 1, 1), (1, 2, 2), (0, 0, 0)),
+    ]
+    MAP_POSITIONS = [(0, 0, 0), (16, 32, 7), (32, 0, 19), (112, 48, 47)]
+
+    def iter_cases(self):
+        for df_region_offset, block_scale, region_pos in self.CASES:
+            coordinates = CoordinateMapper(df_region_offset, block_scale, df_region_tile_size=DF_REGION_TILE_SIZE,
+                                           df_block_tile_size=DF_BLOCK_TILE_SIZE, mt_block_node_size=MT_BLOCK_NODE_SIZE)
+            for map_pos in self.MAP_POSITIONS:
+                with self.subTest(df_region_offset=df_region_offset, block_scale=block_scale,
+                                  region_pos=region_pos, map_pos=map_pos):
+                    yield coordinates, df_region_offset, block_scale, region_pos, map_pos
+
+    def test_cases_have_negative_positions(self):
+        negative = [
+            case for case in self.CASES
+            if min(reference_df2mt_pos(case[0], case[1], case[2], (0, 0, 0))) < 0
+        ]
+        self.assertTrue(negative)
+
+    def test_box_template(self):
+        for coordinates, df_region_offset, block_scale, region_pos, map_pos in self.iter_cases():
+            reference = reference_map_df_block(df_region_offset, block_scale, region_pos, map_pos)
+
+            first_block, template = coordinates.get_mt_box_template(
+                coordinates.df2mt_pos(region_pos, map_pos), coordinates.df_block_box_size)
+            box_shape = template['node_indexes'].shape
+            self.assertEqual(box_shape, tuple(reversed(coordinates.df_block_box_size)))
+            self.assertEqual(box_shape[0] * box_shape[1] * box_shape[2], len(reference))
+
+            # nodes of box are identified by (DF tile x, DF tile y, node x, node y, node z)
+            z, y, x = np.meshgrid(*[np.arange(v) for v in box_shape], indexing='ij')
+            box_nodes = np.stack([
+                x // block_scale[0], z // block_scale[1], x % block_scale[0], z % block_scale[1], y,
+            ], axis=-1)
+
+            # per node arrays
+            block_positions = template['node_block_offsets'] + np.array(first_block)
+            mapped = {}
+            for node, block_pos, node_index in zip(box_nodes.reshape(-1, 5), block_positions.reshape(-1, 3),
+                                                   template['node_indexes'].reshape(-1)):
+                mapped[(tuple(int(v) for v in block_pos), int(node_index))] = tuple(int(v) for v in node)
+            self.assertEqual(mapped, reference)
+
+            # block slices
+            mapped = {}
+            for offset, dst, src in template['blocks']:
+                block_pos = tuple(first_block[i] + offset[i] for i in range(3))
+                indexes = np.arange(16**3).reshape(16, 16, 16)[dst].reshape(-1)
+                for node, node_index in zip(box_nodes[src].reshape(-1, 5), indexes):
+                    key = (block_pos, int(node_index))
+                    self.assertNotIn(key, mapped)
+                    mapped[key] = tuple(int(v) for v in node)
+            self.assertEqual(mapped, reference)
+
+            self.assertEqual(
+                sorted(coordinates.get_df_block_mt_block_positions(region_pos, map_pos)),
+                sorted({block_pos for block_pos, _ in reference}),
+            )
+
+
+class TestBlockIntegers(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(0)
+        edges = [-2048, -2047, -17, -16, -1, 0, 1, 15, 16, 2046, 2047]
+        self.positions = list(itertools.product(edges, repeat=3)) + \
+            [tuple(rng.randint(-2048, 2047) for _ in range(3)) for _ in range(2000)]
+
+    def test_to_int64(self):
+        rng = random.Random(1)
+        values = [0, 1, -1, 2**63 - 1, -2**63 + 1, 2**63 + 1, 2**64 - 1, -2**64 + 1, 3 * 2**64 + 5, -3 * 2**64 - 5]
+        values += [rng.randint(-2**70, 2**70) for _ in range(1000)]
+        for value in values:
+            self.assertEqual(to_int64(value), reference_to_int64(value), value)
+
+        # reference wraps -2**63 out of int64 range
+        for value in [-2**63, 2**63, -2**63 - 2**64]:
+            self.assertEqual(to_int64(value), -2**63)
+
+    def test_get_integer_as_block(self):
+        for pos in self.positions:
+            i = get_block_as_integer(*pos)
+            self.assertEqual(reference_get_integer_as_block(i), pos)
+            self.assertEqual(get_integer_as_block(i), pos)
+
+    def test_vectorized(self):
+        x, y, z = [np.array(v) for v in zip(*self.positions)]
+        integers = get_blocks_as_integers(x, y, z)
+        self.assertEqual(integers.tolist(), [get_block_as_integer(*pos) for pos in self.positions])
+        self.assertEqual(
+            list(zip(*[v.tolist() for v in get_integers_as_blocks(integers)])),
+            [reference_get_integer_as_block(i) for i in integers.tolist()],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import unittest
+
+from fake_dfhack_rpc import SyntheticDFMap, FakeDFHackRPC
+from live_sync import LiveSync
+
+BLOCK_SIZE = (5, 3, 4)
+
+
+class CountingRPC(FakeDFHackRPC):
+
+    def __init__(self, synthetic_map):
+        super().__init__(synthetic_map)
+        self.requests = 0
+
+    def call_method_dict(self, name, input_dict=None):
+        if name == 'GetBlockList':
+            self.requests += 1
+        return super().call_method_dict(name, input_dict)
+
+
+class TestPollDFBlocks(unittest.TestCase):
+
+    def setUp(self):
+        self.rpc = CountingRPC(SyntheticDFMap(*BLOCK_SIZE))
+        self.all_positions = sorted((x, y, z) for x in range(BLOCK_SIZE[0]) for y in range(BLOCK_SIZE[1])
+                                    for z in range(BLOCK_SIZE[2]))
+
+    def poll(self, live_sync):
+        return sorted((b['mapX'] // 16, b['mapY'] // 16, b['mapZ']) for b in live_sync.poll_df_blocks())
+
+    def test_column_requests(self):
+        live_sync = LiveSync(self.rpc, None, (0, 0, 0), BLOCK_SIZE)
+        self.assertEqual(self.poll(live_sync), self.all_positions)
+        self.assertEqual(self.rpc.requests, BLOCK_SIZE[0] * BLOCK_SIZE[1])
+
+        # unchanged blocks are not returned again
+        self.assertEqual(self.poll(live_sync), [])
+
+    def test_batch(self):
+        live_sync = LiveSync(self.rpc, None, (0, 0, 0), BLOCK_SIZE, batch_size=(2, 2))
+        self.assertEqual(self.poll(live_sync), self.all_positions)
+        self.assertEqual(self.rpc.requests, 3 * 2)
+
+    def test_window(self):
+        live_sync = LiveSync(self.rpc, None, (0, 0, 0), BLOCK_SIZE, batch_size=(2, 1), window=4)
+
+        # 9 batches, whole map is polled in 3 cycles and window continues from start
+        polled = []
+        for _ in range(3):
+            requests = self.rpc.requests
+            polled += self.poll(live_sync)
+            self.assertEqual(self.rpc.requests - requests, 4)
+        self.assertEqual(sorted(polled), self.all_positions)
+        self.assertEqual(live_sync.next_batch, 12 % 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import numpy as np
+
+from minetest_world import MinetestWorld, ContentRegistry
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def encode_map_block_v29(nodes, palette, lighting_complete=0xffff):
+    """
+    Map block in format of Minetest 5.5+, name-id mappings are palette indexes of used content ids.
+    """
+    used_ids = np.unique(nodes['content_id'])
+    mapping_ids = np.zeros(len(palette), dtype=np.uint16)
+    mapping_ids[used_ids] = np.arange(used_ids.size)
+
+    # u8 flags, u16 lighting_complete, u32 timestamp, u8 name-id-mapping version, u16 num_name_id_mappings
+    data = struct.pack('>BHIBH', 0, lighting_complete, 0xffffffff, 0, used_ids.size)
+    for mapping_id, content_id in enumerate(used_ids):
+        name = palette[content_id].encode('utf-8')
+        data += struct.pack('>HH', mapping_id, len(name)) + name
+
+    # u8 content_width, u8 params_width, node data
+    data += struct.pack('>BB', 2, 2)
+    data += mapping_ids[nodes['content_id']].astype('>u2').tobytes() + \
+        nodes['param1'].astype(np.uint8).tobytes() + nodes['param2'].astype(np.uint8).tobytes()
+
+    # node metadata version, static object version, u16 static_object_count, node timers
+    data += struct.pack('>BBHBH', 0, 0, 0, 10, 0)
+
+    return struct.pack('>B', 29) + zstandard.ZstdCompressor().compress(data)
+
+
+class TestMapBlockRoundTrip(unittest.TestCase):
+    PALETTE = [None, 'air', 'default:stone', 'dwarftest:granite', 'dwarftest:water_source', 'dwarftest:magma_source']
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.mw = MinetestWorld(os.path.join(self.tmp_path, 'world'))
+        self.rng = np.random.RandomState(0)
+
+    def tearDown(self):
+        self.mw.close_sql_connections()
+        shutil.rmtree(self.tmp_path)
+
+    def make_nodes(self, content_ids):
+        nodes = np.zeros(4096, dtype=MinetestWorld.BLOCK_NUMPY_DTYPE)
+        nodes['content_id'] = self.rng.choice(content_ids, 4096)
+        nodes['param1'] = self.rng.randint(0, 256, 4096)
+        nodes['param2'] = self.rng.randint(0, 256, 4096)
+        return nodes
+
+    def make_blocks(self):
+        """
+        :return: dict, key: (x, y, z), value: nodes with content ids of self.PALETTE
+        """
+        blocks = {}
+        for x in range(-2, 2):
+            for y in range(-1, 2):
+                for z in range(-2, 3):
+                    if (x + y + z) % 2:
+                        blocks[(x, y, z)] = self.make_nodes([1 + (x + y + z) % 5])  # uniform
+                    else:
+                        blocks[(x, y, z)] = self.make_nodes(self.rng.choice(range(1, 6), 3, replace=False))
+        blocks[(-2, -1, -2)] = self.make_nodes(range(1, 6))
+        return blocks
+
+    def check_blocks(self, blocks, bbox):
+        (min_x, min_y, min_z), (max_x, max_y, max_z) = bbox
+        expected = sorted(pos for pos in blocks
+                          if min_x <= pos[0] <= max_x and min_y <= pos[1] <= max_y and min_z <= pos[2] <= max_z)
+
+        read = list(self.mw.iter_blocks(bbox))
+        self.assertEqual(sorted(pos for pos, _, _ in read), expected)
+
+        for pos, nodes, names in read:
+            original = blocks[pos]
+            self.assertEqual(
+                np.array(names, dtype=object)[nodes['content_id']].tolist(),
+                np.array(self.PALETTE, dtype=object)[original['content_id']].tolist(),
+            )
+            np.testing.assert_array_equal(nodes['param1'], original['param1'])
+            np.testing.assert_array_equal(nodes['param2'], original['param2'])
+
+    def round_trip(self, encode, version):
+        blocks = self.make_blocks()
+        rows = [pos + (encode(nodes), ) for pos, nodes in blocks.items()]
+        self.assertEqual({row[3][0] for row in rows}, {version})
+        self.mw.write_blocks(rows)
+        self.mw.commit_sql_connections()
+
+        self.check_blocks(blocks, ((-2, -1, -2), (1, 1, 2)))
+        self.check_blocks(blocks, ((-1, 0, -1), (0, 1, 2)))
+        self.check_blocks(blocks, ((-2, -1, 1), (-2, -1, 1)))
+        self.check_blocks(blocks, ((1, -1, -2), (5, 5, 5)))
+        self.assertEqual(list(self.mw.iter_blocks(((2, 2, 3), (4, 4, 4)))), [])
+
+        # single block reads, ids of content registry
+        nodes = self.mw.read_block_nodes(-2, -1, -2)
+        self.assertEqual([self.mw.content_registry.get_name(i) for i in nodes['content_id']],
+                         [self.PALETTE[i] for i in blocks[(-2, -1, -2)]['content_id']])
+        self.assertIsNone(self.mw.read_block(5, 5, 5))
+
+    def test_version_28(self):
+        self.round_trip(lambda nodes: self.mw.build_map_block(nodes, self.PALETTE, lighting_complete=0xffff), 28)
+
+    def test_version_28_cached(self):
+        self.mw.content_registry = ContentRegistry(self.PALETTE)
+        self.round_trip(lambda nodes: self.mw.build_map_block(nodes, lighting_complete=0xffff), 28)
+
+    @unittest.skipIf(zstandard is None, 'zstandard package is not installed')
+    def test_version_29(self):
+        self.round_trip(lambda nodes: encode_map_block_v29(nodes, self.PALETTE), 29)
+
+
+class TestMapBlockCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.mw = MinetestWorld(os.path.join(self.tmp_path, 'world'))
+        self.mw.content_registry = ContentRegistry(TestMapBlockRoundTrip.PALETTE)
+        self.mw.MAP_BLOCK_CACHE_SIZE = 3
+        self.mw.MAP_BLOCK_UNIFORM_CACHE_SIZE = 2
+
+    def tearDown(self):
+        self.mw.close_sql_connections()
+        shutil.rmtree(self.tmp_path)
+
+    def test_bounded_lru(self):
+        uniform = []
+        for light in range(4):
+            nodes = np.zeros(4096, dtype=MinetestWorld.BLOCK_NUMPY_DTYPE)
+            nodes['content_id'] = 1
+            nodes['param1'] = light
+            uniform.append(nodes)
+        mixed = []
+        for i in range(5):
+            nodes = np.zeros(4096, dtype=MinetestWorld.BLOCK_NUMPY_DTYPE)
+            nodes['content_id'] = 2
+            nodes['content_id'][i] = 3
+            mixed.append(nodes)
+
+        blocks = [self.mw.build_map_block(nodes) for nodes in uniform + mixed]
+        self.assertEqual(len(self.mw.map_block_uniform_cache), 2)
+        self.assertEqual(len(self.mw.map_block_cache), 3)
+
+        # least recently used blocks are evicted, recently used are kept
+        self.mw.build_map_block(uniform[2])
+        self.mw.build_map_block(mixed[2])
+        self.assertEqual(self.mw.map_block_cache_stats, {'uniform_hits': 1, 'hits': 1, 'misses': 9})
+        self.assertEqual(self.mw.build_map_block(uniform[0]), blocks[0])
+        self.assertEqual(self.mw.build_map_block(mixed[0]), blocks[4])
+        self.assertEqual(self.mw.map_block_cache_stats['misses'], 11)
+        self.assertIn((int(uniform[2].view(np.uint32)[0]), 0), self.mw.map_block_uniform_cache)
+        self.assertNotIn((int(uniform[3].view(np.uint32)[0]), 0), self.mw.map_block_uniform_cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
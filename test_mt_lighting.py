@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import mt_lighting
+from minetest_world import MinetestWorld
+from dwarftest_transformer import DwarftestTransformer
+
+MARGIN = mt_lighting.LIGHT_SPREAD_MARGIN
+AREA = 16 + 2 * MARGIN
+LAVA_LIGHT = mt_lighting.LIGHT_MAX - 1
+
+AIR = mt_lighting.LIGHT_CLASS_PROPAGATES | mt_lighting.LIGHT_CLASS_SUNLIGHT_PROPAGATES
+STONE = 0
+LAVA = mt_lighting.LIGHT_CLASS_PROPAGATES | LAVA_LIGHT
+
+
+def covered_heightmap():
+    """
+    :return: (heightmap, known) of columns covered high above block at origin_y 0
+    """
+    return np.full((AREA, AREA), 1000, dtype=np.int32), np.ones((AREA, AREA), dtype=bool)
+
+
+def split_banks(param1):
+    return param1 & 0x0f, param1 >> 4
+
+
+class TestComputeBlockLight(unittest.TestCase):
+
+    def test_lava_in_dark_cavern(self):
+        light_classes = np.full((AREA, AREA, AREA), STONE, dtype=np.uint8)
+        light_classes[MARGIN + 2:MARGIN + 14, MARGIN + 2:MARGIN + 14, MARGIN + 2:MARGIN + 14] = AIR
+        light_classes[MARGIN + 8, MARGIN + 3, MARGIN + 8] = LAVA
+
+        day, night = split_banks(mt_lighting.compute_block_light(light_classes, 0, *covered_heightmap()))
+
+        np.testing.assert_array_equal(day, night)
+        self.assertEqual(night[8, 3, 8], LAVA_LIGHT)
+        self.assertEqual(night[8, 4, 8], LAVA_LIGHT - 1)
+        self.assertEqual(night[8, 3, 12], LAVA_LIGHT - 4)
+        self.assertEqual(night[0, 0, 0], 0)  # stone
+
+    def test_sunlight(self):
+        light_classes = np.full((AREA, AREA, AREA), AIR, dtype=np.uint8)
+        heightmap = np.full((AREA, AREA), mt_lighting.HEIGHTMAP_NONE, dtype=np.int32)
+
+        day, night = split_banks(mt_lighting.compute_block_light(
+            light_classes, 0, heightmap, np.ones(heightmap.shape, dtype=bool)))
+
+        self.assertTrue((day == mt_lighting.LIGHT_SUN).all())
+        self.assertTrue((night == 0).all())
+
+    def test_source_in_neighbouring_block(self):
+        # lava in neighbouring block 3 nodes behind X+ border, air between
+        light_classes = np.full((AREA, AREA, AREA), STONE, dtype=np.uint8)
+        light_classes[MARGIN:MARGIN + 16, MARGIN:MARGIN + 16, MARGIN:] = AIR
+        light_classes[MARGIN + 5, MARGIN + 5, MARGIN + 16 + 2] = LAVA
+
+        day, night = split_banks(mt_lighting.compute_block_light(light_classes, 0, *covered_heightmap()))
+
+        np.testing.assert_array_equal(day, night)
+        self.assertEqual(night[5, 5, 15], LAVA_LIGHT - 3)
+        self.assertEqual(night[5, 5, 10], LAVA_LIGHT - 8)
+
+        # neighbour that does not pass light
+        light_classes[:, :, MARGIN + 16:MARGIN + 16 + 2] = STONE
+        param1 = mt_lighting.compute_block_light(light_classes, 0, *covered_heightmap())
+        self.assertTrue((param1 == 0).all())
+
+
+class TestTransformerLight(unittest.TestCase):
+    BLOCK_POS = (0, 0, 0)
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.mw = MinetestWorld(os.path.join(self.tmp_path, 'world'))
+        self.dt = DwarftestTransformer(self.mw, compute_lighting=True)
+
+        for x in range(-1, 2):
+            for z in range(-1, 2):
+                self.dt.mt_heightmaps[(x, z)] = np.full((16, 16), 1000, dtype=np.int32)
+
+    def tearDown(self):
+        self.mw.close_sql_connections()
+        shutil.rmtree(self.tmp_path)
+
+    def make_nodes(self, lava=()):
+        nodes = np.zeros(4096, dtype=MinetestWorld.BLOCK_NUMPY_DTYPE)
+        content_ids = nodes['content_id'].reshape(16, 16, 16)
+        content_ids[:] = self.dt.mt_air_id
+        for z, y, x in lava:
+            content_ids[z, y, x] = self.dt.mt_lava_id
+        return nodes
+
+    def add_block(self, mt_block_pos, nodes):
+        self.dt.mt_blocks[mt_block_pos] = nodes
+        self.dt.mt_blocks_fill[mt_block_pos] = 0
+        self.dt.add_mt_block_fill(mt_block_pos, nodes.size)
+
+    def test_source_near_unknown_neighbour(self):
+        nodes = self.make_nodes(lava=[(5, 5, 14)])
+        lighting_complete = self.dt.light_mt_block(self.BLOCK_POS, nodes)
+
+        # neighbours are not known, day and night bits are unset in directions of borders near source
+        for direction, day_bit in mt_lighting.LIGHTING_COMPLETE_DAY_BITS.items():
+            bits = day_bit | day_bit << 6
+            if direction in [(1, 0, 0), (0, -1, 0), (0, 0, -1)]:
+                self.assertEqual(lighting_complete & bits, 0, direction)
+            else:
+                self.assertEqual(lighting_complete & bits, bits, direction)
+
+        day, night = split_banks(nodes['param1'].reshape(16, 16, 16))
+        np.testing.assert_array_equal(day, night)
+        self.assertEqual(night[5, 5, 14], LAVA_LIGHT)
+
+        # block without sources does not depend on unknown neighbours
+        self.assertEqual(self.dt.light_mt_block(self.BLOCK_POS, self.make_nodes()), mt_lighting.LIGHTING_COMPLETE)
+
+    def test_source_in_known_neighbour(self):
+        self.add_block((1, 0, 0), self.make_nodes(lava=[(5, 5, 1)]))
+        nodes = self.make_nodes()
+        self.add_block(self.BLOCK_POS, nodes)
+
+        self.dt.dump_mt_blocks()
+
+        nodes = self.mw.read_block_nodes(*self.BLOCK_POS)
+        day, night = split_banks(nodes['param1'].reshape(16, 16, 16))
+        np.testing.assert_array_equal(day, night)
+        self.assertEqual(night[5, 5, 15], LAVA_LIGHT - 2)
+
+        # u8 version, u8 flags, u16 lighting_complete
+        data = self.mw.read_block_data(*self.BLOCK_POS)
+        self.assertEqual(int.from_bytes(data[2:4], 'big'), mt_lighting.LIGHTING_COMPLETE)
+        data = self.mw.read_block_data(1, 0, 0)
+        x_plus = mt_lighting.LIGHTING_COMPLETE_DAY_BITS[(1, 0, 0)]
+        self.assertEqual(int.from_bytes(data[2:4], 'big') & x_plus, x_plus)
+        self.assertNotEqual(int.from_bytes(data[2:4], 'big'), mt_lighting.LIGHTING_COMPLETE)
+
+
+if __name__ == '__main__':
+    unittest.main()
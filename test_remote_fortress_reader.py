@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import unittest
+
+from fake_dfhack_rpc import SyntheticDFMap, FakeDFHackRPC
+from remote_fortress_reader import get_block_list, get_map_blocks
+
+
+class RecordingRPC(object):
+    """
+    Records calls made by get_block_list(), answers like DFHackRPC with empty BlockList.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def call_method_dict(self, name, input_dict=None):
+        self.calls.append(('call_method_dict', name, input_dict))
+        return {'mapX': 0, 'mapY': 0}, None
+
+    def call_method(self, name, input_msg=None):
+        self.calls.append(('call_method', name, input_msg))
+        return None, None
+
+
+class TestGetBlockList(unittest.TestCase):
+
+    def test_dict_request_by_default(self):
+        rpc = RecordingRPC()
+        block_list = get_block_list(rpc, 1, 2, 3, 4, 5, 6)
+
+        # same input dict as converter always sent to DFHackRPC
+        self.assertEqual(rpc.calls, [('call_method_dict', 'GetBlockList', {
+            'minX': 1, 'maxX': 2, 'minY': 3, 'maxY': 4, 'minZ': 5, 'maxZ': 6,
+        })])
+        self.assertEqual(list(get_map_blocks(block_list)), [])
+
+    def test_message_request(self):
+        rpc = RecordingRPC()
+        get_block_list(rpc, 1, 2, 3, 4, 5, 6, request_message=True)
+
+        (method, name, request), = rpc.calls
+        self.assertEqual((method, name), ('call_method', 'GetBlockList'))
+        self.assertEqual((request.min_x, request.max_x, request.min_y, request.max_y, request.min_z, request.max_z),
+                         (1, 2, 3, 4, 5, 6))
+
+    def test_same_blocks(self):
+        synthetic_map = SyntheticDFMap(2, 2, 4)
+        rpc_dict, rpc_message = FakeDFHackRPC(synthetic_map), FakeDFHackRPC(synthetic_map)
+
+        for x in range(2):
+            for y in range(2):
+                dict_blocks = get_map_blocks(get_block_list(rpc_dict, x, x + 1, y, y + 1, 0, 4))
+                message_blocks = get_map_blocks(get_block_list(rpc_message, x, x + 1, y, y + 1, 0, 4,
+                                                               request_message=True))
+                self.assertEqual(len(dict_blocks), 4)
+                self.assertEqual([(b['mapX'], b['mapY'], b['mapZ']) for b in dict_blocks],
+                                 [(b.map_x, b.map_y, b.map_z) for b in message_blocks])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import os
+import hashlib
+import time
+import logging
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image  # optional, needed only for baking of textures
+except ImportError:
+    Image = None
+
+_logger = logging.getLogger(__name__)
+
+
+def read_png(path):
+    """
+    :return: numpy uint8 array of RGBA pixels indexed by [y, x]
+    """
+    with Image.open(path) as img:
+        return np.asarray(img.convert('RGBA'), dtype=np.uint8).copy()
+
+
+def write_png(path, rgba):
+    """
+    :param rgba: numpy uint8 array of RGBA pixels indexed by [y, x]
+    """
+    Image.fromarray(rgba, 'RGBA').save(path, format='PNG', compress_level=9)
+
+
+def colorize(rgba, colors, alpha):
+    """
+    Same as [colorize:#rrggbbaa texture modifier of Minetest, template is blended with colors by alpha and keeps
+    its own alpha.
+
+    :param rgba: numpy uint8 array of template pixels, shape (h, w, 4)
+    :param colors: numpy array of RGB colors, shape (n, 3)
+    :return: numpy uint8 array of colorized textures, shape (n, h, w, 4)
+    """
+    ratio = alpha / 255.0
+    colors = np.asarray(colors, dtype=np.float32)[:, None, None, :]
+
+    result = np.empty((len(colors), ) + rgba.shape, dtype=np.uint8)
+    result[..., :3] = np.clip(np.rint(rgba[None, ..., :3] * (1.0 - ratio) + colors * ratio), 0, 255)
+    result[..., 3] = rgba[None, ..., 3]
+    return result
+
+
+class TextureBaker(object):
+    """
+    Bakes node textures of materials (template colorized by material color) into PNG files, so that clients do not
+    evaluate texture modifiers of thousands of nodes.
+
+    Baked textures are content addressed by template and color, materials of same color share one texture and
+    files that already exist (e.g. from previous build of same world) are not baked again.
+    """
+    BAKED_TEXTURE_PREFIX = 'dwarftest_baked_'
+    VERSION = 1  # part of texture key, has to be changed with every change of baking
+
+    def __init__(self, textures_path, workers=4, colorize_alpha=0x80):
+        """
+        :param textures_path: directory with templates, baked textures are written into it
+        :param workers: number of threads writing PNG files
+        """
+        if Image is None:
+            raise Exception('Textures can not be baked, Pillow package is not installed')
+
+        self.textures_path = textures_path
+        self.workers = workers
+        self.colorize_alpha = colorize_alpha
+
+        self.template_digests = {}  # key: template name
+        self.textures = {}  # key: (template name, color), value: texture name
+        self.pending = {}  # key: template name, value: dict of color: texture name of textures to bake
+        self.stats = {'textures': 0, 'baked': 0, 'cached': 0, 'seconds': 0.0}
+
+    def get_template_digest(self, template):
+        digest = self.template_digests.get(template)
+        if digest is None:
+            with open(os.path.join(self.textures_path, template), 'rb') as f:
+                digest = self.template_digests[template] = hashlib.sha1(f.read()).hexdigest()
+        return digest
+
+    def get_texture_name(self, template, color):
+        """
+        Texture is baked by bake().
+
+        :param template: file name of template texture
+        :param color: (red, green, blue)
+        :return: file name of baked texture
+        """
+        color = tuple(int(c) for c in color)
+        texture = self.textures.get((template, color))
+        if texture is not None:
+            return texture
+
+        key = '{};{};{:02x}{:02x}{:02x}{:02x}'.format(
+            self.VERSION, self.get_template_digest(template), color[0], color[1], color[2], self.colorize_alpha)
+        texture = self.textures[(template, color)] = '{}{}.png'.format(
+            self.BAKED_TEXTURE_PREFIX, hashlib.sha1(key.encode('ascii')).hexdigest()[:20])
+        self.stats['textures'] += 1
+
+        if os.path.exists(os.path.join(self.textures_path, texture)):
+            self.stats['cached'] += 1
+        else:
+            self.pending.setdefault(template, {})[color] = texture
+
+        return texture
+
+    def bake(self):
+        """
+        Bakes all textures returned by get_texture_name() that do not exist yet.
+
+        :return: stats dict
+        """
+        start = time.perf_counter()
+
+        def write(texture, rgba):
+            tmp_path = os.path.join(self.textures_path, texture + '.tmp')
+            write_png(tmp_path, rgba)
+            os.replace(tmp_path, os.path.join(self.textures_path, texture))  # no partial files in cache
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            futures = []
+            for template, textures in self.pending.items():
+                colors = list(textures.keys())
+                baked = colorize(read_png(os.path.join(self.textures_path, template)), colors, self.colorize_alpha)
+                for color, rgba in zip(colors, baked):
+                    futures.append(executor.submit(write, textures[color], rgba))
+
+            for future in futures:
+                future.result()
+
+        self.stats['baked'] += len(futures)
+        self.stats['seconds'] += time.perf_counter() - start
+        self.pending = {}
+
+        _logger.debug('Baked {} textures, {} were cached'.format(len(futures), self.stats['cached']))
+        return dict(self.stats)
+
+    def remove_unused(self):
+        """
+        Removes baked textures that were not returned by get_texture_name(), e.g. of materials removed from map.
+
+        :return: number of removed textures
+        """
+        used = set(self.textures.values())
+        removed = 0
+        for name in os.listdir(self.textures_path):
+            if name.startswith(self.BAKED_TEXTURE_PREFIX) and name not in used:
+                os.remove(os.path.join(self.textures_path, name))
+                removed += 1
+        return removed
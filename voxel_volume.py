@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import os
+import json
+import logging
+import numpy as np
+
+from minetest_world import ContentRegistry
+
+_logger = logging.getLogger(__name__)
+
+
+class VoxelVolume(object):
+    """
+    Dense volume of MT content ids of whole converted DF map, kept in world directory as .npy file mapped into
+    memory. DF blocks are written into it in any order and MT blocks are emitted from it afterwards, so volume
+    can be used again (lighting, previews, re-emitting MT blocks) without fetching DF blocks from DFHack.
+
+    Volume is aligned to MT blocks and indexed by [MT z, MT y, MT x] like nodes of MT blocks, nodes outside
+    of DF map stay ContentRegistry.UNSET_ID. Content ids are ids of content names stored in info file.
+    """
+    FILENAME = 'dwarftest_volume.npy'
+    INFO_FILENAME = 'dwarftest_volume.json'
+    VERSION = 1
+
+    def __init__(self, world_path, first_block, block_count, block_node_size=(16, 16, 16), mode='r'):
+        """
+        :param first_block: (x, y, z) position of first MT block of volume
+        :param block_count: (x, y, z) number of MT blocks of volume
+        :param mode: 'w+' creates new volume, 'r' and 'r+' open existing volume
+        """
+        self.path = os.path.join(world_path, self.FILENAME)
+        self.info_path = os.path.join(world_path, self.INFO_FILENAME)
+        self.first_block = tuple(int(v) for v in first_block)
+        self.block_count = tuple(int(v) for v in block_count)
+        self.block_node_size = tuple(int(v) for v in block_node_size)
+        self.first_node = tuple(self.first_block[i] * self.block_node_size[i] for i in range(3))
+
+        shape = tuple(self.block_count[i] * self.block_node_size[i] for i in (2, 1, 0))
+        if mode == 'w+':
+            # new file is sparse and filled with zeros, which is UNSET_ID
+            self.data = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.uint16, shape=shape)
+        else:
+            self.data = np.load(self.path, mmap_mode=mode)
+            if self.data.shape != shape or self.data.dtype != np.uint16:
+                raise Exception('Voxel volume {} does not match its info file'.format(self.path))
+
+        self.info = {
+            'version': self.VERSION,
+            'first_block': self.first_block,
+            'block_count': self.block_count,
+            'block_node_size': self.block_node_size,
+            'complete': False,
+        }
+
+    @classmethod
+    def create(cls, world_path, coordinates, region_pos, block_size):
+        """
+        Creates volume covering all MT blocks with nodes of DF map, removes previous volume.
+
+        :param coordinates: CoordinateMapper of conversion
+        :param block_size: (x, y, z) size of DF map in DF blocks, see map_info of DFHack
+        """
+        first_block, block_count = cls.get_df_map_blocks(coordinates, region_pos, block_size)
+
+        info_path = os.path.join(world_path, cls.INFO_FILENAME)
+        if os.path.exists(info_path):
+            os.remove(info_path)
+
+        volume = cls(world_path, first_block, block_count, block_node_size=coordinates.mt_block_node_size,
+                     mode='w+')
+        _logger.debug('Created voxel volume of {} MT blocks ({:.1f} MiB)'.format(
+            volume.block_count, volume.data.nbytes / 1024**2))
+        return volume
+
+    @classmethod
+    def open(cls, world_path, mode='r'):
+        """
+        Opens volume written by previous conversion.
+        """
+        info_path = os.path.join(world_path, cls.INFO_FILENAME)
+        if not os.path.exists(info_path):
+            raise Exception('Could not find voxel volume in {}, run conversion with --voxel_volume'.format(
+                world_path))
+
+        with open(info_path) as f:
+            info = json.load(f)
+        if info.get('version') != cls.VERSION or not info.get('complete'):
+            raise Exception('Voxel volume in {} is outdated or was not completed'.format(world_path))
+
+        volume = cls(world_path, info['first_block'], info['block_count'],
+                     block_node_size=info['block_node_size'], mode=mode)
+        volume.info = info
+        return volume
+
+    @staticmethod
+    def get_df_map_blocks(coordinates, region_pos, block_size):
+        """
+        :return: (position of first MT block, number of MT blocks) covering DF map
+        """
+        bs = coordinates.mt_block_node_size
+        tile_size = (block_size[0] * coordinates.df_block_tile_size[0],
+                     block_size[1] * coordinates.df_block_tile_size[1],
+                     block_size[2])
+
+        first_node = coordinates.df2mt_pos(region_pos, (0, 0, 0))
+        end_node = coordinates.df2mt_pos(region_pos, tile_size)  # first node after DF map
+
+        first_block = first_node // bs
+        end_block = -(-end_node // bs)
+        return tuple(int(v) for v in first_block), tuple(int(v) for v in end_block - first_block)
+
+    def set_nodes(self, mt_pos, content_ids):
+        """
+        :param mt_pos: MT position (x, y, z) of first node of box
+        :param content_ids: numpy array of content ids with shape (size_z, size_y, size_x)
+        """
+        start = [int(mt_pos[i]) - self.first_node[i] for i in range(3)]
+        end = [start[i] + content_ids.shape[2 - i] for i in range(3)]
+
+        if min(start) < 0 or any(end[i] > self.data.shape[2 - i] for i in range(3)):
+            raise Exception('Box of nodes at {} is outside of voxel volume'.format(tuple(mt_pos)))
+
+        self.data[start[2]:end[2], start[1]:end[1], start[0]:end[0]] = content_ids
+
+    def iter_block_slabs(self):
+        """
+        Reads volume sequentially, one layer of MT blocks with same z at a time.
+
+        :return: generator of (MT block z, content ids of MT blocks in layer indexed by
+            [block y, block x, node z, node y, node x])
+        """
+        bs = self.block_node_size
+        for i in range(self.block_count[2]):
+            slab = np.array(self.data[i * bs[2]:(i + 1) * bs[2]])
+            slab = slab.reshape(bs[2], self.block_count[1], bs[1], self.block_count[0], bs[0])
+            yield self.first_block[2] + i, slab.transpose(1, 3, 0, 2, 4)
+
+    def check_config(self, config):
+        """
+        :param config: JSON serializable dict used by finish()
+        :return: True if volume was converted with same config
+        """
+        return json.dumps(self.info.get('config'), sort_keys=True) == json.dumps(config, sort_keys=True)
+
+    def finish(self, content_names, materials, config):
+        """
+        Writes volume to disk and marks it complete, only complete volume can be opened again.
+
+        :param content_names: list of content names indexed by content ids used in volume
+        :param materials: list of material dicts of transformer, tile material variants are not known without
+            parsing DF blocks again
+        :param config: JSON serializable dict (block scale, offsets, ...) of conversion
+        """
+        self.data.flush()
+        self.info['content_names'] = list(content_names)
+        self.info['materials'] = materials
+        self.info['config'] = config
+        self.info['complete'] = True
+
+        with open(self.info_path, 'w') as f:
+            json.dump(self.info, f)
+
+    def get_content_id_map(self, content_registry):
+        """
+        :return: numpy array mapping content ids of volume to ids of content_registry, None if ids are same
+        """
+        names = self.info.get('content_names')
+        if names is None or names == content_registry.names[:len(names)]:
+            return None
+
+        content_id_map = np.zeros((ContentRegistry.MAX_ID + 1, ), dtype=np.uint16)
+        for content_id, name in enumerate(names):
+            if content_id != ContentRegistry.UNSET_ID:
+                content_id_map[content_id] = content_registry.get_id(name)
+        return content_id_map
+
+    def close(self):
+        if self.data.mode != 'r':
+            self.data.flush()
+        self.data = None